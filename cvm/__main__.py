@@ -27,11 +27,12 @@ from cvm.controllers import (GuestNetHandler, PowerStateHandler, UpdateHandler,
 from cvm.database import Database
 from cvm.event_listener import EventListener
 from cvm.models import VlanIdPool
-from cvm.monitors import VMwareMonitor
+from cvm.monitors import VMwareMonitor, VmRemovalMonitor
 from cvm.sandesh_handler import SandeshHandler
 from cvm.services import (VirtualMachineInterfaceService,
                           VirtualMachineService, VirtualNetworkService,
-                          VRouterPortService, VlanIdService)
+                          VRouterPortService, VlanIdService,
+                          VmRemovalService, OrderedPool)
 from cvm.supervisor import Supervisor
 
 gevent.monkey.patch_all()
@@ -67,11 +68,17 @@ def build_context(config):
 
     vlan_id_pool = VlanIdPool(const.VLAN_ID_RANGE_START, const.VLAN_ID_RANGE_END)
 
+    shared_property_filter = esxi_cfg.get('shared_property_filter', False)
+
+    vnc_workers = OrderedPool(vnc_cfg.get('workers', const.VNC_WORKER_POOL_SIZE))
+
     vm_service = VirtualMachineService(
         esxi_api_client=esxi_api_client,
         vcenter_api_client=vcenter_api_client,
         vnc_api_client=vnc_api_client,
-        database=database
+        database=database,
+        shared_property_filter=shared_property_filter,
+        vnc_workers=vnc_workers
     )
 
     vn_service = VirtualNetworkService(
@@ -85,7 +92,8 @@ def build_context(config):
         vnc_api_client=vnc_api_client,
         database=database,
         esxi_api_client=esxi_api_client,
-        vlan_id_pool=vlan_id_pool
+        vlan_id_pool=vlan_id_pool,
+        vnc_workers=vnc_workers
     )
     vrouter_port_service = VRouterPortService(
         vrouter_api_client=VRouterAPIClient(),
@@ -95,7 +103,15 @@ def build_context(config):
         vcenter_api_client=vcenter_api_client,
         esxi_api_client=esxi_api_client,
         vlan_id_pool=vlan_id_pool,
-        database=database
+        database=database,
+        wait_in_background=True
+    )
+    vm_removal_service = VmRemovalService(
+        vcenter_api_client=vcenter_api_client,
+        esxi_api_client=esxi_api_client,
+        vnc_api_client=vnc_api_client,
+        database=database,
+        vlan_id_pool=vlan_id_pool
     )
     vm_updated_handler = VmUpdatedHandler(vm_service, vn_service, vmi_service,
                                           vrouter_port_service, vlan_id_service)
@@ -108,7 +124,11 @@ def build_context(config):
     guest_net_handler = GuestNetHandler(vmi_service, vrouter_port_service)
     vmware_tools_status_handler = VmwareToolsStatusHandler(vm_service)
     power_state_handler = PowerStateHandler(vm_service, vrouter_port_service, vlan_id_service)
+    # Handlers are synchronized in this order after each batch of updates.
+    # Power state changes go first, so that VLANs of powered on VMs are set
+    # and not assigned anew by other handlers.
     handlers = [
+        power_state_handler,
         vm_updated_handler,
         vm_renamed_handler,
         vm_reconfigured_handler,
@@ -116,25 +136,28 @@ def build_context(config):
         vm_registered_handler,
         guest_net_handler,
         vmware_tools_status_handler,
-        power_state_handler,
     ]
     update_handler = UpdateHandler(handlers)
     vmware_controller = VmwareController(vm_service, vn_service,
                                          vmi_service, vrouter_port_service,
-                                         vlan_id_service, update_handler, lock)
+                                         vlan_id_service, update_handler, lock,
+                                         vm_removal_service=vm_removal_service,
+                                         database=database)
     vmware_monitor = VMwareMonitor(vmware_controller, update_set_queue)
-    event_listener = EventListener(vmware_controller, update_set_queue, esxi_api_client, database)
+    vm_removal_monitor = VmRemovalMonitor(vmware_controller)
+    event_listener = EventListener(vmware_controller, update_set_queue, esxi_api_client, database,
+                                   shared_property_filter=shared_property_filter)
     supervisor = Supervisor(event_listener, esxi_api_client)
     context = {
-        'lock': lock,
         'database': database,
         'vmware_monitor': vmware_monitor,
+        'vm_removal_monitor': vm_removal_monitor,
         'supervisor': supervisor,
     }
     return context
 
 
-def run_introspect(cfg, database, lock):
+def run_introspect(cfg, database):
     sandesh_config = cfg['sandesh']
     sandesh_config['collectors'] = sandesh_config['collectors'].split()
     random.shuffle(sandesh_config['collectors'])
@@ -150,7 +173,7 @@ def run_introspect(cfg, database, lock):
     sandesh_config['node_type_name'] = NodeTypeNames[sandesh_config['node_type']]
 
     sandesh = Sandesh()
-    sandesh_handler = SandeshHandler(database, lock)
+    sandesh_handler = SandeshHandler(database)
     sandesh_handler.bind_handlers()
     config = SandeshConfig(http_server_ip=sandesh_config['http_server_ip'])
     sandesh.init_generator(
@@ -187,14 +210,15 @@ def run_introspect(cfg, database, lock):
 def main(args):
     cfg = load_config(args.config_file)
     context = build_context(cfg)
-    lock = context['lock']
     database = context['database']
     vmware_monitor = context['vmware_monitor']
+    vm_removal_monitor = context['vm_removal_monitor']
     supervisor = context['supervisor']
-    run_introspect(cfg, database, lock)
+    run_introspect(cfg, database)
     greenlets = [
         gevent.spawn(supervisor.supervise),
         gevent.spawn(vmware_monitor.monitor),
+        gevent.spawn(vm_removal_monitor.monitor),
     ]
     gevent.joinall(greenlets, raise_error=True)
 
@@ -2,6 +2,8 @@ from builtins import str
 from builtins import next
 from builtins import object
 import atexit
+import collections
+import functools
 import itertools
 import json
 import logging
@@ -10,6 +12,7 @@ import os
 import time
 from uuid import uuid4
 
+import gevent.lock
 import requests
 from pyVim.connect import Disconnect, SmartConnectNoSSL
 from pyVim.task import WaitForTask
@@ -21,7 +24,11 @@ from contrail_vrouter_api.vrouter_api import ContrailVRouterApi
 from cvm.constants import (ID_PERMS_CREATOR, VM_PROPERTY_FILTERS, VNC_ROOT_DOMAIN,
                            VNC_VCENTER_DEFAULT_SG, VNC_VCENTER_DEFAULT_SG_FQN,
                            VNC_VCENTER_IPAM, VNC_VCENTER_IPAM_FQN,
-                           VNC_VCENTER_PROJECT, HISTORY_COLLECTOR_PAGE_SIZE)
+                           VNC_VCENTER_PROJECT, HISTORY_COLLECTOR_PAGE_SIZE,
+                           PROPERTY_COLLECTOR_PAGE_SIZE, VM_SYNC_PROPERTY_FILTERS,
+                           VM_INVENTORY_PROPERTIES, INVENTORY_CACHE_TTL,
+                           VM_REMOVAL_PROPERTIES, VMFS, VNC_LIST_PAGE_SIZE,
+                           VNC_CACHE_MAX_SIZE, VNC_CACHE_REVISION_CHECK_INTERVAL)
 from cvm.models import find_vrouter_uuid
 
 logger = logging.getLogger(__name__)
@@ -31,23 +38,147 @@ class VSphereAPIClient(object):
     def __init__(self):
         self._si = None
         self._datacenter = None
+        self._vm_inventory = None
 
     def _get_object(self, vimtype, name):
+        if vimtype == [vim.VirtualMachine]:
+            return self._find_vm('name', name)
         content = self._si.content
         container = content.viewManager.CreateContainerView(content.rootFolder, vimtype, True)
         try:
-            return [obj for obj in container.view if obj.name == name][0]
-        except IndexError:
-            return None
+            return next((obj for obj in container.view if obj.name == name), None)
+        finally:
+            container.Destroy()
 
     def _get_vm_by_uuid(self, uuid):
-        content = self._si.content
-        container = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
         try:
-            return [vm for vm in container.view if vm.config.instanceUuid == uuid][0]
+            return self._find_vm_by_uuid_in_search_index(uuid)
+        except Exception as exc:
+            logger.error('Unable to find VM %s in SearchIndex due to: %s. Falling back to inventory scan', uuid, exc)
+        try:
+            return self._find_vm('config.instanceUuid', uuid)
+        except vim.fault.NotAuthenticated:
+            raise
         except Exception:
             return None
 
+    def _find_vm_by_uuid_in_search_index(self, uuid):
+        search_index = self._si.content.searchIndex
+        return search_index.FindByUuid(datacenter=None, uuid=uuid, vmSearch=True, instanceUuid=True)
+
+    def _find_vm(self, property_name, value):
+        vmware_vms = self._find_vms(property_name, value)
+        return vmware_vms[0] if vmware_vms else None
+
+    def _find_vms(self, property_name, value):
+        if self._vm_inventory is None or self._vm_inventory.is_expired():
+            if self._vm_inventory is not None:
+                self._vm_inventory.destroy()
+            self._vm_inventory = VmInventory(self._si.content)
+        try:
+            # Only changes since the last lookup are read
+            self._vm_inventory.refresh()
+        except Exception:
+            self._vm_inventory = None
+            raise
+        return self._vm_inventory.get_all(property_name, value)
+
+    def _read_properties(self, obj, filters):
+        filter_spec = make_filter_spec(obj, filters)
+        options = vmodl.query.PropertyCollector.RetrieveOptions()
+        property_collector = self._si.content.propertyCollector
+        result = property_collector.RetrievePropertiesEx([filter_spec], options=options)
+        if not result or not result.objects:
+            return {}
+        return {prop.name: prop.val for prop in result.objects[0].propSet}
+
+    def _read_all_properties(self, obj_type, filters):
+        content = self._si.content
+        container = content.viewManager.CreateContainerView(content.rootFolder, [obj_type], True)
+        try:
+            filter_spec = make_container_filter_spec(container, obj_type, filters)
+            options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=PROPERTY_COLLECTOR_PAGE_SIZE)
+            property_collector = content.propertyCollector
+            result = property_collector.RetrievePropertiesEx([filter_spec], options=options)
+            objects_properties = []
+            while result:
+                for object_content in result.objects:
+                    properties = {prop.name: prop.val for prop in object_content.propSet}
+                    objects_properties.append((object_content.obj, properties))
+                if not result.token:
+                    break
+                result = property_collector.ContinueRetrievePropertiesEx(result.token)
+            return objects_properties
+        finally:
+            container.Destroy()
+
+
+class VmInventory(object):
+    """ VMware VMs indexed by their inventory properties (name and instanceUuid).
+
+    The index is kept current with incremental updates of its own
+    PropertyCollector and is meant to be rebuilt from scratch after `ttl`.
+    """
+
+    def __init__(self, content, ttl=INVENTORY_CACHE_TTL):
+        self._expires_at = time.time() + ttl
+        self._property_collector = content.propertyCollector.CreatePropertyCollector()
+        self._container = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
+        filter_spec = make_container_filter_spec(self._container, vim.VirtualMachine, VM_INVENTORY_PROPERTIES)
+        self._property_collector.CreateFilter(filter_spec, partialUpdates=False)
+        self._wait_options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=0, maxObjectUpdates=PROPERTY_COLLECTOR_PAGE_SIZE)
+        self._version = ''
+        # Only one WaitForUpdatesEx call may be pending on a collector
+        self._lock = gevent.lock.BoundedSemaphore()
+        self._properties = {}
+        self._vms = {}
+
+    def refresh(self):
+        with self._lock:
+            while True:
+                update_set = self._property_collector.WaitForUpdatesEx(self._version, self._wait_options)
+                if update_set is None:
+                    return
+                self._version = update_set.version
+                for filter_update in update_set.filterSet:
+                    for object_update in filter_update.objectSet:
+                        self._apply(object_update)
+                if not update_set.truncated:
+                    return
+
+    def _apply(self, object_update):
+        vmware_vm = object_update.obj
+        properties = self._properties.pop(vmware_vm, {})
+        for property_name, value in properties.items():
+            vms = self._vms[property_name][value]
+            vms.remove(vmware_vm)
+            if not vms:
+                del self._vms[property_name][value]
+        if object_update.kind == 'leave':
+            return
+        for change in object_update.changeSet:
+            if change.op == 'remove':
+                properties.pop(change.name, None)
+            else:
+                properties[change.name] = change.val
+        self._properties[vmware_vm] = properties
+        for property_name, value in properties.items():
+            self._vms.setdefault(property_name, {}).setdefault(value, []).append(vmware_vm)
+
+    def get_all(self, property_name, value):
+        return list(self._vms.get(property_name, {}).get(value, []))
+
+    def is_expired(self):
+        return time.time() > self._expires_at
+
+    def destroy(self):
+        try:
+            self._property_collector.Destroy()
+            self._container.Destroy()
+        except Exception as exc:
+            logger.error('Unable to destroy VM inventory collector: %s', exc)
+
 
 class ESXiAPIClient(VSphereAPIClient):
     def __init__(self, esxi_cfg):
@@ -69,6 +200,8 @@ class ESXiAPIClient(VSphereAPIClient):
         self._property_collector = self._si.content.propertyCollector
         self._wait_options = vmodl.query.PropertyCollector.WaitOptions()
         self._version = ''
+        self._vms_view = None
+        self._vm_inventory = None
 
     def get_all_vms(self):
         return self._datacenter.vmFolder.childEntity
@@ -90,6 +223,16 @@ class ESXiAPIClient(VSphereAPIClient):
         filter_spec = make_filter_spec(obj, filters)
         return self._property_collector.CreateFilter(filter_spec, True)
 
+    def add_vms_filter(self, filters):
+        """ Add a single filter over a ContainerView of all VMs on the host. """
+        # The view has to outlive the filter, so it's kept until replaced
+        if self._vms_view is not None:
+            self._vms_view.Destroy()
+        content = self._si.content
+        self._vms_view = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
+        filter_spec = make_container_filter_spec(self._vms_view, vim.VirtualMachine, filters)
+        return self._property_collector.CreateFilter(filter_spec, True)
+
     def make_wait_options(self, max_wait_seconds=None, max_object_updates=None):
         if max_object_updates is not None:
             self._wait_options.maxObjectUpdates = max_object_updates
@@ -102,18 +245,44 @@ class ESXiAPIClient(VSphereAPIClient):
             self._version = update_set.version
         return update_set
 
+    def watch_property(self, obj, property_name, timeout):
+        """ Yields values of the property reported by PropertyCollector until the timeout expires. """
+        # A separate collector keeps these updates away from the event listener's one
+        property_collector = self._si.content.propertyCollector.CreatePropertyCollector()
+        try:
+            property_collector.CreateFilter(make_filter_spec(obj, [property_name]), True)
+            deadline = time.time() + timeout
+            version = ''
+            while True:
+                max_wait_seconds = int(deadline - time.time())
+                if max_wait_seconds <= 0:
+                    return
+                wait_options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=max_wait_seconds)
+                update_set = property_collector.WaitForUpdatesEx(version, wait_options)
+                if not update_set:
+                    return
+                version = update_set.version
+                for property_filter_update in update_set.filterSet:
+                    for object_update in property_filter_update.objectSet:
+                        for property_change in object_update.changeSet:
+                            if property_change.name == property_name:
+                                yield property_change.val
+        finally:
+            property_collector.DestroyPropertyCollector()
+
     def renew_connection(self):
         self._create_connection()
 
     def read_vm_properties(self, vmware_vm):
-        filter_spec = make_filter_spec(vmware_vm, VM_PROPERTY_FILTERS)
-        options = vmodl.query.PropertyCollector.RetrieveOptions()
-        object_set = self._property_collector.RetrievePropertiesEx([filter_spec], options=options).objects
-        prop_set = object_set[0].propSet
-        properties = {prop.name: prop.val for prop in prop_set}
+        properties = self._read_properties(vmware_vm, VM_PROPERTY_FILTERS)
         logger.info('Read from ESXi API %s properties: %s', vmware_vm.name, properties)
         return properties
 
+    def read_all_vms_properties(self):
+        vms_properties = self._read_all_properties(vim.VirtualMachine, VM_SYNC_PROPERTY_FILTERS)
+        logger.info('Read from ESXi API properties of %d VMs', len(vms_properties))
+        return vms_properties
+
     def read_vrouter_uuid(self):
         return find_vrouter_uuid(self._host)
 
@@ -143,16 +312,84 @@ def make_filter_spec(obj, filters):
     return filter_spec
 
 
+def make_container_filter_spec(container, obj_type, filters):
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traverseView',
+        path='view',
+        skip=False,
+        type=vim.view.ContainerView)
+    object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=container, skip=True, selectSet=[traversal_spec])
+    property_spec = vmodl.query.PropertyCollector.PropertySpec(type=obj_type, all=False)
+    property_spec.pathSet.extend(filters)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+    filter_spec.objectSet = [object_spec]
+    filter_spec.propSet = [property_spec]
+    return filter_spec
+
+
+def relogin_on_not_authenticated(func):
+    """ Retries the call once with a new vCenter session if the current one expired. """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        si = self._si
+        try:
+            return func(self, *args, **kwargs)
+        except vim.fault.NotAuthenticated:
+            logger.info('vCenter session expired. Logging in again...')
+            self._relogin(si)
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
 class VCenterAPIClient(VSphereAPIClient):
-    WAITING_TIMEOUT = 20
-    WAITING_SLEEP = 3
+    SESSION_CHECK_INTERVAL = 60
 
     def __init__(self, vcenter_cfg):
         super(VCenterAPIClient, self).__init__()
         self._vcenter_cfg = vcenter_cfg
         self._dvs = None
+        self._dv_ports = {}
+        self._depth = 0
+        self._session_checked_at = None
+        # Greenlets share the session, only one of them may replace it
+        self._session_lock = gevent.lock.RLock()
+        atexit.register(self._logout)
 
     def __enter__(self):
+        # The session outlives the context, so nested and subsequent
+        # `with` blocks reuse it as long as vCenter still accepts it
+        with self._session_lock:
+            if self._depth == 0 and not self._is_session_alive():
+                self._login()
+            self._depth += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if isinstance(exc_value, vim.fault.NotAuthenticated):
+            self._session_checked_at = None
+
+    def _is_session_alive(self):
+        if self._si is None:
+            return False
+        if self._session_checked_at is not None and \
+                time.time() - self._session_checked_at < self.SESSION_CHECK_INTERVAL:
+            return True
+        try:
+            alive = self._si.content.sessionManager.currentSession is not None
+        except Exception:
+            alive = False
+        if alive:
+            self._session_checked_at = time.time()
+        return alive
+
+    def _relogin(self, expired_si):
+        with self._session_lock:
+            # Another greenlet could have logged in again already
+            if self._si is expired_si:
+                self._login()
+
+    def _login(self):
+        self._logout()
         self._si = SmartConnectNoSSL(
             host=self._vcenter_cfg.get('host'),
             user=self._vcenter_cfg.get('username'),
@@ -160,35 +397,44 @@ class VCenterAPIClient(VSphereAPIClient):
             port=self._vcenter_cfg.get('port'),
             preferredApiVersions=self._vcenter_cfg.get('preferred_api_versions')
         )
+        self._session_checked_at = time.time()
+        self._vm_inventory = None
+        self._dv_ports = {}
         self._datacenter = self._get_datacenter(self._vcenter_cfg.get('datacenter'))
         self._dvs = self._get_dvswitch(self._vcenter_cfg.get('dvswitch'))
 
-    def __exit__(self, *args):
-        Disconnect(self._si)
+    def _logout(self):
+        if self._si is None:
+            return
+        try:
+            Disconnect(self._si)
+        except Exception:
+            pass
+        self._si = None
+        self._session_checked_at = None
 
+    @relogin_on_not_authenticated
     def get_dpg_by_key(self, key):
         for dpg in self._datacenter.network:
             if isinstance(dpg, vim.dvs.DistributedVirtualPortgroup) and dpg.key == key:
                 return dpg
         return None
 
+    @relogin_on_not_authenticated
     def get_dpg_by_name(self, name):
         for dpg in self._datacenter.network:
             if isinstance(dpg, vim.dvs.DistributedVirtualPortgroup) and dpg.name == name:
                 return dpg
         return None
 
-    def set_vlan_id(self, vcenter_port):
-        dv_port = self.fetch_port_from_dvs(vcenter_port.port_key)
-        if not dv_port:
-            return
-        logger.info('Setting vCenter VLAN ID of port %s to %d', vcenter_port.port_key, vcenter_port.vlan_id)
-        dv_port_spec = make_dv_port_spec(dv_port, vcenter_port.vlan_id)
-        task = self._dvs.ReconfigureDVPort_Task(port=[dv_port_spec])
-        success_message = 'Successfully set VLAN ID: %d for port: %s' % (vcenter_port.vlan_id, vcenter_port.port_key)
-        fault_message = 'Failed to set VLAN ID: %d for port: %s' % (vcenter_port.vlan_id, vcenter_port.port_key)
-        return wait_for_task(task, success_message, fault_message)
+    @relogin_on_not_authenticated
+    def set_vlan_ids(self, vcenter_ports):
+        """ Sets VLAN IDs of the ports in one DVS task. Returns errors of the ports that failed. """
+        logger.info('Setting vCenter VLAN IDs of ports: %s',
+                    ', '.join('%s: %d' % (port.port_key, port.vlan_id) for port in vcenter_ports))
+        return self._reconfigure_dv_ports(vcenter_ports)
 
+    @relogin_on_not_authenticated
     def get_vlan_id(self, vcenter_port):
         logger.info('Reading VLAN ID of port %s', vcenter_port.port_key)
         dv_port = self.fetch_port_from_dvs(vcenter_port.port_key)
@@ -199,15 +445,65 @@ class VCenterAPIClient(VSphereAPIClient):
         logger.info('Port: %s has no VLAN ID', vcenter_port.port_key)
         return None
 
-    def restore_vlan_id(self, vcenter_port):
-        logger.info('Restoring VLAN ID of port %s to inherited value', vcenter_port.port_key)
-        dv_port = self.fetch_port_from_dvs(vcenter_port.port_key)
-        dv_port_config_spec = make_dv_port_spec(dv_port)
-        task = self._dvs.ReconfigureDVPort_Task(port=[dv_port_config_spec])
-        success_message = 'Successfully restored VLAN ID for port: %s' % (vcenter_port.port_key,)
-        fault_message = 'Failed to restore VLAN ID for port: %s' % (vcenter_port.port_key,)
-        wait_for_task(task, success_message, fault_message)
+    @relogin_on_not_authenticated
+    def restore_vlan_ids(self, vcenter_ports):
+        """ Restores inherited VLAN IDs of the ports in one DVS task. Returns errors of the ports that failed. """
+        logger.info('Restoring VLAN IDs of ports: %s to inherited value',
+                    ', '.join(port.port_key for port in vcenter_ports))
+        return self._reconfigure_dv_ports(vcenter_ports, restore=True)
+
+    def _reconfigure_dv_ports(self, vcenter_ports, restore=False):
+        errors = {}
+        dv_port_specs = []
+        dv_ports = self.fetch_ports_from_dvs([vcenter_port.port_key for vcenter_port in vcenter_ports], use_cache=True)
+        for vcenter_port in vcenter_ports:
+            dv_port = dv_ports.get(vcenter_port.port_key)
+            if not dv_port:
+                errors[vcenter_port.port_key] = 'Port not found in DVS'
+                continue
+            vlan_id = None if restore else vcenter_port.vlan_id
+            dv_port_specs.append(make_dv_port_spec(dv_port, vlan_id))
+        if not dv_port_specs:
+            return errors
+
+        # Reconfiguration bumps configVersion of the ports, and a failed task
+        # could have been caused by a stale one, so cached ports are dropped
+        self._drop_cached_dv_ports(dv_port_specs)
+        try:
+            errors.update(self._reconfigure_and_find_faults(dv_port_specs))
+        finally:
+            # The ports could have been fetched again while the task was running
+            self._drop_cached_dv_ports(dv_port_specs)
+        return errors
+
+    def _drop_cached_dv_ports(self, dv_port_specs):
+        for dv_port_spec in dv_port_specs:
+            self._dv_ports.pop(dv_port_spec.key, None)
+
+    def _reconfigure_and_find_faults(self, dv_port_specs):
+        state, error_msg = self._reconfigure_dv_port_specs(dv_port_specs)
+        if state == 'success':
+            return {}
+        if len(dv_port_specs) == 1:
+            return {dv_port_specs[0].key: error_msg}
+
+        # The task fails as a whole, so the ports are reconfigured one by one
+        # to find out which of them caused the fault
+        errors = {}
+        for dv_port_spec in dv_port_specs:
+            state, error_msg = self._reconfigure_dv_port_specs([dv_port_spec])
+            if state != 'success':
+                errors[dv_port_spec.key] = error_msg
+        return errors
+
+    def _reconfigure_dv_port_specs(self, dv_port_specs):
+        port_keys = ', '.join(dv_port_spec.key for dv_port_spec in dv_port_specs)
+        task = self._dvs.ReconfigureDVPort_Task(port=dv_port_specs)
+        success_message = 'Successfully reconfigured ports: %s' % port_keys
+        fault_message = 'Failed to reconfigure ports: %s' % port_keys
+        return wait_for_task(task, success_message, fault_message)
 
+    @relogin_on_not_authenticated
     def get_all_vms(self):
         flat_vm_list = list(itertools.chain.from_iterable(ds.vm for ds in self._datacenter.datastore))
         return [vm for vm in flat_vm_list if isinstance(vm, vim.VirtualMachine)]
@@ -218,13 +514,29 @@ class VCenterAPIClient(VSphereAPIClient):
     def _get_dvswitch(self, name):
         return self._get_object([vim.dvs.VmwareDistributedVirtualSwitch], name)
 
-    def fetch_port_from_dvs(self, port_key):
-        criteria = vim.dvs.PortCriteria()
-        criteria.portKey = port_key
-        try:
-            return next(port for port in self._dvs.FetchDVPorts(criteria))
-        except StopIteration:
-            return None
+    @relogin_on_not_authenticated
+    def fetch_ports_from_dvs(self, port_keys, use_cache=False):
+        """ Reads the ports in one FetchDVPorts call. Ports stay cached until they are reconfigured. """
+        dv_ports = {}
+        if use_cache:
+            dv_ports = {port_key: self._dv_ports[port_key] for port_key in port_keys if port_key in self._dv_ports}
+        missing_port_keys = [port_key for port_key in port_keys if port_key not in dv_ports]
+        if missing_port_keys:
+            criteria = vim.dvs.PortCriteria()
+            criteria.portKey = missing_port_keys
+            try:
+                fetched_dv_ports = self._dvs.FetchDVPorts(criteria)
+            except Exception:
+                # Without a fresh read the cached ports can't be trusted either
+                self._dv_ports = {}
+                raise
+            for dv_port in fetched_dv_ports:
+                self._dv_ports[dv_port.key] = dv_port
+                dv_ports[dv_port.key] = dv_port
+        return dv_ports
+
+    def fetch_port_from_dvs(self, port_key, use_cache=True):
+        return self.fetch_ports_from_dvs([port_key], use_cache=use_cache).get(port_key)
 
     @staticmethod
     def enable_vlan_override(portgroup):
@@ -237,9 +549,11 @@ class VCenterAPIClient(VSphereAPIClient):
         fault_message = 'Enabling VLAN override on portgroup {} failed: %s'.format(portgroup.name)
         wait_for_task(task, success_message, fault_message)
 
+    @relogin_on_not_authenticated
     def can_remove_vm(self, uuid):
         return not self._get_vm_by_uuid(uuid)
 
+    @relogin_on_not_authenticated
     def can_rename_vm(self, vm_model, new_name):
         vmware_vm = self._get_object([vim.VirtualMachine], new_name)
         return vmware_vm and (vmware_vm.summary.runtime.host.hardware.systemInfo.uuid == vm_model.host_uuid)
@@ -251,31 +565,34 @@ class VCenterAPIClient(VSphereAPIClient):
     def can_rename_vmi(self, vmi_model, new_name):
         return self.can_rename_vm(vmi_model.vm_model, new_name)
 
-    def is_vm_removed(self, vm_name, host_uuid):
-        logger.info('Checking if VM: %s was removed', vm_name)
-        start_time = time.time()
-        while True:
-            vm = self._get_vm_by_name(vm_name)
-            if vm is None:
+    @relogin_on_not_authenticated
+    def check_vms_removed(self, vm_names, host_uuid):
+        """
+        Checks which of the VMs removed from the host were removed from vCenter (True)
+        and which still exist on another host (False). None means that it can't be told
+        yet, e.g. the VM is being migrated. Only the given VMs are read from vCenter.
+        """
+        hosts_uuids = {}
+        removal_states = {}
+        for vm_name in vm_names:
+            vmware_vms = self._find_vms('name', get_vm_name(vm_name))
+            if not vmware_vms:
                 logger.info('VM: %s was removed', vm_name)
-                return True
-            host = vm.runtime.host
-            if host is None:
-                logger.info('Host for VM %s is None. Waiting for update...', vm_name)
-            else:
-                current_host_uuid = host.hardware.systemInfo.uuid
-                if current_host_uuid != host_uuid:
+                removal_states[vm_name] = True
+                continue
+            removal_states[vm_name] = None
+            for vmware_vm in vmware_vms:
+                host = self._read_properties(vmware_vm, VM_REMOVAL_PROPERTIES).get('runtime.host')
+                if host is None:
+                    logger.info('Host for VM %s is None. Waiting for update...', vm_name)
+                    continue
+                if host not in hosts_uuids:
+                    hosts_uuids[host] = host.hardware.systemInfo.uuid
+                if hosts_uuids[host] != host_uuid:
                     logger.info('VM: %s was not removed', vm_name)
-                    return False
-            if time.time() - start_time > self.WAITING_TIMEOUT:
-                logger.error('Unable to confirm that VM was removed or not...', vm_name)
-                return False
-            time.sleep(self.WAITING_SLEEP)
-
-    def _get_vm_by_name(self, vm_name):
-        if 'vmfs' in vm_name:
-            vm_name = vm_name.split('/')[-2]
-        return self._get_object([vim.VirtualMachine], vm_name)
+                    removal_states[vm_name] = False
+                    break
+        return removal_states
 
 
 def make_dv_port_spec(dv_port, vlan_id=None):
@@ -320,6 +637,12 @@ def wait_for_task(task, success_message, fault_message):
     return state, error_msg
 
 
+def get_vm_name(vm_name):
+    if VMFS in vm_name:
+        return vm_name.split('/')[-2]
+    return vm_name
+
+
 def get_vm_uuid_for_vmi(vnc_vmi):
     refs = vnc_vmi.get_virtual_machine_refs() or []
     if refs:
@@ -331,13 +654,81 @@ def get_key_from_task(task):
     return int(task.info.key.split('-')[1])
 
 
+class RequestCountingProxy(object):
+    """ Counts calls made through the wrapped API client, per method name. """
+
+    def __init__(self, api, counts):
+        self._api = api
+        self._counts = counts
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        @functools.wraps(attr)
+        def counted(*args, **kwargs):
+            self._counts[name] += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class VncObjectCache(object):
+    """ LRU cache of VNC objects, indexed by uuid and by fq_name. """
+
+    def __init__(self, max_size=VNC_CACHE_MAX_SIZE):
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._uuids_by_fq_name = {}
+
+    def get(self, resource_type, uuid=None, fq_name=None):
+        if uuid is None:
+            uuid = self._uuids_by_fq_name.get((resource_type, tuple(fq_name)))
+        entry = self._entries.get(uuid)
+        if entry is None or entry[0] != resource_type:
+            return None
+        self._entries.pop(uuid)
+        self._entries[uuid] = entry
+        return entry[1]
+
+    def put(self, resource_type, vnc_obj, fq_name=None):
+        if self._max_size <= 0:
+            return
+        self.invalidate(vnc_obj.uuid)
+        fq_key = (resource_type, tuple(fq_name)) if fq_name is not None else None
+        self._entries[vnc_obj.uuid] = (resource_type, vnc_obj, fq_key)
+        if fq_key is not None:
+            self._uuids_by_fq_name[fq_key] = vnc_obj.uuid
+        while len(self._entries) > self._max_size:
+            self.invalidate(next(iter(self._entries)))
+
+    def invalidate(self, uuid):
+        entry = self._entries.pop(uuid, None)
+        if entry is not None and entry[2] is not None:
+            self._uuids_by_fq_name.pop(entry[2], None)
+
+    def clear(self):
+        self._entries.clear()
+        self._uuids_by_fq_name.clear()
+
+    def get_all(self, resource_type):
+        return [entry[1] for entry in self._entries.values() if entry[0] == resource_type]
+
+    def get_resource_types(self):
+        return set(entry[0] for entry in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class VNCAPIClient(object):
     def __init__(self, vnc_cfg):
         vnc_cfg['api_server_host'] = vnc_cfg['api_server_host'].split(',')
         random.shuffle(vnc_cfg['api_server_host'])
         vnc_cfg['auth_host'] = vnc_cfg['auth_host'].split(',')
         random.shuffle(vnc_cfg['auth_host'])
-        self.vnc_lib = vnc_api.VncApi(
+        self.request_counts = collections.Counter()
+        self.vnc_lib = RequestCountingProxy(vnc_api.VncApi(
             username=vnc_cfg.get('username'),
             password=vnc_cfg.get('password'),
             tenant_name=vnc_cfg.get('tenant_name'),
@@ -345,7 +736,9 @@ class VNCAPIClient(object):
             api_server_port=vnc_cfg.get('api_server_port'),
             auth_host=vnc_cfg.get('auth_host'),
             auth_port=vnc_cfg.get('auth_port')
-        )
+        ), self.request_counts)
+        self._cache = VncObjectCache(vnc_cfg.get('cache_size', VNC_CACHE_MAX_SIZE))
+        self._revisions_checked_at = time.time()
         self.id_perms = vnc_api.IdPermsType()
         self.id_perms.set_creator('vcenter-manager')
         self.id_perms.set_enable(True)
@@ -357,6 +750,7 @@ class VNCAPIClient(object):
             for vmi_ref in vm.get_virtual_machine_interface_back_refs() or []:
                 self.delete_vmi(vmi_ref.get('uuid'))
             self.vnc_lib.virtual_machine_delete(id=uuid)
+            self._cache.invalidate(uuid)
             logger.info('Virtual Machine %s removed from VNC', uuid)
         except NoIdError:
             logger.error('Virtual Machine %s not found in VNC. Unable to delete', uuid)
@@ -370,6 +764,7 @@ class VNCAPIClient(object):
             self._create_vm(vnc_vm)
 
     def _update_vm(self, vnc_vm):
+        self._cache.invalidate(vnc_vm.uuid)
         self.vnc_lib.virtual_machine_update(vnc_vm)
         logger.info('Virtual Machine %s updated in VNC', vnc_vm.name)
 
@@ -378,80 +773,125 @@ class VNCAPIClient(object):
         logger.info('Virtual Machine %s created in VNC', vnc_vm.name)
 
     def get_all_vms(self):
-        vms_data = self.vnc_lib.virtual_machines_list().get('virtual-machines')
-        vms = []
-        for vm_data in vms_data:
-            try:
-                vnc_vm = self.read_vm(vm_data['uuid'])
-                if vnc_vm.id_perms.creator == ID_PERMS_CREATOR:
-                    vms.append(vnc_vm)
-            except Exception as exc:
-                logger.error('Unexpected exception %s during pulling VM from VNC', exc, exc_info=True)
-        return vms
+        vms = self._list_details('virtual_machine', fields=['virtual_machine_interface_back_refs'])
+        return [vnc_vm for vnc_vm in vms if self._is_created_by_cvm(vnc_vm)]
 
     def get_all_vm_uuids(self):
-        vms_data = self.vnc_lib.virtual_machines_list().get('virtual-machines')
-        vm_uuids = []
-        for vm_data in vms_data:
-            try:
-                vnc_vm = self.read_vm(vm_data['uuid'])
-                if vnc_vm.id_perms.creator == ID_PERMS_CREATOR:
-                    vm_uuids.append(vm_data['uuid'])
-            except Exception as exc:
-                logger.error('Unexpected exception %s during pulling VM uuid from VNC', exc, exc_info=True)
-        return vm_uuids
+        # Only id_perms is needed, so details of the VMs aren't read
+        vms = self._list('virtual_machine', fields=['id_perms'])
+        return [vm['uuid'] for vm in vms if (vm.get('id_perms') or {}).get('creator') == ID_PERMS_CREATOR]
+
+    def _list(self, resource_type, **kwargs):
+        """ Lists resources without details, i.e. their uuids and requested properties. """
+        list_method = getattr(self.vnc_lib, '{}s_list'.format(resource_type))
+        return list_method(**kwargs).get('{}s'.format(resource_type.replace('_', '-')))
+
+    def _list_details(self, resource_type, fields=None, **kwargs):
+        """ Lists resources with details, reading them in pages of VNC_LIST_PAGE_SIZE uuids. """
+        list_method = getattr(self.vnc_lib, '{}s_list'.format(resource_type))
+        uuids = [resource['uuid'] for resource in self._list(resource_type, **kwargs)]
+        details = []
+        for i in range(0, len(uuids), VNC_LIST_PAGE_SIZE):
+            details.extend(list_method(obj_uuids=uuids[i:i + VNC_LIST_PAGE_SIZE], detail=True, fields=fields))
+        return details
+
+    @staticmethod
+    def _is_created_by_cvm(vnc_obj):
+        return vnc_obj.id_perms is not None and vnc_obj.id_perms.creator == ID_PERMS_CREATOR
 
     def get_vmi_uuids_by_vm_uuid(self, vm_uuid):
         vm = self.read_vm(vm_uuid)
         return [vmi_ref['uuid'] for vmi_ref in vm.get_virtual_machine_interface_back_refs() or ()]
 
     def read_vm(self, uuid):
-        return self.vnc_lib.virtual_machine_read(id=uuid)
+        return self._read_through_cache('virtual_machine', uuid=uuid)
+
+    def _read_through_cache(self, resource_type, uuid=None, fq_name=None):
+        self._check_cache_revisions()
+        vnc_obj = self._cache.get(resource_type, uuid=uuid, fq_name=fq_name)
+        if vnc_obj is None:
+            read_method = getattr(self.vnc_lib, '{}_read'.format(resource_type))
+            if uuid is not None:
+                vnc_obj = read_method(id=uuid)
+            else:
+                vnc_obj = read_method(fq_name)
+            self._cache.put(resource_type, vnc_obj, fq_name=fq_name)
+        return vnc_obj
+
+    def _check_cache_revisions(self):
+        """ Drops cached objects which were modified or deleted in VNC by someone else. """
+        if time.time() - self._revisions_checked_at < VNC_CACHE_REVISION_CHECK_INTERVAL:
+            return
+        self._revisions_checked_at = time.time()
+        for resource_type in self._cache.get_resource_types():
+            cached_objs = {vnc_obj.uuid: vnc_obj for vnc_obj in self._cache.get_all(resource_type)}
+            list_method = getattr(self.vnc_lib, '{}s_list'.format(resource_type))
+            uuids = list(cached_objs)
+            revisions = {}
+            for i in range(0, len(uuids), VNC_LIST_PAGE_SIZE):
+                resources = list_method(obj_uuids=uuids[i:i + VNC_LIST_PAGE_SIZE], fields=['id_perms'])
+                for resource in resources.get('{}s'.format(resource_type.replace('_', '-'))):
+                    revisions[resource['uuid']] = resource.get('id_perms', {}).get('last_modified')
+            for uuid, vnc_obj in cached_objs.items():
+                if uuid not in revisions or revisions[uuid] != self._get_last_modified(vnc_obj):
+                    self._cache.invalidate(uuid)
+
+    @staticmethod
+    def _get_last_modified(vnc_obj):
+        if vnc_obj.id_perms is None:
+            return None
+        return vnc_obj.id_perms.last_modified
 
     def update_vmi(self, vnc_vmi):
         logger.info('Attempting to update Virtual Machine Interface %s in VNC', vnc_vmi.name)
         try:
             old_vmi = self.vnc_lib.virtual_machine_interface_read(id=vnc_vmi.uuid)
-            self._update_vmi_vn(old_vmi, vnc_vmi)
+            recreated = self._update_vmi_vn(old_vmi, vnc_vmi)
             self._rename_vmi(old_vmi, vnc_vmi)
+            self._cache.invalidate(vnc_vmi.uuid)
             self.vnc_lib.virtual_machine_interface_update(old_vmi)
+            if not recreated:
+                return old_vmi
         except NoIdError:
             logger.info('Virtual Machine Interface %s not found in VNC - creating', vnc_vmi.name)
             self.create_vmi(vnc_vmi)
-        return self.vnc_lib.virtual_machine_interface_read(id=vnc_vmi.uuid)
+        return vnc_vmi
 
     def _update_vmi_vn(self, old_vmi, new_vmi):
         new_vn_fq_name = self._get_vn_fq_name_for_vmi(new_vmi)
         old_vn_fq_name = self._get_vn_fq_name_for_vmi(old_vmi)
         if new_vn_fq_name == old_vn_fq_name:
             logger.info('No network change detected.')
-            return
+            return False
 
         logger.info('Network change detected. Updating Interface %s info in VNC.', new_vmi.name)
-        self.delete_vmi(old_vmi.uuid)
+        self.delete_vmi(old_vmi.uuid, vmi=old_vmi)
         logger.info('Deleted VMI %s from VNC with old network %s', old_vmi.uuid, old_vn_fq_name[2])
         self.create_vmi(new_vmi)
         logger.info('Created VMI %s in VNC with new network %s', new_vmi.uuid, new_vn_fq_name[2])
+        return True
 
     def _delete_instance_ip_of(self, vnc_vmi):
         logger.info('Deleting old Instance IP for Interface %s', vnc_vmi.name)
         instance_ip_fq_name = self._get_ip_fq_name_for_vmi(vnc_vmi)
         self.vnc_lib.instance_ip_delete(instance_ip_fq_name)
+        self._invalidate_vmi(vnc_vmi)
 
     @staticmethod
     def _rename_vmi(old_vmi, new_vmi):
         old_vmi.set_display_name(new_vmi.display_name)
 
     def create_vmi(self, vnc_vmi):
+        self._invalidate_vmi(vnc_vmi)
         try:
             self.vnc_lib.virtual_machine_interface_create(vnc_vmi)
             logger.info('Virtual Machine Interface %s created in VNC', vnc_vmi.name)
         except RefsExistError:
             logger.info('Virtual Machine Interface %s already exists in VNC', vnc_vmi.name)
 
-    def delete_vmi(self, uuid):
+    def delete_vmi(self, uuid, vmi=None):
         logger.info('Deleting Virtual Machine Interface %s from VNC...', uuid)
-        vmi = self.read_vmi(uuid)
+        vmi = vmi or self.read_vmi(uuid)
         if not vmi:
             logger.error('Virtual Machine Interface %s not found in VNC. Unable to delete', uuid)
             return
@@ -465,22 +905,27 @@ class VNCAPIClient(object):
             self.delete_instance_ip(instance_ip_ref.get('uuid'))
 
         self.vnc_lib.virtual_machine_interface_delete(id=uuid)
+        self._invalidate_vmi(vmi)
         logger.info('Virtual Machine Interface %s removed from VNC', uuid)
 
+    def _invalidate_vmi(self, vnc_vmi):
+        # VM back refs change together with the VMI
+        self._cache.invalidate(vnc_vmi.uuid)
+        for vm_ref in vnc_vmi.get_virtual_machine_refs() or ():
+            self._cache.invalidate(vm_ref.get('uuid'))
+
     def get_vmis_by_project(self, project):
-        vmis = self.vnc_lib.virtual_machine_interfaces_list(parent_id=project.uuid).get('virtual-machine-interfaces')
-        return [self.vnc_lib.virtual_machine_interface_read(vmi['fq_name']) for vmi in vmis]
+        return self._list_details('virtual_machine_interface', fields=['instance_ip_back_refs'], parent_id=project.uuid)
 
     def read_vmi(self, uuid):
         try:
-            return self.vnc_lib.virtual_machine_interface_read(id=uuid)
+            return self._read_through_cache('virtual_machine_interface', uuid=uuid)
         except NoIdError:
             logger.error('Could not find VMI %s in VNC', uuid)
         return None
 
     def get_vns_by_project(self, project):
-        vns = self.vnc_lib.virtual_networks_list(parent_id=project.uuid).get('virtual-networks')
-        return [self.vnc_lib.virtual_network_read(vn['fq_name']) for vn in vns]
+        return self._list_details('virtual_network', parent_id=project.uuid)
 
     @staticmethod
     def _get_vn_fq_name_for_vmi(vnc_vmi):
@@ -496,7 +941,7 @@ class VNCAPIClient(object):
 
     def read_vn(self, fq_name):
         try:
-            return self.vnc_lib.virtual_network_read(fq_name)
+            return self._read_through_cache('virtual_network', fq_name=fq_name)
         except NoIdError:
             logger.error('VN %s not found in VNC', fq_name[2])
         return None
@@ -553,28 +998,45 @@ class VNCAPIClient(object):
         logger.info('Network IPAM created: %s', ipam.name)
         return ipam
 
-    def create_and_read_instance_ip(self, vmi_model):
-        instance_ip = self._read_instance_ip(vmi_model)
+    def create_and_read_instance_ip(self, vmi_model, vnc_vmi=None):
+        instance_ip = self._read_instance_ip(vmi_model, vnc_vmi)
         if instance_ip:
             return instance_ip
         try:
             instance_ip = vmi_model.vnc_instance_ip
             self.vnc_lib.instance_ip_create(instance_ip)
+            self._cache.invalidate(vmi_model.uuid)
+            self._invalidate_instance_ip(instance_ip)
             logger.info("Created Instance IP: %s with IP: %s", instance_ip.name, instance_ip.instance_ip_address)
-            return self._read_instance_ip(vmi_model)
+            if instance_ip.instance_ip_address:
+                return instance_ip
+            # Only the address allocated by VNC is missing from the create response
+            return self._read_instance_ip_by_uuid(instance_ip.uuid)
         except Exception as e:
             logger.error("Unable to create Instance IP: %s due to: %s", instance_ip.name, e)
 
     def delete_instance_ip(self, uuid):
         logger.info('Deleting Instance IP: %s... from VNC', uuid)
+        instance_ip = self._read_instance_ip_by_uuid(uuid)
         try:
             self.vnc_lib.instance_ip_delete(id=uuid)
             logger.info('Removed Instance IP %s from VNC', uuid)
         except NoIdError:
             logger.error('Instance IP not found: %s', uuid)
-
-    def _read_instance_ip(self, vmi_model):
-        vmi_vnc = self.read_vmi(vmi_model.uuid)
+        self._cache.invalidate(uuid)
+        if instance_ip is not None:
+            self._invalidate_instance_ip(instance_ip)
+
+    def _invalidate_instance_ip(self, instance_ip):
+        # VMI back refs change together with the Instance IP
+        self._cache.invalidate(instance_ip.uuid)
+        for vmi_ref in instance_ip.get_virtual_machine_interface_refs() or ():
+            self._cache.invalidate(vmi_ref.get('uuid'))
+
+    def _read_instance_ip(self, vmi_model, vnc_vmi=None):
+        vmi_vnc = vnc_vmi or self.read_vmi(vmi_model.uuid)
+        if vmi_vnc is None:
+            return None
         ip_back_refs = vmi_vnc.get_instance_ip_back_refs() or ()
         for ip_ref in ip_back_refs:
             ip_uuid = ip_ref["uuid"]
@@ -587,7 +1049,7 @@ class VNCAPIClient(object):
 
     def _read_instance_ip_by_uuid(self, ip_uuid):
         try:
-            return self.vnc_lib.instance_ip_read(id=ip_uuid)
+            return self._read_through_cache('instance_ip', uuid=ip_uuid)
         except NoIdError:
             return None
 
@@ -666,6 +1128,8 @@ class VRouterAPIClient(object):
         self.vrouter_host = 'http://localhost'
         self.vrouter_port = '9091'
         self.port_files_path = '/var/lib/contrail/ports/'
+        # Keeps the connection to the agent alive between requests
+        self._session = requests.Session()
 
     def add_port(self, vmi_model):
         """ Add port to VRouter Agent. """
@@ -690,8 +1154,10 @@ class VRouterAPIClient(object):
             )
             self.vrouter_api.add_port(**parameters)
             logger.info('Added port to vRouter with parameters: %s', parameters)
+            return True
         except Exception as e:
             logger.error('There was a problem with vRouter API Client: %s', e)
+            return False
 
     def delete_port(self, vmi_uuid):
         """ Delete port from VRouter Agent. """
@@ -720,7 +1186,7 @@ class VRouterAPIClient(object):
             request_url = '{host}:{port}/port/{uuid}'.format(host=self.vrouter_host,
                                                              port=self.vrouter_port,
                                                              uuid=vmi_uuid)
-            response = requests.get(request_url)
+            response = self._session.get(request_url)
             if response.status_code == requests.codes.ok:
                 port_properties = json.loads(response.content)
                 logger.info('Read vRouter port with uuid: %s, port properties: %s', vmi_uuid, port_properties)
@@ -730,6 +1196,10 @@ class VRouterAPIClient(object):
         logger.info('Unable to read vRouter port with uuid: %s', vmi_uuid)
         return None
 
+    def read_ports(self, vmi_uuids):
+        """ Returns properties of many ports (None for missing ones) by their uuids, read over one connection. """
+        return {vmi_uuid: self.read_port(vmi_uuid) for vmi_uuid in vmi_uuids}
+
     def get_all_port_uuids(self):
         if not os.path.exists(self.port_files_path):
             return ()
@@ -24,6 +24,17 @@ VM_PROPERTY_FILTERS = [
     'runtime.powerState',
     'guest.toolsRunningStatus',
     'summary.runtime.host',
+    'config.changeVersion',
+]
+VM_SYNC_PROPERTY_FILTERS = VM_PROPERTY_FILTERS + [
+    'config.hardware.device',
+]
+VM_INVENTORY_PROPERTIES = [
+    'name',
+    'config.instanceUuid',
+]
+VM_REMOVAL_PROPERTIES = [
+    'runtime.host',
 ]
 VM_UPDATE_FILTERS = [
     'guest.toolsRunningStatus',
@@ -47,12 +58,28 @@ ID_PERMS_CREATOR = 'vcenter-manager'
 ID_PERMS = IdPermsType(creator=ID_PERMS_CREATOR, enable=True)
 
 SET_VLAN_ID_RETRY_LIMIT = 2
+WAIT_FOR_PORT_TIMEOUT = 30  # 30s
 WAIT_FOR_PORT_RETRY_TIME = 1  # 1s
-WAIT_FOR_PORT_RETRY_LIMIT = int(old_div(30,WAIT_FOR_PORT_RETRY_TIME))  # Timeout after 30s
+WAIT_FOR_PORT_RETRY_LIMIT = int(old_div(WAIT_FOR_PORT_TIMEOUT,WAIT_FOR_PORT_RETRY_TIME))  # Timeout after 30s
 
 WAIT_FOR_UPDATE_TIMEOUT = 60
 SUPERVISOR_TIMEOUT = 80
 
+UPDATE_SET_BATCH_SIZE = 100
+UPDATE_SET_BATCH_WINDOW = 0.5  # 0.5s
+VM_UPDATE_WORKER_POOL_SIZE = 10
+
+VM_REMOVAL_CHECK_INTERVAL = 3  # 3s
+VM_REMOVAL_TIMEOUT = 20  # 20s
+
 HISTORY_COLLECTOR_PAGE_SIZE = 1000
+VNC_WORKER_POOL_SIZE = 10
+PROPERTY_COLLECTOR_PAGE_SIZE = 1000
+VNC_LIST_PAGE_SIZE = 500
+VNC_CACHE_MAX_SIZE = 10000
+VNC_CACHE_REVISION_CHECK_INTERVAL = 60  # 60s
+INVENTORY_CACHE_TTL = 60  # 60s
+INTROSPECT_PAGE_SIZE = 100
+INTROSPECT_MAX_PAGE_SIZE = 1000
 
 VMFS = 'vmfs'
@@ -1,16 +1,20 @@
 from builtins import object
+import collections
 import logging
 from abc import ABCMeta, abstractmethod
 
 from pyVmomi import vim, vmodl  # pylint: disable=no-name-in-module
 from future.utils import with_metaclass
 
+from cvm.constants import VM_UPDATE_WORKER_POOL_SIZE
+from cvm.services import OrderedPool
+
 logger = logging.getLogger(__name__)
 
 
 class VmwareController(object):
     def __init__(self, vm_service, vn_service, vmi_service, vrouter_port_service,
-                 vlan_id_service, update_handler, lock):
+                 vlan_id_service, update_handler, lock, vm_removal_service=None, database=None):
         self._vm_service = vm_service
         self._vn_service = vn_service
         self._vmi_service = vmi_service
@@ -18,6 +22,8 @@ class VmwareController(object):
         self._vlan_id_service = vlan_id_service
         self._update_handler = update_handler
         self._lock = lock
+        self._vm_removal_service = vm_removal_service
+        self._database = database
 
     def sync(self):
         logger.info('Synchronizing CVM...')
@@ -30,26 +36,143 @@ class VmwareController(object):
             self._vlan_id_service.update_vlan_ids()
             self._vrouter_port_service.sync_ports()
             self._vrouter_port_service.delete_stale_vrouter_ports()
+            self._publish_snapshot()
         logger.info('Synchronization complete')
 
+    def resync(self):
+        logger.info('Resynchronizing CVM...')
+        with self._lock:
+            for vm_name in self._vm_service.resync_vms_from_vmware():
+                self._vmi_service.remove_vmis_for_vm_model(vm_name)
+                self._vm_service.remove_vm(vm_name)
+            self._vn_service.update_vns()
+            self._vmi_service.update_vmis()
+            self._vlan_id_service.update_vlan_ids()
+            self._vrouter_port_service.sync_ports()
+            self._publish_snapshot()
+        logger.info('Resynchronization complete')
+
     def handle_update(self, update_set):
+        self.handle_updates([update_set])
+
+    def handle_updates(self, update_sets):
+        with self._lock:
+            self._update_handler.handle_updates(update_sets)
+            self._publish_snapshot()
+
+    def confirm_vm_removals(self):
+        # vCenter is asked without holding the lock, so that updates can be
+        # handled in the meantime
+        removal_states = self._vm_removal_service.check_removals()
+        if not removal_states and not self._vm_removal_service.has_pending_removals():
+            return
         with self._lock:
-            self._update_handler.handle_update(update_set)
+            self._vm_removal_service.confirm_removals(removal_states)
+            self._vlan_id_service.update_vlan_ids()
+            self._publish_snapshot()
+
+    def _publish_snapshot(self):
+        # Introspect reads the snapshot, so it never waits for the lock
+        if self._database is not None:
+            self._database.publish_snapshot()
+
+
+PropertyChange = collections.namedtuple('PropertyChange', ('name', 'val'))
 
 
 class UpdateHandler(object):
-    def __init__(self, handlers):
+    def __init__(self, handlers, vm_workers=None):
         self._handlers = handlers
+        self._vm_workers = vm_workers or OrderedPool(VM_UPDATE_WORKER_POOL_SIZE)
 
     def handle_update(self, update_set):
+        self.handle_updates([update_set])
+
+    def handle_updates(self, update_sets):
+        """ Applies coalesced changes of all update sets and then synchronizes each affected handler once. """
+        # Changes of different VMs are applied concurrently, changes of one VM
+        # in order. Synchronization touches shared state (e.g. VLAN ID pool),
+        # so it runs afterwards, one handler at a time.
+        for obj, property_change in coalesce_changes(update_sets):
+            vm_key = get_vm_key(obj, property_change)
+            if vm_key is None:
+                # A change which can't be attributed to a VM runs alone
+                self._vm_workers.join()
+                self._handle_change(obj, property_change)
+                continue
+            self._vm_workers.spawn(vm_key, self._handle_change, obj, property_change)
+        self._vm_workers.join()
+        for handler in self._handlers:
+            handler.sync()
+
+    def _handle_change(self, obj, property_change):
+        for handler in self._handlers:
+            handler.handle_change(obj, property_change)
+
+
+def get_vm_key(obj, property_change):
+    """ Returns the managed object of the VM which the change is about, if known. """
+    if property_change.name != AbstractEventHandler.PROPERTY_NAME:
+        return obj
+    vm_argument = getattr(property_change.val, 'vm', None)
+    return getattr(vm_argument, 'vm', None)
+
+
+def coalesce_changes(update_sets):
+    """ Merges changes of many update sets into a list of (object, change) pairs.
+
+    Changes keep their arrival order. Events are deduplicated by their keys,
+    VmReconfiguredEvents of VMs which are updated anyway are dropped and only
+    the last value of any other property of an object is kept, where it arrived.
+    """
+    changes = []
+    event_keys = set()
+    property_positions = {}
+    for update_set in update_sets:
         for property_filter_update in update_set.filterSet:
             for object_update in property_filter_update.objectSet:
+                obj = object_update.obj
                 for property_change in object_update.changeSet:
-                    for handler in self._handlers:
-                        handler.handle_change(object_update.obj, property_change)
+                    name = getattr(property_change, 'name', None)
+                    value = getattr(property_change, 'val', None)
+                    if name == AbstractEventHandler.PROPERTY_NAME:
+                        for event in _list_events(value):
+                            if event.key not in event_keys:
+                                event_keys.add(event.key)
+                                changes.append((obj, PropertyChange(name, event)))
+                        continue
+                    position = property_positions.get((obj, name))
+                    if position is not None:
+                        changes[position] = None
+                    property_positions[(obj, name)] = len(changes)
+                    changes.append((obj, property_change))
+
+    changes = [change for change in changes if change is not None]
+    updated_vms = set(
+        property_change.val.vm.vm for _, property_change in changes
+        if isinstance(property_change.val, VmUpdatedHandler.EVENTS + VmRegisteredHandler.EVENTS)
+    )
+    coalesced_changes = []
+    for obj, property_change in changes:
+        event = property_change.val
+        if isinstance(event, VmReconfiguredHandler.EVENTS) and event.vm.vm in updated_vms:
+            logger.info('Skipping %s for VM: %s which is updated anyway', type(event), event.vm.name)
+            continue
+        coalesced_changes.append((obj, property_change))
+    return coalesced_changes
+
+
+def _list_events(value):
+    if not value:
+        return []
+    if isinstance(value, list):
+        return sorted(value, key=lambda e: e.key)
+    return [value]
 
 
 class AbstractChangeHandler(with_metaclass(ABCMeta, object)):
+    _sync_pending = False
+
     def handle_change(self, obj, property_change):
         name = getattr(property_change, 'name', None)
         value = getattr(property_change, 'val', None)
@@ -62,6 +185,19 @@ class AbstractChangeHandler(with_metaclass(ABCMeta, object)):
                 except Exception as exc:
                     logger.error('Unexpected exception: %s during handling %s', exc, value, exc_info=True)
 
+    def sync(self):
+        """ Pushes changes handled since the last call further, e.g. to VNC, vCenter and vRouter. """
+        if not self._sync_pending:
+            return
+        self._sync_pending = False
+        try:
+            self._sync()
+        except Exception as exc:
+            logger.error('Unexpected exception: %s during synchronizing %s', exc, type(self).__name__, exc_info=True)
+
+    def _sync(self):
+        pass
+
     @abstractmethod
     def _log_managed_object_not_found(self, value):
         pass
@@ -154,6 +290,9 @@ class VmUpdatedHandler(AbstractEventHandler):
             return
         vmware_vm = event.vm.vm
         self._vm_service.update(vmware_vm)
+        self._sync_pending = True
+
+    def _sync(self):
         self._vn_service.update_vns()
         self._vmi_service.update_vmis()
         self._vlan_id_service.update_vlan_ids()
@@ -169,18 +308,24 @@ class VmRegisteredHandler(AbstractEventHandler):
         self._vmi_service = vmi_service
         self._vrouter_port_service = vrouter_port_service
         self._vlan_id_service = vlan_id_service
+        self._registered_vm_uuids = []
 
     def _handle_event(self, event):
         if not self._validate_event(event):
             return
         vmware_vm = event.vm.vm
         self._vm_service.update(vmware_vm)
+        self._registered_vm_uuids.append(vmware_vm.config.instanceUuid)
+        self._sync_pending = True
+
+    def _sync(self):
+        vm_uuids, self._registered_vm_uuids = self._registered_vm_uuids, []
         self._vn_service.update_vns()
         self._vmi_service.register_vmis()
         self._vlan_id_service.update_vlan_ids()
         self._vrouter_port_service.sync_ports()
-        vm_uuid = vmware_vm.config.instanceUuid
-        self._vmi_service.delete_unused_vm_vmis_in_vnc(vm_uuid)
+        for vm_uuid in vm_uuids:
+            self._vmi_service.delete_unused_vm_vmis_in_vnc(vm_uuid)
 
 
 class VmRenamedHandler(AbstractEventHandler):
@@ -198,6 +343,9 @@ class VmRenamedHandler(AbstractEventHandler):
         new_name = event.newName
         self._vm_service.rename_vm(old_name, new_name)
         self._vmi_service.rename_vmis(new_name)
+        self._sync_pending = True
+
+    def _sync(self):
         self._vrouter_port_service.sync_ports()
 
     def _validate_event(self, event):
@@ -224,13 +372,16 @@ class VmReconfiguredHandler(AbstractEventHandler):
             if isinstance(device, vim.vm.device.VirtualEthernetCard):
                 logger.info('Detected VmReconfiguredEvent with %s device', type(device))
                 self._vm_service.update_vm_models_interfaces(vmware_vm)
-                self._vn_service.update_vns()
-                self._vmi_service.update_vmis()
-                self._vlan_id_service.update_vlan_ids()
-                self._vrouter_port_service.sync_ports()
+                self._sync_pending = True
             else:
                 logger.info('Detected VmReconfiguredEvent with unsupported %s device type', type(device))
 
+    def _sync(self):
+        self._vn_service.update_vns()
+        self._vmi_service.update_vmis()
+        self._vlan_id_service.update_vlan_ids()
+        self._vrouter_port_service.sync_ports()
+
     def _validate_event(self, event):
         vmware_vm = event.vm.vm
         return all((
@@ -254,8 +405,11 @@ class VmRemovedHandler(AbstractEventHandler):
             return
         vm_name = event.vm.name
         self._vmi_service.remove_vmis_for_vm_model(vm_name)
-        self._vlan_id_service.update_vlan_ids()
         self._vm_service.remove_vm(vm_name)
+        self._sync_pending = True
+
+    def _sync(self):
+        self._vlan_id_service.update_vlan_ids()
         self._vrouter_port_service.sync_ports()
 
     def _validate_event(self, event):
@@ -273,6 +427,9 @@ class GuestNetHandler(AbstractChangeHandler):
     def _handle_change(self, obj, value):
         for nic_info in value:
             self._vmi_service.update_nic(nic_info)
+        self._sync_pending = True
+
+    def _sync(self):
         self._vrouter_port_service.sync_ports()
 
     def _log_managed_object_not_found(self, value):
@@ -309,6 +466,9 @@ class PowerStateHandler(AbstractChangeHandler):
         if not self._validate_vm(obj):
             return
         self._vm_service.update_power_state(obj, value)
+        self._sync_pending = True
+
+    def _sync(self):
         self._vrouter_port_service.sync_port_states()
         self._vlan_id_service.update_vcenter_vlans()
 
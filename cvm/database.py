@@ -1,5 +1,8 @@
 from builtins import object
+import bisect
 import logging
+from collections import OrderedDict, namedtuple
+from operator import attrgetter
 
 from cvm.constants import VMFS
 from cvm.models import (VirtualMachineInterfaceModel, VirtualMachineModel,
@@ -14,22 +17,52 @@ class Database(object):
         self.vm_models = {}
         self.vn_models = {}
         self.vmi_models = {}
-        self.vmis_to_update = []
-        self.vmis_to_delete = []
-        self.vlans_to_update = []
-        self.vlans_to_restore = []
-        self.ports_to_update = []
-        self.ports_to_delete = []
+        self.vmis_to_update = WorkQueue(key=attrgetter('uuid'))
+        self.vmis_to_delete = WorkQueue(key=attrgetter('uuid'))
+        self.vlans_to_update = WorkQueue(key=attrgetter('uuid'))
+        self.vlans_to_restore = WorkQueue(key=attrgetter('uuid'))
+        self.ports_to_update = WorkQueue(key=attrgetter('uuid'))
+        self.ports_to_delete = WorkQueue()
+        self.vms_to_confirm_removal = WorkQueue(key=attrgetter('uuid'))
+        self.vmis_to_confirm_removal = WorkQueue(key=attrgetter('uuid'))
+        self.snapshot = DatabaseSnapshot()
+        # Keys of models saved or deleted since the last published snapshot
+        self._changed_vm_uuids = set()
+        self._changed_vn_keys = set()
+        self._changed_vmi_uuids = set()
+        self._clear_indexes()
+
+    def _clear_indexes(self):
+        # Secondary indexes: attribute value -> {primary key: model}.
+        # Keys under which each model is currently indexed are remembered,
+        # so that changed attributes can be re-indexed on the next save.
+        self._vms_by_name = {}
+        self._vm_index_keys = {}
+        self._vns_by_uuid = {}
+        self._vn_index_keys = {}
+        self._vmis_by_vm_uuid = {}
+        self._vmis_by_vn_uuid = {}
+        self._vmis_by_vlan_id = {}
+        self._vmi_index_keys = {}
 
     def save(self, obj):
         if isinstance(obj, VirtualMachineModel):
             self.vm_models[obj.uuid] = obj
+            self._index_vm(obj)
+            # Display names of VMIs are derived from the VM's name
+            self._changed_vm_uuids.add(obj.uuid)
+            self._changed_vmi_uuids.update(self._vmis_by_vm_uuid.get(obj.uuid, ()))
             logger.info('Saved Virtual Machine model for %s', obj.name)
         if isinstance(obj, VirtualNetworkModel):
             self.vn_models[obj.key] = obj
+            self._index_vn(obj)
+            self._changed_vn_keys.add(obj.key)
+            self._changed_vmi_uuids.update(self._vmis_by_vn_uuid.get(obj.uuid, ()))
             logger.info('Saved Virtual Network model for %s', obj.name)
         if isinstance(obj, VirtualMachineInterfaceModel):
             self.vmi_models[obj.uuid] = obj
+            self._index_vmi(obj)
+            self._changed_vmi_uuids.add(obj.uuid)
             logger.info('Saved Virtual Machine Interface model for %s', obj.display_name)
 
     def get_all_vm_models(self):
@@ -42,11 +75,11 @@ class Database(object):
         return vm_model
 
     def get_vm_model_by_name(self, name):
-        try:
-            return [vm_model for vm_model in list(self.vm_models.values()) if vm_model.name == name][0]
-        except IndexError:
-            logger.info('Could not find VM model with name %s.', name)
-            return self._get_vm_model_by_old_name(name)
+        vm_models = self._vms_by_name.get(name)
+        if vm_models:
+            return next(iter(vm_models.values()))
+        logger.info('Could not find VM model with name %s.', name)
+        return self._get_vm_model_by_old_name(name)
 
     def _get_vm_model_by_old_name(self, old_name):
         # Sometimes during stress tests VmRemoved event comes with old name, despite rename
@@ -66,11 +99,11 @@ class Database(object):
         return vn_model
 
     def get_vn_model_by_uuid(self, uuid):
-        try:
-            return [vn_model for vn_model in list(self.vn_models.values()) if vn_model.uuid == uuid][0]
-        except IndexError:
-            logger.info('Could not find VN model with UUID %s.', uuid)
-            return None
+        vn_models = self._vns_by_uuid.get(uuid)
+        if vn_models:
+            return next(iter(vn_models.values()))
+        logger.info('Could not find VN model with UUID %s.', uuid)
+        return None
 
     def get_all_vn_models(self):
         return list(self.vn_models.values())
@@ -82,42 +115,420 @@ class Database(object):
         return self.vmi_models.get(uuid, None)
 
     def get_vmi_models_by_vm_uuid(self, uuid):
-        return [vmi_model for vmi_model in list(self.vmi_models.values()) if vmi_model.vm_model.uuid == uuid]
+        return list(self._vmis_by_vm_uuid.get(uuid, {}).values())
 
     def get_vmi_models_by_vn_uuid(self, uuid):
-        return [vmi_model for vmi_model in list(self.vmi_models.values()) if vmi_model.vn_model.uuid == uuid]
+        return list(self._vmis_by_vn_uuid.get(uuid, {}).values())
 
     def delete_vm_model(self, uid):
         try:
             self.vm_models.pop(uid)
+            self._unindex_vm(uid)
+            self._changed_vm_uuids.add(uid)
         except KeyError:
             logger.info('Could not delete VM model with uuid %s.', uid)
 
     def delete_vn_model(self, key):
         try:
             self.vn_models.pop(key)
+            self._unindex_vn(key)
+            self._changed_vn_keys.add(key)
         except KeyError:
             logger.info('Could not find VN model with key %s. Nothing to delete.', key)
 
     def delete_vmi_model(self, uuid):
         try:
             self.vmi_models.pop(uuid)
+            self._unindex_vmi(uuid)
+            self._changed_vmi_uuids.add(uuid)
         except KeyError:
             logger.info('Could not find VMI model with uuid %s. Nothing to delete.', uuid)
 
+    def update_vlan_id(self, vmi_model, vlan_id):
+        vmi_model.vcenter_port.vlan_id = vlan_id
+        if self.vmi_models.get(vmi_model.uuid) is vmi_model:
+            self._index_vmi(vmi_model)
+            self._changed_vmi_uuids.add(vmi_model.uuid)
+
+    def get_vmi_models_by_vlan_id(self, vlan_id):
+        return [vmi_model for vmi_model in list(self._vmis_by_vlan_id.get(vlan_id, {}).values())
+                if vmi_model.vcenter_port.vlan_id == vlan_id]
+
     def is_vlan_available(self, new_vmi_model, vlan_id):
-        vmi_models = [vmi_model for vmi_model in self.get_all_vmi_models()
+        vmi_models = [vmi_model for vmi_model in list(self._vmis_by_vlan_id.get(vlan_id, {}).values())
                       if vmi_model.vcenter_port.vlan_id == vlan_id
                       and vmi_model.uuid != new_vmi_model.uuid]
         return not bool(vmi_models)
 
+    def publish_snapshot(self):
+        """ Replaces the read-only snapshot of the models, which is read without holding any lock.
+
+        Only models saved or deleted since the last snapshot are copied into the new one.
+        """
+        if not (self._changed_vm_uuids or self._changed_vn_keys or self._changed_vmi_uuids):
+            return
+        self.snapshot = self.snapshot.update(
+            {uuid: self.vm_models.get(uuid) for uuid in self._changed_vm_uuids},
+            {key: self.vn_models.get(key) for key in self._changed_vn_keys},
+            {uuid: self.vmi_models.get(uuid) for uuid in self._changed_vmi_uuids},
+        )
+        self._changed_vm_uuids = set()
+        self._changed_vn_keys = set()
+        self._changed_vmi_uuids = set()
+
     def clear_database(self):
+        self._changed_vm_uuids.update(self.vm_models)
+        self._changed_vn_keys.update(self.vn_models)
+        self._changed_vmi_uuids.update(self.vmi_models)
         self.vm_models = {}
         self.vn_models = {}
         self.vmi_models = {}
-        self.vmis_to_update = []
-        self.vmis_to_delete = []
-        self.vlans_to_update = []
-        self.vlans_to_restore = []
-        self.ports_to_update = []
-        self.ports_to_delete = []
+        self.vmis_to_update = WorkQueue(key=attrgetter('uuid'))
+        self.vmis_to_delete = WorkQueue(key=attrgetter('uuid'))
+        self.vlans_to_update = WorkQueue(key=attrgetter('uuid'))
+        self.vlans_to_restore = WorkQueue(key=attrgetter('uuid'))
+        self.ports_to_update = WorkQueue(key=attrgetter('uuid'))
+        self.ports_to_delete = WorkQueue()
+        self.vms_to_confirm_removal = WorkQueue(key=attrgetter('uuid'))
+        self.vmis_to_confirm_removal = WorkQueue(key=attrgetter('uuid'))
+        self._clear_indexes()
+
+    def _index_vm(self, vm_model):
+        uuid = vm_model.uuid
+        self._unindex_vm(uuid)
+        name = vm_model.name
+        self._vms_by_name.setdefault(name, {})[uuid] = vm_model
+        self._vm_index_keys[uuid] = name
+
+    def _unindex_vm(self, uuid):
+        name = self._vm_index_keys.pop(uuid, None)
+        _remove_from_index(self._vms_by_name, name, uuid)
+
+    def _index_vn(self, vn_model):
+        key = vn_model.key
+        self._unindex_vn(key)
+        uuid = vn_model.uuid
+        self._vns_by_uuid.setdefault(uuid, {})[key] = vn_model
+        self._vn_index_keys[key] = uuid
+
+    def _unindex_vn(self, key):
+        uuid = self._vn_index_keys.pop(key, None)
+        _remove_from_index(self._vns_by_uuid, uuid, key)
+
+    def _index_vmi(self, vmi_model):
+        uuid = vmi_model.uuid
+        self._unindex_vmi(uuid)
+        vm_uuid = vmi_model.vm_model.uuid if vmi_model.vm_model else None
+        vn_uuid = vmi_model.vn_model.uuid if vmi_model.vn_model else None
+        vlan_id = vmi_model.vcenter_port.vlan_id
+        self._vmis_by_vm_uuid.setdefault(vm_uuid, {})[uuid] = vmi_model
+        self._vmis_by_vn_uuid.setdefault(vn_uuid, {})[uuid] = vmi_model
+        self._vmis_by_vlan_id.setdefault(vlan_id, {})[uuid] = vmi_model
+        self._vmi_index_keys[uuid] = (vm_uuid, vn_uuid, vlan_id)
+
+    def _unindex_vmi(self, uuid):
+        index_keys = self._vmi_index_keys.pop(uuid, None)
+        if index_keys is None:
+            return
+        vm_uuid, vn_uuid, vlan_id = index_keys
+        _remove_from_index(self._vmis_by_vm_uuid, vm_uuid, uuid)
+        _remove_from_index(self._vmis_by_vn_uuid, vn_uuid, uuid)
+        _remove_from_index(self._vmis_by_vlan_id, vlan_id, uuid)
+
+
+VirtualMachineRecord = namedtuple('VirtualMachineRecord', ('uuid', 'name', 'host_uuid', 'power_state'))
+VirtualNetworkRecord = namedtuple('VirtualNetworkRecord', ('uuid', 'key', 'name'))
+VirtualMachineInterfaceRecord = namedtuple('VirtualMachineInterfaceRecord', (
+    'uuid', 'display_name', 'mac_address', 'port_key', 'ip_address', 'vm_uuid', 'vn_uuid', 'vlan_id'
+))
+
+
+class DatabaseSnapshot(object):
+    """ Immutable copy of the models at one point in time.
+
+    Records and indexes which did not change are shared with the previous
+    snapshot, so that snapshots of a mostly unchanged database are cheap.
+    """
+
+    def __init__(self, vm_models=(), vn_models=(), vmi_models=(), previous=None):
+        self._vms = {}
+        self._vns = {}
+        self._vmis = {}
+        self._vm_uuids_by_name = {}
+        self._vm_uuids_by_host_uuid = {}
+        self._vm_uuids_by_power_state = {}
+        self._vn_keys_by_uuid = {}
+        self._vmi_uuids_by_vm_uuid = {}
+        self._vmi_uuids_by_vn_uuid = {}
+        self._vmi_uuids_by_vlan_id = {}
+        # Pages are cut out of sorted keys, so that a cursor stays valid
+        # even if objects before it are added or removed
+        self._sorted_vm_uuids = []
+        self._sorted_vn_keys = []
+        self._sorted_vmi_uuids = []
+        self._sorted_vlan_ids = []
+        previous = previous or self
+        self._apply(
+            previous._make_records(dict((vm_model.uuid, vm_model) for vm_model in vm_models),
+                                   _make_vm_record, previous._vms),
+            previous._make_records(dict((vn_model.key, vn_model) for vn_model in vn_models),
+                                   _make_vn_record, previous._vns),
+            previous._make_records(dict((vmi_model.uuid, vmi_model) for vmi_model in vmi_models),
+                                   _make_vmi_record, previous._vmis),
+        )
+
+    def update(self, vm_models, vn_models, vmi_models):
+        """ Returns a new snapshot with the given models (None for deleted ones) replaced by key. """
+        snapshot = object.__new__(DatabaseSnapshot)
+        snapshot.__dict__ = dict((name, value.copy() if isinstance(value, dict) else value)
+                                 for name, value in self.__dict__.items())
+        snapshot._apply(
+            self._make_records(vm_models, _make_vm_record, self._vms),
+            self._make_records(vn_models, _make_vn_record, self._vns),
+            self._make_records(vmi_models, _make_vmi_record, self._vmis),
+        )
+        return snapshot
+
+    @staticmethod
+    def _make_records(models, make_record, previous_records):
+        records = {}
+        for key, model in models.items():
+            record = make_record(model) if model is not None else None
+            previous_record = previous_records.get(key)
+            records[key] = previous_record if previous_record == record else record
+        return records
+
+    def _apply(self, vm_records, vn_records, vmi_records):
+        # Index buckets are shared with the previous snapshot until they are
+        # copied, which happens at most once per snapshot
+        owned = set()
+        vm_uuids = self._apply_records(self._vms, vm_records, owned, (
+            (self._vm_uuids_by_name, attrgetter('name')),
+            (self._vm_uuids_by_host_uuid, attrgetter('host_uuid')),
+            (self._vm_uuids_by_power_state, attrgetter('power_state')),
+        ))
+        vn_keys = self._apply_records(self._vns, vn_records, owned, (
+            (self._vn_keys_by_uuid, attrgetter('uuid')),
+        ))
+        vlan_ids = set(self._vmi_uuids_by_vlan_id)
+        vmi_uuids = self._apply_records(self._vmis, vmi_records, owned, (
+            (self._vmi_uuids_by_vm_uuid, attrgetter('vm_uuid')),
+            (self._vmi_uuids_by_vn_uuid, attrgetter('vn_uuid')),
+            (self._vmi_uuids_by_vlan_id, attrgetter('vlan_id')),
+        ))
+        self._sorted_vm_uuids = _update_sorted_keys(self._sorted_vm_uuids, *vm_uuids)
+        self._sorted_vn_keys = _update_sorted_keys(self._sorted_vn_keys, *vn_keys)
+        self._sorted_vmi_uuids = _update_sorted_keys(self._sorted_vmi_uuids, *vmi_uuids)
+        if set(self._vmi_uuids_by_vlan_id) != vlan_ids:
+            self._sorted_vlan_ids = sorted(vlan_id for vlan_id in self._vmi_uuids_by_vlan_id if vlan_id is not None)
+
+    @staticmethod
+    def _apply_records(records, new_records, owned, indexes):
+        """ Replaces records by key and returns the keys which were added and removed. """
+        added, removed = set(), set()
+        for key, record in new_records.items():
+            old_record = records.get(key)
+            if old_record is record:
+                continue
+            for index, index_key in indexes:
+                if old_record is not None:
+                    _discard_from_bucket(index, index_key(old_record), key, owned)
+                if record is not None:
+                    _add_to_bucket(index, index_key(record), key, owned)
+            if record is None:
+                del records[key]
+                removed.add(key)
+            else:
+                records[key] = record
+                if old_record is None:
+                    added.add(key)
+        return added, removed
+
+    def get_all_vms(self):
+        return list(self._vms.values())
+
+    def get_vm_by_uuid(self, uuid):
+        return self._vms.get(uuid)
+
+    def get_vm_by_name(self, name):
+        return self._vms.get(min(self._vm_uuids_by_name.get(name) or [None]))
+
+    def get_all_vns(self):
+        return list(self._vns.values())
+
+    def get_vn_by_key(self, key):
+        return self._vns.get(key)
+
+    def get_vn_by_uuid(self, uuid):
+        return self._vns.get(min(self._vn_keys_by_uuid.get(uuid) or [None]))
+
+    def get_all_vmis(self):
+        return list(self._vmis.values())
+
+    def get_vmi_by_uuid(self, uuid):
+        return self._vmis.get(uuid)
+
+    def get_vmis_by_vm_uuid(self, uuid):
+        return [self._vmis[vmi_uuid] for vmi_uuid in sorted(self._vmi_uuids_by_vm_uuid.get(uuid, ()))]
+
+    def get_vmis_by_vn_uuid(self, uuid):
+        return [self._vmis[vmi_uuid] for vmi_uuid in sorted(self._vmi_uuids_by_vn_uuid.get(uuid, ()))]
+
+    def find_vms(self, host_uuid=None, power_state=None, vn_uuid=None, start=None, limit=None):
+        """ Returns a page of matching VMs, sorted by UUID, and the UUID the next page starts at. """
+        vm_uuids = self._sorted_vm_uuids
+        filters = []
+        if host_uuid is not None:
+            filters.append(self._vm_uuids_by_host_uuid.get(host_uuid, ()))
+        if power_state is not None:
+            filters.append(self._vm_uuids_by_power_state.get(power_state, ()))
+        if vn_uuid is not None:
+            filters.append(set(vmi.vm_uuid for vmi in self.get_vmis_by_vn_uuid(vn_uuid)))
+        if filters:
+            vm_uuids = sorted(set.intersection(*[set(uuids) for uuids in filters]))
+        page, next_cursor = _paginate(vm_uuids, start, limit)
+        return [self._vms[uuid] for uuid in page], next_cursor
+
+    def find_vns(self, start=None, limit=None):
+        """ Returns a page of VNs, sorted by key, and the key the next page starts at. """
+        page, next_cursor = _paginate(self._sorted_vn_keys, start, limit)
+        return [self._vns[key] for key in page], next_cursor
+
+    def find_vmis(self, host_uuid=None, power_state=None, vn_uuid=None, min_vlan_id=None, max_vlan_id=None,
+                  start=None, limit=None):
+        """ Returns a page of matching VMIs, sorted by UUID, and the UUID the next page starts at. """
+        vmi_uuids = self._sorted_vmi_uuids
+        filters = []
+        if host_uuid is not None or power_state is not None:
+            vms, _ = self.find_vms(host_uuid=host_uuid, power_state=power_state)
+            filters.append([vmi_uuid for vm in vms for vmi_uuid in self._vmi_uuids_by_vm_uuid.get(vm.uuid, [])])
+        if vn_uuid is not None:
+            filters.append(self._vmi_uuids_by_vn_uuid.get(vn_uuid, []))
+        if min_vlan_id is not None or max_vlan_id is not None:
+            filters.append(self._get_vmi_uuids_by_vlan_range(min_vlan_id, max_vlan_id))
+        if filters:
+            vmi_uuids = sorted(set.intersection(*[set(uuids) for uuids in filters]))
+        page, next_cursor = _paginate(vmi_uuids, start, limit)
+        return [self._vmis[uuid] for uuid in page], next_cursor
+
+    def _get_vmi_uuids_by_vlan_range(self, min_vlan_id, max_vlan_id):
+        vlan_ids = self._sorted_vlan_ids
+        first = bisect.bisect_left(vlan_ids, min_vlan_id) if min_vlan_id is not None else 0
+        last = bisect.bisect_right(vlan_ids, max_vlan_id) if max_vlan_id is not None else len(vlan_ids)
+        return [vmi_uuid for vlan_id in vlan_ids[first:last] for vmi_uuid in self._vmi_uuids_by_vlan_id[vlan_id]]
+
+
+def _paginate(keys, start, limit):
+    first = bisect.bisect_left(keys, start) if start else 0
+    last = first + limit if limit else len(keys)
+    next_cursor = keys[last] if last < len(keys) else None
+    return keys[first:last], next_cursor
+
+
+def _update_sorted_keys(keys, added, removed):
+    if not added and not removed:
+        return keys
+    keys = [key for key in keys if key not in removed]
+    # Both runs are sorted already, so sorting merges them in linear time
+    keys.extend(sorted(added))
+    keys.sort()
+    return keys
+
+
+def _add_to_bucket(index, index_key, key, owned):
+    bucket = index.get(index_key)
+    if (id(index), index_key) not in owned:
+        bucket = set(bucket or ())
+        index[index_key] = bucket
+        owned.add((id(index), index_key))
+    bucket.add(key)
+
+
+def _discard_from_bucket(index, index_key, key, owned):
+    bucket = index.get(index_key)
+    if bucket is None:
+        return
+    if (id(index), index_key) not in owned:
+        bucket = set(bucket)
+        index[index_key] = bucket
+        owned.add((id(index), index_key))
+    bucket.discard(key)
+    if not bucket:
+        del index[index_key]
+        owned.discard((id(index), index_key))
+
+
+def _make_vm_record(vm_model):
+    return VirtualMachineRecord(vm_model.uuid, vm_model.name, vm_model.host_uuid, vm_model.power_state)
+
+
+def _make_vn_record(vn_model):
+    return VirtualNetworkRecord(vn_model.uuid, vn_model.key, vn_model.name)
+
+
+def _make_vmi_record(vmi_model):
+    ip_address = None
+    if vmi_model.vnc_instance_ip is not None:
+        ip_address = vmi_model.vnc_instance_ip.instance_ip_address
+    vm_uuid = vmi_model.vm_model.uuid if vmi_model.vm_model else None
+    vn_uuid = vmi_model.vn_model.uuid if vmi_model.vn_model else None
+    vcenter_port = vmi_model.vcenter_port
+    return VirtualMachineInterfaceRecord(
+        vmi_model.uuid, vmi_model.display_name, vcenter_port.mac_address, vcenter_port.port_key,
+        ip_address, vm_uuid, vn_uuid, vcenter_port.vlan_id
+    )
+
+
+class WorkQueue(object):
+    """ Ordered queue of pending work, holding at most one item per key.
+
+    Appending an item whose key is already queued replaces the queued item
+    in place, so repeated updates of the same object are processed once.
+    """
+
+    def __init__(self, key=None):
+        self._holds_keys = key is None
+        self._key = key or (lambda item: item)
+        self._items = OrderedDict()
+
+    def append(self, item):
+        self._items[self._key(item)] = item
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def remove(self, item):
+        # A newer item with the same key could have been queued while this
+        # one was processed, it must not be lost
+        key = self._key(item)
+        if key in self._items and (self._holds_keys or self._items[key] is item):
+            del self._items[key]
+
+    def popleft(self):
+        _, item = self._items.popitem(last=False)
+        return item
+
+    def clear(self):
+        self._items.clear()
+
+    def __contains__(self, item):
+        return self._key(item) in self._items
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return 'WorkQueue(%s)' % list(self._items.values())
+
+
+def _remove_from_index(index, index_key, primary_key):
+    models = index.get(index_key)
+    if models is None:
+        return
+    models.pop(primary_key, None)
+    if not models:
+        del index[index_key]
@@ -1,22 +1,28 @@
 from builtins import object
 import logging
 
-from cvm.constants import EVENTS_TO_OBSERVE, WAIT_FOR_UPDATE_TIMEOUT
+from cvm.constants import (EVENTS_TO_OBSERVE, VM_UPDATE_FILTERS,
+                           WAIT_FOR_UPDATE_TIMEOUT)
 
 logger = logging.getLogger(__name__)
 
 
 class EventListener(object):
-    def __init__(self, controller, update_set_queue, esxi_api_client, database):
+    def __init__(self, controller, update_set_queue, esxi_api_client, database,
+                 shared_property_filter=False):
         self._controller = controller
         self._esxi_api_client = esxi_api_client
         self._database = database
         self._update_set_queue = update_set_queue
+        self._shared_property_filter = shared_property_filter
+        self._synced = False
 
     def listen(self, to_supervisor):
         logger.info('Event listener greenlet start working')
         event_history_collector = self._esxi_api_client.create_event_history_collector(EVENTS_TO_OBSERVE)
         self._esxi_api_client.add_filter(event_history_collector, ['latestPage'])
+        if self._shared_property_filter:
+            self._esxi_api_client.add_vms_filter(VM_UPDATE_FILTERS)
         self._esxi_api_client.make_wait_options(WAIT_FOR_UPDATE_TIMEOUT)
         self._safe_wait_for_update(to_supervisor)
         self._sync()
@@ -26,8 +32,14 @@ class EventListener(object):
                 self._update_set_queue.put(update_set)
 
     def _sync(self):
+        # After a reconnect, the database is kept and only what changed
+        # in ESXi meanwhile is processed again
+        if self._synced:
+            self._controller.resync()
+            return
         self._database.clear_database()
         self._controller.sync()
+        self._synced = True
 
     def _safe_wait_for_update(self, to_supervisor):
         to_supervisor.put('START_WAIT_FOR_UPDATES')
@@ -3,7 +3,7 @@ from builtins import range
 from builtins import object
 import logging
 import uuid
-from collections import deque
+from collections import OrderedDict
 
 from pyVmomi import vim  # pylint: disable=no-name-in-module
 from vnc_api.vnc_api import (InstanceIp, MacAddressesType, VirtualMachine,
@@ -24,49 +24,80 @@ def find_vrouter_uuid(host):
     return None
 
 
+def read_devices(vmware_vm, vm_properties):
+    # Devices prefetched during sync are kept out of vm_properties,
+    # which is logged on every update
+    devices = vm_properties.pop('config.hardware.device', None)
+    if devices is None:
+        devices = vmware_vm.config.hardware.device
+    return devices
+
+
+# VM properties kept by VirtualMachineModel and the fields holding them
+VM_MODEL_FIELDS = (
+    ('config.instanceUuid', 'uuid'),
+    ('name', 'name'),
+    ('runtime.powerState', 'power_state'),
+    ('guest.toolsRunningStatus', 'tools_running_status'),
+    ('config.changeVersion', 'change_version'),
+)
+
+
 class VirtualMachineModel(object):
+    # Only the fields CVM needs are extracted from vmware_vm's properties
+    # and devices, neither of which is kept
+    __slots__ = ('vmware_vm', 'uuid', 'name', 'host_uuid', 'power_state', 'tools_running_status',
+                 'change_version', 'property_filter', 'ports', 'vmi_models', '_vnc_vm', '_vnc_vm_inputs')
+
     def __init__(self, vmware_vm, vm_properties):
-        self.vmware_vm = vmware_vm
-        self.vm_properties = vm_properties
-        self.devices = vmware_vm.config.hardware.device
-        host = vm_properties['summary.runtime.host']
-        self.host_uuid = host.hardware.systemInfo.uuid
         self.property_filter = None
-        self.ports = self._read_ports()
+        self._vnc_vm = None
+        self._vnc_vm_inputs = None
+        self.update(vmware_vm, vm_properties)
         self.vmi_models = self._construct_interfaces()
 
     def update(self, vmware_vm, vm_properties):
         self.vmware_vm = vmware_vm
-        self.vm_properties = vm_properties
-        self.devices = vmware_vm.config.hardware.device
+        for property_name, field in VM_MODEL_FIELDS:
+            setattr(self, field, vm_properties.get(property_name))
         host = vm_properties['summary.runtime.host']
         self.host_uuid = host.hardware.systemInfo.uuid
-        self.ports = self._read_ports()
+        self.ports = self._read_ports(read_devices(vmware_vm, vm_properties))
 
     def rename(self, name):
-        self.vm_properties['name'] = name
+        self.name = name
+
+    def is_changed(self, vm_properties):
+        # config.changeVersion changes with every reconfiguration,
+        # including changes of the VM's devices
+        return any(vm_properties.get(property_name) != getattr(self, field)
+                   for property_name, field in VM_MODEL_FIELDS)
+
+    def are_interfaces_changed(self):
+        # update() reads the VM's ports, but keeps its interfaces
+        return [vmi_model.vcenter_port.identity for vmi_model in self.vmi_models] != \
+            [port.identity for port in self.ports or ()]
 
     def update_interfaces(self, vmware_vm):
-        self.devices = vmware_vm.config.hardware.device
-        self.ports = self._read_ports()
+        self.ports = self._read_ports(vmware_vm.config.hardware.device)
         self.vmi_models = self._construct_interfaces()
 
     def is_tools_running_status_changed(self, tools_running_status):
-        return tools_running_status != self.vm_properties['guest.toolsRunningStatus']
+        return tools_running_status != self.tools_running_status
 
     def update_tools_running_status(self, tools_running_status):
-        self.vm_properties['guest.toolsRunningStatus'] = tools_running_status
+        self.tools_running_status = tools_running_status
 
     def is_power_state_changed(self, power_state):
-        return power_state != self.vm_properties['runtime.powerState']
+        return power_state != self.power_state
 
     def update_power_state(self, power_state):
-        self.vm_properties['runtime.powerState'] = power_state
+        self.power_state = power_state
 
-    def _read_ports(self):
+    def _read_ports(self, devices):
         try:
             return [VCenterPort(device)
-                    for device in self.devices
+                    for device in devices
                     if isinstance(device.backing, vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo)]
         except AttributeError:
             logger.error('Could not read ports for %s.', self.name)
@@ -77,26 +108,27 @@ class VirtualMachineModel(object):
                 for port in self.ports]
 
     def destroy_property_filter(self):
+        if self.property_filter is None:
+            return
         self.property_filter.DestroyPropertyFilter()
 
-    @property
-    def uuid(self):
-        return self.vm_properties.get('config.instanceUuid')
-
-    @property
-    def name(self):
-        return self.vm_properties.get('name')
-
     @property
     def is_powered_on(self):
-        return self.vm_properties.get('runtime.powerState') == 'poweredOn'
+        return self.power_state == 'poweredOn'
 
     @property
     def tools_running(self):
-        return self.vm_properties.get('guest.toolsRunningStatus') == 'guestToolsRunning'
+        return self.tools_running_status == 'guestToolsRunning'
 
     @property
     def vnc_vm(self):
+        inputs = (self.uuid, self.name)
+        if self._vnc_vm is None or self._vnc_vm_inputs != inputs:
+            self._vnc_vm = self._construct_new_vnc_vm()
+            self._vnc_vm_inputs = inputs
+        return self._vnc_vm
+
+    def _construct_new_vnc_vm(self):
         vnc_vm = VirtualMachine(name=self.uuid,
                                 display_name=self.name,
                                 id_perms=ID_PERMS)
@@ -104,9 +136,9 @@ class VirtualMachineModel(object):
         return vnc_vm
 
     def __repr__(self):
-        return 'VirtualMachineModel(uuid=%s, name=%s, vm_properties=%s, interfaces=%s)' % \
-               (self.uuid, self.name, self.vm_properties,
-                [vmi_model.uuid for vmi_model in self.vmi_models])
+        return 'VirtualMachineModel(uuid=%s, name=%s, host_uuid=%s, power_state=%s, tools_running_status=%s, ' \
+               'interfaces=%s)' % (self.uuid, self.name, self.host_uuid, self.power_state, self.tools_running_status,
+                                   [vmi_model.uuid for vmi_model in self.vmi_models])
 
 
 class VirtualNetworkModel(object):
@@ -137,6 +169,9 @@ class VirtualNetworkModel(object):
 
 
 class VirtualMachineInterfaceModel(object):
+    __slots__ = ('vm_model', 'vn_model', 'vcenter_port', '_ip_address', 'vnc_instance_ip', 'parent',
+                 'security_group', '_vnc_vmi', '_vnc_vmi_inputs', 'applied_fingerprint')
+
     def __init__(self, vm_model, vn_model, vcenter_port):
         self.vm_model = vm_model
         self.vn_model = vn_model
@@ -146,6 +181,8 @@ class VirtualMachineInterfaceModel(object):
         self.parent = None
         self.security_group = None
         self._vnc_vmi = None
+        self._vnc_vmi_inputs = None
+        self.applied_fingerprint = None
 
     @property
     def uuid(self):
@@ -163,11 +200,22 @@ class VirtualMachineInterfaceModel(object):
 
     @property
     def vnc_vmi(self):
-        return self._construct_new_vnc_vmi()
+        # Rebuilt only when one of the objects it's constructed from changes
+        inputs = self._vnc_vmi_inputs_now()
+        if self._vnc_vmi is None or self._vnc_vmi_inputs != inputs:
+            self._vnc_vmi = self._construct_new_vnc_vmi()
+            self._vnc_vmi_inputs = inputs
+        return self._vnc_vmi
 
     @vnc_vmi.setter
     def vnc_vmi(self, vmi):
         self._vnc_vmi = vmi
+        self._vnc_vmi_inputs = self._vnc_vmi_inputs_now()
+
+    def _vnc_vmi_inputs_now(self):
+        vnc_vn = self.vn_model.vnc_vn if self.vn_model else None
+        return (self.vcenter_port.mac_address, self.display_name, self.parent,
+                self.security_group, vnc_vn, self.vm_model.vnc_vm)
 
     def _construct_new_vnc_vmi(self):
         vmi = VirtualMachineInterface(name=self.uuid,
@@ -183,6 +231,21 @@ class VirtualMachineInterfaceModel(object):
         vmi.set_security_group(self.security_group)
         return vmi
 
+    @property
+    def fingerprint(self):
+        # Desired state of the interface, the portgroup determines its VN
+        return (self.vcenter_port.portgroup_key, self.vcenter_port.mac_address, self._ip_address,
+                self.vcenter_port.vlan_id, self.display_name, self.vm_model.is_powered_on)
+
+    def is_applied(self):
+        # The VLAN ID is set in the background, a failed one has to be set again
+        if self.vm_model.is_powered_on and not self.vcenter_port.vlan_success:
+            return False
+        return self.applied_fingerprint == self.fingerprint
+
+    def mark_applied(self):
+        self.applied_fingerprint = self.fingerprint
+
     def update_ip_address(self, ip_address):
         if ip_address != self._ip_address:
             self._ip_address = ip_address
@@ -243,26 +306,28 @@ class VirtualMachineInterfaceModel(object):
 
 class VlanIdPool(object):
     def __init__(self, start, end):
-        self._available_ids = deque(list(range(start, end + 1)))
+        # Ordered free list: IDs are handed out from the front and freed IDs
+        # go to the back, while membership checks and removals are O(1).
+        self._available_ids = OrderedDict((vlan_id, None) for vlan_id in range(start, end + 1))
 
     def reserve(self, vlan_id):
         try:
-            self._available_ids.remove(vlan_id)
+            self._available_ids.pop(vlan_id)
             logger.info('Reserved VLAN %s', vlan_id)
-        except ValueError:
+        except KeyError:
             pass
 
     def get_available(self):
         try:
-            vlan_id = self._available_ids.popleft()
+            vlan_id, _ = self._available_ids.popitem(last=False)
             logger.info('Reserved VLAN %s', vlan_id)
             return vlan_id
-        except IndexError:
+        except KeyError:
             raise Exception('No viable VLAN ID')
 
     def free(self, vlan_id):
         if vlan_id not in self._available_ids:
-            self._available_ids.append(vlan_id)
+            self._available_ids[vlan_id] = None
         logger.info('Freed VLAN %s', vlan_id)
 
     def is_available(self, vlan_id):
@@ -270,14 +335,20 @@ class VlanIdPool(object):
 
 
 class VCenterPort(object):
+    __slots__ = ('mac_address', 'port_key', 'portgroup_key', 'device_key', 'vlan_id', 'vlan_success')
+
     def __init__(self, device):
-        self.device = device
         self.mac_address = device.macAddress
+        self.device_key = device.key
         self.port_key = device.backing.port.portKey
         self.portgroup_key = device.backing.port.portgroupKey
         self.vlan_id = None
         self.vlan_success = False
 
+    @property
+    def identity(self):
+        return self.mac_address, self.port_key, self.portgroup_key
+
     def __repr__(self):
         return 'VCenterPort(mac_address=%s, port_key=%s, portgroup_key=%s, vlan_id=%s, vlan_success=%s)' \
                % (self.mac_address, self.port_key, self.portgroup_key, self.vlan_id, self.vlan_success)
@@ -1,6 +1,10 @@
 from builtins import object
+import gevent
 import logging
 
+from cvm.constants import (UPDATE_SET_BATCH_SIZE, UPDATE_SET_BATCH_WINDOW,
+                           VM_REMOVAL_CHECK_INTERVAL)
+
 logger = logging.getLogger(__name__)
 
 
@@ -11,5 +15,26 @@ class VMwareMonitor(object):
 
     def monitor(self):
         while True:
-            update_set = self._update_set_queue.get()
-            self._controller.handle_update(update_set)
+            self._controller.handle_updates(self._get_update_sets())
+
+    def _get_update_sets(self):
+        update_sets = [self._update_set_queue.get()]
+        # Changes of one VM (e.g. creation, reconfiguration and powering on)
+        # usually come in a burst, so they are given a moment to be batched
+        gevent.sleep(UPDATE_SET_BATCH_WINDOW)
+        while len(update_sets) < UPDATE_SET_BATCH_SIZE and not self._update_set_queue.empty():
+            update_sets.append(self._update_set_queue.get_nowait())
+        return update_sets
+
+
+class VmRemovalMonitor(object):
+    def __init__(self, vmware_controller):
+        self._controller = vmware_controller
+
+    def monitor(self):
+        while True:
+            gevent.sleep(VM_REMOVAL_CHECK_INTERVAL)
+            try:
+                self._controller.confirm_vm_removals()
+            except Exception as exc:
+                logger.error('Unexpected exception %s during confirming VM removals', exc, exc_info=True)
@@ -5,6 +5,7 @@ import greenlet
 from cfgm_common.uve.greenlets.ttypes import (GreenletObjectReq,
                                               GreenletObject,
                                               GreenletObjectListResp)
+from cvm.constants import INTROSPECT_MAX_PAGE_SIZE, INTROSPECT_PAGE_SIZE
 from cvm.sandesh.vcenter_manager.ttypes import (VirtualMachineData,
                                                 VirtualMachineInterfaceData,
                                                 VirtualMachineInterfaceRequest,
@@ -17,10 +18,8 @@ from cvm.sandesh.vcenter_manager.ttypes import (VirtualMachineData,
 
 
 class SandeshHandler(object):
-    def __init__(self, database, lock):
+    def __init__(self, database):
         self._database = database
-        self._lock = lock
-        self._converter = SandeshConverter(self._database)
 
     def bind_handlers(self):
         VirtualMachineRequest.handle_request = self.handle_virtual_machine_request
@@ -29,43 +28,62 @@ class SandeshHandler(object):
         GreenletObjectReq.handle_request = self.handle_greenlet_obj_list_request
 
     def handle_virtual_machine_request(self, request):
-        with self._lock:
-            if request.uuid is not None:
-                vm_models = [self._database.get_vm_model_by_uuid(request.uuid)]
-            elif request.name is not None:
-                vm_models = [self._database.get_vm_model_by_name(request.name)]
-            else:
-                vm_models = self._database.get_all_vm_models()
-            virtual_machines_data = [
-                self._converter.convert_vm(vm_model) for vm_model in vm_models if vm_model is not None
-            ]
-        response = VirtualMachineResponse(virtual_machines_data)
+        # The snapshot is immutable, so no lock is needed
+        snapshot = self._database.snapshot
+        next_cursor = None
+        if request.uuid is not None:
+            vms = [snapshot.get_vm_by_uuid(request.uuid)]
+        elif request.name is not None:
+            vms = [snapshot.get_vm_by_name(request.name)]
+        else:
+            vms, next_cursor = snapshot.find_vms(
+                host_uuid=request.host_uuid,
+                power_state=request.power_state,
+                vn_uuid=request.vn_uuid,
+                start=request.start,
+                limit=get_page_size(request)
+            )
+        converter = SandeshConverter(snapshot)
+        virtual_machines_data = [converter.convert_vm(vm) for vm in vms if vm is not None]
+        response = VirtualMachineResponse(virtual_machines_data, next_cursor)
         response.response(request.context())
 
     def handle_virtual_network_request(self, request):
-        with self._lock:
+        snapshot = self._database.snapshot
+        converter = SandeshConverter(snapshot)
+        if request.uuid is not None or request.key is not None:
             if request.uuid is not None:
-                vn_models = [self._database.get_vn_model_by_uuid(request.uuid)]
-            elif request.key is not None:
-                vn_models = [self._database.get_vn_model_by_key(request.key)]
+                vn = snapshot.get_vn_by_uuid(request.uuid)
             else:
-                vn_models = self._database.get_all_vn_models()
-            virtual_networks_data = [
-                self._converter.convert_vn(vn_model) for vn_model in vn_models if vn_model is not None
-            ]
-        response = VirtualNetworkResponse(virtual_networks_data)
+                vn = snapshot.get_vn_by_key(request.key)
+            virtual_networks_data = [converter.convert_vn(vn)] if vn is not None else []
+            next_cursor = None
+        else:
+            # Interfaces of listed VNs are left out, they can be paged
+            # through with VirtualMachineInterfaceRequest filtered by VN
+            vns, next_cursor = snapshot.find_vns(start=request.start, limit=get_page_size(request))
+            virtual_networks_data = [converter.convert_vn(vn, with_interfaces=False) for vn in vns]
+        response = VirtualNetworkResponse(virtual_networks_data, next_cursor)
         response.response(request.context())
 
     def handle_virtual_machine_interface_request(self, request):
-        with self._lock:
-            if request.uuid is not None:
-                vmi_models = [self._database.get_vmi_model_by_uuid(request.uuid)]
-            else:
-                vmi_models = self._database.get_all_vmi_models()
-            virtual_interfaces_data = [
-                self._converter.convert_vmi(vmi_model) for vmi_model in vmi_models if vmi_model is not None
-            ]
-        response = VirtualMachineInterfaceResponse(virtual_interfaces_data)
+        snapshot = self._database.snapshot
+        next_cursor = None
+        if request.uuid is not None:
+            vmis = [snapshot.get_vmi_by_uuid(request.uuid)]
+        else:
+            vmis, next_cursor = snapshot.find_vmis(
+                host_uuid=request.host_uuid,
+                power_state=request.power_state,
+                vn_uuid=request.vn_uuid,
+                min_vlan_id=request.min_vlan_id,
+                max_vlan_id=request.max_vlan_id,
+                start=request.start,
+                limit=get_page_size(request)
+            )
+        converter = SandeshConverter(snapshot)
+        virtual_interfaces_data = [converter.convert_vmi(vmi) for vmi in vmis if vmi is not None]
+        response = VirtualMachineInterfaceResponse(virtual_interfaces_data, next_cursor)
         response.response(request.context())
 
     @classmethod
@@ -97,39 +115,43 @@ class SandeshHandler(object):
 
 
 class SandeshConverter(object):
-    def __init__(self, database):
-        self._database = database
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
 
-    def convert_vm(self, vm_model):
-        vmi_models = self._database.get_vmi_models_by_vm_uuid(vm_model.uuid)
+    def convert_vm(self, vm):
+        vmis = self._snapshot.get_vmis_by_vm_uuid(vm.uuid)
         return VirtualMachineData(
-            uuid=vm_model.uuid,
-            name=vm_model.name,
-            host_uuid=vm_model.host_uuid,
-            interfaces=[self.convert_vmi(vmi_model) for vmi_model in vmi_models]
+            uuid=vm.uuid,
+            name=vm.name,
+            host_uuid=vm.host_uuid,
+            interfaces=[self.convert_vmi(vmi) for vmi in vmis],
+            power_state=vm.power_state
         )
 
-    def convert_vn(self, vn_model):
-        vmi_models = self._database.get_vmi_models_by_vn_uuid(vn_model.uuid)
+    def convert_vn(self, vn, with_interfaces=True):
+        vmis = self._snapshot.get_vmis_by_vn_uuid(vn.uuid) if with_interfaces else []
         return VirtualNetworkData(
-            uuid=vn_model.uuid,
-            key=vn_model.key,
-            name=vn_model.name,
-            interfaces=[self.convert_vmi(vmi_model) for vmi_model in vmi_models]
+            uuid=vn.uuid,
+            key=vn.key,
+            name=vn.name,
+            interfaces=[self.convert_vmi(vmi) for vmi in vmis]
         )
 
-    def convert_vmi(self, vmi_model):
-        if vmi_model.vnc_instance_ip is not None:
-            ip_address = vmi_model.vnc_instance_ip.instance_ip_address
-        if ip_address is None:
-            ip_address = '-'
+    @staticmethod
+    def convert_vmi(vmi):
         return VirtualMachineInterfaceData(
-            uuid=vmi_model.uuid,
-            display_name=vmi_model.display_name,
-            mac_address=vmi_model.vcenter_port.mac_address,
-            port_key=vmi_model.vcenter_port.port_key,
-            ip_address=ip_address,
-            vm_uuid=vmi_model.vm_model.uuid,
-            vn_uuid=vmi_model.vn_model.uuid,
-            vlan_id=vmi_model.vcenter_port.vlan_id,
+            uuid=vmi.uuid,
+            display_name=vmi.display_name,
+            mac_address=vmi.mac_address,
+            port_key=vmi.port_key,
+            ip_address=vmi.ip_address or '-',
+            vm_uuid=vmi.vm_uuid,
+            vn_uuid=vmi.vn_uuid,
+            vlan_id=vmi.vlan_id,
         )
+
+
+def get_page_size(request):
+    if not request.limit:
+        return INTROSPECT_PAGE_SIZE
+    return min(request.limit, INTROSPECT_MAX_PAGE_SIZE)
@@ -2,26 +2,60 @@ from builtins import str
 from builtins import next
 from builtins import range
 from builtins import object
+import collections
 import ipaddress
 import logging
 import time
 
+import gevent
+import gevent.pool
 from pyVmomi import vmodl  # pylint: disable=no-name-in-module
 from vnc_api.gen.resource_xsd import PermType2
 from cvm.constants import (CONTRAIL_VM_NAME, VM_UPDATE_FILTERS,
                            VNC_ROOT_DOMAIN, VNC_VCENTER_PROJECT,
                            WAIT_FOR_PORT_RETRY_TIME, WAIT_FOR_PORT_RETRY_LIMIT,
-                           SET_VLAN_ID_RETRY_LIMIT)
+                           WAIT_FOR_PORT_TIMEOUT, SET_VLAN_ID_RETRY_LIMIT,
+                           VM_REMOVAL_TIMEOUT, VNC_WORKER_POOL_SIZE)
 from cvm.models import (VirtualMachineInterfaceModel, VirtualMachineModel,
                         VirtualNetworkModel)
 
 logger = logging.getLogger(__name__)
 
 
+class OrderedPool(object):
+    """ Bounded pool of greenlets, which runs jobs with the same key one after another. """
+
+    def __init__(self, size):
+        self._pool = gevent.pool.Pool(size)
+        self._last_jobs = {}
+
+    def spawn(self, key, func, *args):
+        previous_job = self._last_jobs.get(key)
+        job = self._pool.spawn(self._run_after, previous_job, func, *args)
+        self._last_jobs[key] = job
+        job.link(lambda finished_job: self._forget(key, finished_job))
+        return job
+
+    @staticmethod
+    def _run_after(previous_job, func, *args):
+        if previous_job is not None:
+            previous_job.join()
+        return func(*args)
+
+    def _forget(self, key, job):
+        if self._last_jobs.get(key) is job:
+            del self._last_jobs[key]
+
+    def join(self):
+        self._pool.join()
+
+
 class Service(object):
-    def __init__(self, vnc_api_client, database, esxi_api_client=None, vcenter_api_client=None):
+    def __init__(self, vnc_api_client, database, esxi_api_client=None, vcenter_api_client=None,
+                 vnc_workers=None):
         self._vnc_api_client = vnc_api_client
         self._database = database
+        self._vnc_workers = vnc_workers or OrderedPool(VNC_WORKER_POOL_SIZE)
         self._esxi_api_client = esxi_api_client
         self._vcenter_api_client = vcenter_api_client
         self._project = self._vnc_api_client.read_or_create_project()
@@ -33,28 +67,47 @@ class Service(object):
 
 class VirtualMachineInterfaceService(Service):
     def __init__(self, vcenter_api_client, vnc_api_client, database,
-                 esxi_api_client=None, vlan_id_pool=None):
+                 esxi_api_client=None, vlan_id_pool=None, vnc_workers=None):
         super(VirtualMachineInterfaceService, self).__init__(vnc_api_client, database,
                                                              esxi_api_client=esxi_api_client,
-                                                             vcenter_api_client=vcenter_api_client)
+                                                             vcenter_api_client=vcenter_api_client,
+                                                             vnc_workers=vnc_workers)
         self._vlan_id_pool = vlan_id_pool
+        self.update_counts = collections.Counter()
 
     def update_vmis(self):
+        # VNC writes of different VMIs are independent, so they're done
+        # concurrently. Jobs of the same VMI keep their order.
         for vmi_model in list(self._database.vmis_to_update):
-            try:
-                logger.info('Updating %s', vmi_model)
-                self._update_vmi(vmi_model)
+            self._vnc_workers.spawn(vmi_model.uuid, self._update_queued_vmi, vmi_model)
+        for vmi_model in list(self._database.vmis_to_delete):
+            self._vnc_workers.spawn(vmi_model.uuid, self._delete_queued_vmi, vmi_model)
+        self._vnc_workers.join()
+
+    def _update_queued_vmi(self, vmi_model):
+        try:
+            if vmi_model.is_applied():
+                logger.info('%s is up to date, skipping update', vmi_model)
                 self._database.vmis_to_update.remove(vmi_model)
-                logger.info('Updated %s', vmi_model)
-            except Exception as exc:
-                logger.error('Unexpected exception %s during updating VMI', exc, exc_info=True)
+                self.update_counts['skipped'] += 1
+                return
+            logger.info('Updating %s', vmi_model)
+            if not self._update_vmi(vmi_model):
+                # Stays queued, so that the failed VNC writes are retried
+                logger.error('Unable to fully update %s in VNC', vmi_model)
+                return
+            self._database.vmis_to_update.remove(vmi_model)
+            self.update_counts['updated'] += 1
+            logger.info('Updated %s', vmi_model)
+        except Exception as exc:
+            logger.error('Unexpected exception %s during updating VMI', exc, exc_info=True)
 
-        for vmi_model in list(self._database.vmis_to_delete):
-            try:
-                self._delete(vmi_model)
-                self._database.vmis_to_delete.remove(vmi_model)
-            except Exception as exc:
-                logger.error('Unexpected exception %s during deleting VMI', exc, exc_info=True)
+    def _delete_queued_vmi(self, vmi_model):
+        try:
+            self._delete(vmi_model)
+            self._database.vmis_to_delete.remove(vmi_model)
+        except Exception as exc:
+            logger.error('Unexpected exception %s during deleting VMI', exc, exc_info=True)
 
     def _update_vmis_vn(self, vmi_model):
         new_vn_model = self._database.get_vn_model_by_key(vmi_model.vcenter_port.portgroup_key)
@@ -74,10 +127,11 @@ class VirtualMachineInterfaceService(Service):
         self._add_default_vnc_info_to(vmi_model)
         self._update_vmis_vn(vmi_model)
         self._assign_vlan_id(vmi_model)
-        self._update_in_vnc(vmi_model)
-        self._add_instance_ip_to(vmi_model)
+        vnc_vmi = self._update_in_vnc(vmi_model)
+        instance_ip_added = self._add_instance_ip_to(vmi_model, vnc_vmi)
         self._update_vrouter_port(vmi_model)
         self._database.save(vmi_model)
+        return instance_ip_added
 
     def _assign_vlan_id(self, vmi_model):
         self._database.vlans_to_update.append(vmi_model)
@@ -87,18 +141,19 @@ class VirtualMachineInterfaceService(Service):
         vmi_model.security_group = self._default_security_group
 
     def _update_in_vnc(self, vmi_model):
-        self._vnc_api_client.update_vmi(vmi_model.vnc_vmi)
+        return self._vnc_api_client.update_vmi(vmi_model.vnc_vmi)
 
-    def _add_instance_ip_to(self, vmi_model):
+    def _add_instance_ip_to(self, vmi_model, vnc_vmi=None):
         vmi_model.construct_instance_ip()
         if vmi_model.vnc_instance_ip:
             logger.info('Try to read and create instance_ip for: VMI %s', vmi_model)
-            instance_ip = self._vnc_api_client.create_and_read_instance_ip(vmi_model)
+            instance_ip = self._vnc_api_client.create_and_read_instance_ip(vmi_model, vnc_vmi)
             if not instance_ip:
-                return
+                return False
             logger.info('Read instance ip: %s with IP: %s', str(instance_ip), instance_ip.instance_ip_address)
             vmi_model.vnc_instance_ip = instance_ip
             vmi_model.update_ip_address(instance_ip.instance_ip_address)
+        return True
 
     def _update_vrouter_port(self, vmi_model):
         self._database.ports_to_update.append(vmi_model)
@@ -124,6 +179,7 @@ class VirtualMachineInterfaceService(Service):
             logger.info('Attempting to update %s IP address to: %s', vmi_model, ip_address)
             vmi_model.update_ip_address(ip_address)
             self._add_instance_ip_to(vmi_model)
+            self._database.save(vmi_model)
             logger.info('IP address of %s updated to %s',
                         vmi_model.display_name, vmi_model.vnc_instance_ip.instance_ip_address)
             logger.info('VMI %s after IP update from guest.net', vmi_model)
@@ -148,27 +204,17 @@ class VirtualMachineInterfaceService(Service):
         if not vm_model:
             return
 
-        host_uuid = self._esxi_api_client.read_host_uuid()
-        with self._vcenter_api_client:
-            full_remove = self._vcenter_api_client.is_vm_removed(vm_model.name, host_uuid)
-        vmi_models = self._database.get_vmi_models_by_vm_uuid(vm_model.uuid)
-
-        for vmi_model in vmi_models:
-            if full_remove:
-                self._full_remove(vmi_model)
-            else:
-                self._local_remove(vmi_model)
+        # VMIs are deleted from VNC only after vCenter confirms that the VM
+        # didn't just move to another host, see VmRemovalService
+        for vmi_model in self._database.get_vmi_models_by_vm_uuid(vm_model.uuid):
+            self._local_remove(vmi_model)
+            self._database.vmis_to_confirm_removal.append(vmi_model)
 
     def _local_remove(self, vmi_model):
-        self._vlan_id_pool.free(vmi_model.vcenter_port.vlan_id)
+        # The VLAN ID stays reserved until VmRemovalService confirms the removal
         self._database.delete_vmi_model(vmi_model.uuid)
         self._delete_vrouter_port(vmi_model.uuid)
 
-    def _full_remove(self, vmi_model):
-        self._local_remove(vmi_model)
-        self._delete_from_vnc(vmi_model)
-        self._restore_vlan_id(vmi_model)
-
     def rename_vmis(self, new_name):
         vm_model = self._database.get_vm_model_by_name(new_name)
         vmi_models = self._database.get_vmi_models_by_vm_uuid(vm_model.uuid)
@@ -180,17 +226,19 @@ class VirtualMachineInterfaceService(Service):
 
     def register_vmis(self):
         for vmi_model in list(self._database.vmis_to_update):
-            logger.info('Updating %s', vmi_model)
-            self._update_vmi(vmi_model)
-            self._database.vmis_to_update.remove(vmi_model)
-            logger.info('Updated %s', vmi_model)
+            self._vnc_workers.spawn(vmi_model.uuid, self._update_queued_vmi, vmi_model)
+        self._vnc_workers.join()
 
     def delete_unused_vmis_in_vnc(self):
         for vm_model in self._database.get_all_vm_models():
-            try:
-                self.delete_unused_vm_vmis_in_vnc(vm_model.uuid)
-            except Exception as exc:
-                logger.error('Unexpected exception %s during deleting stale VMIs from VNC', exc, exc_info=True)
+            self._vnc_workers.spawn(vm_model.uuid, self._delete_unused_vm_vmis_in_vnc, vm_model.uuid)
+        self._vnc_workers.join()
+
+    def _delete_unused_vm_vmis_in_vnc(self, vm_uuid):
+        try:
+            self.delete_unused_vm_vmis_in_vnc(vm_uuid)
+        except Exception as exc:
+            logger.error('Unexpected exception %s during deleting stale VMIs from VNC', exc, exc_info=True)
 
     def delete_unused_vm_vmis_in_vnc(self, vm_uuid):
         vm_model = self._database.get_vm_model_by_uuid(vm_uuid)
@@ -208,18 +256,21 @@ class VirtualMachineInterfaceService(Service):
 
 
 class VirtualMachineService(Service):
-    def __init__(self, esxi_api_client, vcenter_api_client, vnc_api_client, database):
+    def __init__(self, esxi_api_client, vcenter_api_client, vnc_api_client, database,
+                 shared_property_filter=False, vnc_workers=None):
         super(VirtualMachineService, self).__init__(vnc_api_client, database,
                                                     esxi_api_client=esxi_api_client,
-                                                    vcenter_api_client=vcenter_api_client)
+                                                    vcenter_api_client=vcenter_api_client,
+                                                    vnc_workers=vnc_workers)
+        self._shared_property_filter = shared_property_filter
 
-    def update(self, vmware_vm):
-        vm_properties = self.get_vm_vmware_properties(vmware_vm)
+    def update(self, vmware_vm, vm_properties=None):
+        if vm_properties is None:
+            vm_properties = self.get_vm_vmware_properties(vmware_vm)
         if is_contrail_vm_name(vm_properties['name']):
             return
-        try:
-            vm_uuid = vmware_vm.config.instanceUuid
-        except AttributeError:
+        vm_uuid = vm_properties.get('config.instanceUuid')
+        if vm_uuid is None:
             logger.error('VM: %s has no vCenter uuid', vm_properties.get('name'))
             return
         vm_model = self._database.get_vm_model_by_uuid(vm_uuid)
@@ -241,14 +292,18 @@ class VirtualMachineService(Service):
         logger.info('Updating %s', vm_model)
         vm_model.update(vmware_vm, vm_properties)
         logger.info('Updated %s', vm_model)
+        if vm_model.are_interfaces_changed():
+            # Devices of the VM could have changed while CVM was disconnected
+            self.update_vm_models_interfaces(vmware_vm)
         for vmi_model in vm_model.vmi_models:
             self._database.vmis_to_update.append(vmi_model)
         self._database.save(vm_model)
 
     def _create(self, vmware_vm, vm_properties):
         vm_model = VirtualMachineModel(vmware_vm, vm_properties)
-        self._database.vmis_to_update += vm_model.vmi_models
-        self._add_property_filter_for_vm(vm_model, vmware_vm, VM_UPDATE_FILTERS)
+        self._database.vmis_to_update.extend(vm_model.vmi_models)
+        if not self._shared_property_filter:
+            self._add_property_filter_for_vm(vm_model, vmware_vm, VM_UPDATE_FILTERS)
         self._update_in_vnc(vm_model.vnc_vm)
         logger.info('Created %s', vm_model)
         self._database.save(vm_model)
@@ -267,14 +322,38 @@ class VirtualMachineService(Service):
         vnc_vm.set_perms2(perms2)
 
     def get_vms_from_vmware(self):
-        vmware_vms = self._esxi_api_client.get_all_vms()
-        for vmware_vm in vmware_vms:
-            try:
-                self.update(vmware_vm)
-            except vmodl.fault.ManagedObjectNotFound:
-                logger.error('One VM was moved out of ESXi during CVM sync')
-            except Exception as exc:
-                logger.error('Unexpected exception %s during syncing VM', exc, exc_info=True)
+        vms_properties = self._esxi_api_client.read_all_vms_properties()
+        for vmware_vm, vm_properties in vms_properties:
+            self._vnc_workers.spawn(vm_properties.get('config.instanceUuid'), self._sync_vm, vmware_vm, vm_properties)
+        self._vnc_workers.join()
+
+    def resync_vms_from_vmware(self):
+        """ Updates VMs which changed since they were last seen and returns names of VMs gone from ESXi. """
+        vms_properties = self._esxi_api_client.read_all_vms_properties()
+        vm_uuids = set()
+        for vmware_vm, vm_properties in vms_properties:
+            vm_uuid = vm_properties.get('config.instanceUuid')
+            vm_uuids.add(vm_uuid)
+            vm_model = self._database.get_vm_model_by_uuid(vm_uuid)
+            if vm_model is not None:
+                # Managed objects and property filters of the old connection are no longer usable
+                vm_model.vmware_vm = vmware_vm
+                if not self._shared_property_filter:
+                    self._add_property_filter_for_vm(vm_model, vmware_vm, VM_UPDATE_FILTERS)
+                if not vm_model.is_changed(vm_properties) and \
+                        all(vmi_model.is_applied() for vmi_model in vm_model.vmi_models):
+                    continue
+            self._vnc_workers.spawn(vm_uuid, self._sync_vm, vmware_vm, vm_properties)
+        self._vnc_workers.join()
+        return [vm_model.name for vm_model in self._database.get_all_vm_models() if vm_model.uuid not in vm_uuids]
+
+    def _sync_vm(self, vmware_vm, vm_properties):
+        try:
+            self.update(vmware_vm, vm_properties)
+        except vmodl.fault.ManagedObjectNotFound:
+            logger.error('One VM was moved out of ESXi during CVM sync')
+        except Exception as exc:
+            logger.error('Unexpected exception %s during syncing VM', exc, exc_info=True)
 
     def delete_unused_vms_in_vnc(self):
         logger.info('Deleting stale information in VNC...')
@@ -297,27 +376,30 @@ class VirtualMachineService(Service):
 
     def _delete_stale_vms_from_vnc(self, vms_to_remove):
         for uuid in vms_to_remove:
-            try:
-                attached_vmis = self._vnc_api_client.get_vmi_uuids_by_vm_uuid(uuid)
-                self._database.ports_to_delete.extend(attached_vmis)
-                logger.info('Deleting stale VM from VNC - uuid: %s', uuid)
-                self._vnc_api_client.delete_vm(uuid=uuid)
-            except Exception as exc:
-                logger.error('Unexpected exception %s during removing VM from VNC', exc, exc_info=True)
+            self._vnc_workers.spawn(uuid, self._delete_stale_vm_from_vnc, uuid)
+        self._vnc_workers.join()
+
+    def _delete_stale_vm_from_vnc(self, uuid):
+        try:
+            attached_vmis = self._vnc_api_client.get_vmi_uuids_by_vm_uuid(uuid)
+            self._database.ports_to_delete.extend(attached_vmis)
+            logger.info('Deleting stale VM from VNC - uuid: %s', uuid)
+            self._vnc_api_client.delete_vm(uuid=uuid)
+        except Exception as exc:
+            logger.error('Unexpected exception %s during removing VM from VNC', exc, exc_info=True)
 
     def remove_vm(self, name):
         vm_model = self._database.get_vm_model_by_name(name)
         logger.info('Deleting %s', vm_model)
         if not vm_model:
             return
-        host_uuid = self._esxi_api_client.read_host_uuid()
-        with self._vcenter_api_client:
-            if self._vcenter_api_client.is_vm_removed(vm_model.name, host_uuid):
-                self._vnc_api_client.delete_vm(vm_model.uuid)
-            else:
-                logger.info('VM %s still exists on another host and can\'t be deleted from VNC', name)
         self._database.delete_vm_model(vm_model.uuid)
-        vm_model.destroy_property_filter()
+        try:
+            vm_model.destroy_property_filter()
+        except Exception as exc:
+            # The filter could belong to a connection which no longer exists
+            logger.error('Unable to destroy property filter of %s: %s', vm_model.name, exc)
+        self._database.vms_to_confirm_removal.append(vm_model)
 
     def update_vmware_tools_status(self, vmware_vm, tools_running_status):
         vm_model = self._database.get_vm_model_by_uuid(vmware_vm.config.instanceUuid)
@@ -350,7 +432,7 @@ class VirtualMachineService(Service):
                 new_vmi_model.vn_model = old_vmi_model.vn_model
             self._database.vmis_to_update.append(new_vmi_model)
 
-        self._database.vmis_to_delete += list(old_vmi_models.values())
+        self._database.vmis_to_delete.extend(list(old_vmi_models.values()))
 
     def update_power_state(self, vmware_vm, power_state):
         vm_model = self._database.get_vm_model_by_uuid(vmware_vm.config.instanceUuid)
@@ -434,25 +516,33 @@ class VRouterPortService(object):
 
     def _update_ports(self):
         ports = list(self._database.ports_to_update)
+        if not ports:
+            return
+        vrouter_ports = self._vrouter_api_client.read_ports([vmi_model.uuid for vmi_model in ports])
         for vmi_model in ports:
             try:
-                vrouter_port = self._vrouter_api_client.read_port(vmi_model.uuid)
+                vrouter_port = vrouter_ports.get(vmi_model.uuid)
+                port_added = True
                 if not vrouter_port:
-                    self._create_port(vmi_model)
-                    continue
-                if self._port_needs_an_update(vrouter_port, vmi_model):
-                    self._update_port(vmi_model)
+                    port_added = self._create_port(vmi_model)
+                elif self._port_needs_an_update(vrouter_port, vmi_model):
+                    port_added = self._update_port(vmi_model)
+                # The vRouter port is the last step of applying a VMI,
+                # unless its VNC writes failed and are still queued
+                if port_added and vmi_model not in self._database.vmis_to_update:
+                    vmi_model.mark_applied()
             except Exception as exc:
                 logger.error('Unexpected exception %s during updating vRouter port', exc, vmi_model.uuid, exc_info=True)
 
     def _create_port(self, vmi_model):
-        self._vrouter_api_client.add_port(vmi_model)
+        port_added = self._vrouter_api_client.add_port(vmi_model)
         if not vmi_model.vm_model.is_powered_on:
             self._database.ports_to_update.remove(vmi_model)
+        return port_added
 
     def _update_port(self, vmi_model):
         self._vrouter_api_client.delete_port(vmi_model.uuid)
-        self._vrouter_api_client.add_port(vmi_model)
+        return self._vrouter_api_client.add_port(vmi_model)
 
     def _set_port_state(self, vmi_model):
         if vmi_model.vm_model.is_powered_on:
@@ -480,29 +570,108 @@ class VRouterPortService(object):
             logger.error('Unexpected exception %s during deleting stale vRouter ports', exc, exc_info=True)
 
 
+class VmRemovalService(object):
+    """ Deletes VMs removed from the host from VNC, once vCenter confirms they were removed for good. """
+
+    def __init__(self, vcenter_api_client, esxi_api_client, vnc_api_client, database, vlan_id_pool):
+        self._vcenter_api_client = vcenter_api_client
+        self._esxi_api_client = esxi_api_client
+        self._vnc_api_client = vnc_api_client
+        self._database = database
+        self._vlan_id_pool = vlan_id_pool
+        self._deadlines = {}
+
+    def has_pending_removals(self):
+        return bool(self._database.vms_to_confirm_removal)
+
+    def check_removals(self):
+        vm_models = list(self._database.vms_to_confirm_removal)
+        if not vm_models:
+            return {}
+        host_uuid = self._esxi_api_client.read_host_uuid()
+        with self._vcenter_api_client:
+            return self._vcenter_api_client.check_vms_removed([vm_model.name for vm_model in vm_models], host_uuid)
+
+    def confirm_removals(self, removal_states):
+        for vm_model in list(self._database.vms_to_confirm_removal):
+            is_removed = removal_states.get(vm_model.name)
+            deadline = self._deadlines.setdefault(vm_model.uuid, time.time() + VM_REMOVAL_TIMEOUT)
+            if is_removed is None:
+                if time.time() < deadline:
+                    continue
+                logger.error('Unable to confirm that VM %s was removed or not', vm_model.name)
+            try:
+                self._confirm_removal(vm_model, bool(is_removed))
+                self._database.vms_to_confirm_removal.remove(vm_model)
+                self._deadlines.pop(vm_model.uuid, None)
+            except Exception as exc:
+                logger.error('Unexpected exception %s during removing %s from VNC', exc, vm_model, exc_info=True)
+
+    def _confirm_removal(self, vm_model, is_removed):
+        vmi_models = [vmi_model for vmi_model in self._database.vmis_to_confirm_removal
+                      if vmi_model.vm_model.uuid == vm_model.uuid]
+        # The VM could have come back to the host in the meantime
+        if is_removed and self._database.get_vm_model_by_uuid(vm_model.uuid) is None:
+            for vmi_model in vmi_models:
+                self._vnc_api_client.delete_vmi(vmi_model.uuid)
+                # Restoring the VLAN ID in vCenter also frees it in the pool
+                self._database.vlans_to_restore.append(vmi_model)
+            self._vnc_api_client.delete_vm(vm_model.uuid)
+        else:
+            logger.info('VM %s still exists on another host and can\'t be deleted from VNC', vm_model.name)
+            for vmi_model in vmi_models:
+                self._free_vlan_id(vmi_model)
+        for vmi_model in vmi_models:
+            self._database.vmis_to_confirm_removal.remove(vmi_model)
+
+    def _free_vlan_id(self, vmi_model):
+        vlan_id = vmi_model.vcenter_port.vlan_id
+        # A VM which came back to the host could have kept its VLAN ID
+        if vlan_id is not None and not self._database.get_vmi_models_by_vlan_id(vlan_id):
+            self._vlan_id_pool.free(vlan_id)
+
+
 class VlanIdService(object):
-    def __init__(self, vcenter_api_client, esxi_api_client, vlan_id_pool, database):
+    def __init__(self, vcenter_api_client, esxi_api_client, vlan_id_pool, database,
+                 wait_in_background=False):
         self._vcenter_api_client = vcenter_api_client
         self._esxi_api_client = esxi_api_client
         self._vlan_id_pool = vlan_id_pool
         self._database = database
+        self._wait_in_background = wait_in_background
+        self._waiting_vmi_uuids = set()
 
     def update_vlan_ids(self):
+        self._fetch_dv_ports(list(self._database.vlans_to_update) + list(self._database.vlans_to_restore))
+        updated_vmi_models = []
         for vmi_model in list(self._database.vlans_to_update):
             try:
                 logger.info('Updating %s', vmi_model)
                 self._update_vlan_id(vmi_model)
                 self._database.vlans_to_update.remove(vmi_model)
+                updated_vmi_models.append(vmi_model)
                 logger.info('Updated %s', vmi_model)
             except Exception as exc:
                 logger.error('Unexpected exception %s during updating vCenter VLAN', exc, exc_info=True)
+        self._update_vcenter_vlans(updated_vmi_models)
 
-        for vmi_model in list(self._database.vlans_to_restore):
-            try:
-                self._restore_vlan_id(vmi_model)
-                self._database.vlans_to_restore.remove(vmi_model)
-            except Exception as exc:
-                logger.error('Unexpected exception %s during restoring vCenter VLAN', exc, exc_info=True)
+        vmi_models = list(self._database.vlans_to_restore)
+        if not vmi_models:
+            return
+        try:
+            self._restore_vlan_ids(vmi_models)
+        except Exception as exc:
+            logger.error('Unexpected exception %s during restoring vCenter VLAN', exc, exc_info=True)
+
+    def _fetch_dv_ports(self, vmi_models):
+        if not vmi_models:
+            return
+        try:
+            with self._vcenter_api_client:
+                self._vcenter_api_client.fetch_ports_from_dvs(
+                    [vmi_model.vcenter_port.port_key for vmi_model in vmi_models])
+        except Exception as exc:
+            logger.error('Unexpected exception %s during reading vCenter ports', exc, exc_info=True)
 
     def _update_vlan_id(self, vmi_model):
         with self._vcenter_api_client:
@@ -514,81 +683,135 @@ class VlanIdService(object):
 
     def _preserve_old_vlan_id(self, current_vlan_id, vmi_model):
         if self._database.is_vlan_available(vmi_model, current_vlan_id):
-            vmi_model.vcenter_port.vlan_id = current_vlan_id
+            self._database.update_vlan_id(vmi_model, current_vlan_id)
             vmi_model.vcenter_port.vlan_success = True
             self._vlan_id_pool.reserve(current_vlan_id)
         else:
             self._assign_new_vlan_id(vmi_model)
 
     def _assign_new_vlan_id(self, vmi_model):
-        vmi_model.vcenter_port.vlan_id = self._vlan_id_pool.get_available()
-        self._update_vcenter_vlan(vmi_model)
-
-    def _restore_vlan_id(self, vmi_model):
-        self._restore_vcenter_vlan_id(vmi_model)
-        self._vlan_id_pool.free(vmi_model.vcenter_port.vlan_id)
+        self._database.update_vlan_id(vmi_model, self._vlan_id_pool.get_available())
 
-    def _restore_vcenter_vlan_id(self, vmi_model):
-        with self._vcenter_api_client:
-            self._vcenter_api_client.restore_vlan_id(vmi_model.vcenter_port)
+    def _restore_vlan_ids(self, vmi_models):
+        pending_vmi_models = vmi_models
+        for i in range(SET_VLAN_ID_RETRY_LIMIT):
+            if not pending_vmi_models:
+                break
+            if i != 0:
+                logger.error('Task failed to complete, retrying for %d ports...', len(pending_vmi_models))
+            with self._vcenter_api_client:
+                errors = self._vcenter_api_client.restore_vlan_ids(
+                    [vmi_model.vcenter_port for vmi_model in pending_vmi_models])
+            pending_vmi_models = [vmi_model for vmi_model in pending_vmi_models
+                                  if vmi_model.vcenter_port.port_key in errors]
+        for vmi_model in pending_vmi_models:
+            logger.error('Unable to restore VLAN ID for %s', vmi_model)
+        for vmi_model in vmi_models:
+            vlan_id = vmi_model.vcenter_port.vlan_id
+            if not self._database.get_vmi_models_by_vlan_id(vlan_id):
+                self._vlan_id_pool.free(vlan_id)
+            self._database.vlans_to_restore.remove(vmi_model)
 
     def update_vcenter_vlans(self):
-        for vmi_model in list(self._database.vlans_to_update):
-            self._update_vcenter_vlan(vmi_model)
+        vmi_models = list(self._database.vlans_to_update)
+        self._fetch_dv_ports(vmi_models)
+        self._update_vcenter_vlans(vmi_models)
+        for vmi_model in vmi_models:
             self._database.vlans_to_update.remove(vmi_model)
 
-    def _update_vcenter_vlan(self, vmi_model):
-        if vmi_model.vcenter_port.vlan_success:
-            logger.info('VLAN ID is already set with success')
+    def _update_vcenter_vlans(self, vmi_models):
+        pending_vmi_models = []
+        for vmi_model in vmi_models:
+            if vmi_model.vcenter_port.vlan_success:
+                logger.info('VLAN ID of %s is already set with success', vmi_model.display_name)
+            elif not vmi_model.vm_model.is_powered_on:
+                logger.info('Unable to set VLAN ID of %s for powered off VM', vmi_model.display_name)
+            elif vmi_model.uuid in self._waiting_vmi_uuids:
+                logger.info('VLAN ID of %s is already waiting to be set', vmi_model.display_name)
+            else:
+                pending_vmi_models.append(vmi_model)
+        if not pending_vmi_models:
             return
-        if not vmi_model.vm_model.is_powered_on:
-            logger.info('Unable to set VLAN ID for powered off VM')
+
+        if self._wait_in_background:
+            # Waiting for the ports can take a while, so it mustn't block
+            # handling of other updates
+            self._waiting_vmi_uuids.update(vmi_model.uuid for vmi_model in pending_vmi_models)
+            gevent.spawn(self._set_vcenter_vlans_with_retries, pending_vmi_models)
+        else:
+            self._set_vcenter_vlans_with_retries(pending_vmi_models)
+
+    def _set_vcenter_vlans_with_retries(self, vmi_models):
+        pending_vmi_models = vmi_models
+        try:
+            for i in range(SET_VLAN_ID_RETRY_LIMIT):
+                if not pending_vmi_models:
+                    return
+                if i != 0:
+                    logger.error('Task failed to complete, retrying for %d ports...', len(pending_vmi_models))
+                try:
+                    with self._vcenter_api_client:
+                        self._set_vcenter_vlans(pending_vmi_models)
+                except Exception as exc:
+                    logger.error('Unexpected exception: %s during setting VLAN IDs', exc, exc_info=exc)
+                pending_vmi_models = [vmi_model for vmi_model in pending_vmi_models
+                                      if not vmi_model.vcenter_port.vlan_success]
+            for vmi_model in pending_vmi_models:
+                logger.error('Unable to set VLAN ID for %s', vmi_model)
+        finally:
+            self._waiting_vmi_uuids.difference_update(vmi_model.uuid for vmi_model in vmi_models)
+
+    def _set_vcenter_vlans(self, vmi_models):
+        waits = [gevent.spawn(self._wait_for_port, vmi_model) for vmi_model in vmi_models]
+        gevent.joinall(waits)
+        # VMIs could have been removed in the meantime
+        ready_vmi_models = [vmi_model for vmi_model, wait in zip(vmi_models, waits)
+                            if wait.value and self._database.get_vmi_model_by_uuid(vmi_model.uuid) is vmi_model]
+        if not ready_vmi_models:
             return
-        for i in range(SET_VLAN_ID_RETRY_LIMIT):
-            if i != 0:
-                logger.error('Task failed to complete, retrying...')
-            try:
-                with self._vcenter_api_client:
-                    logger.info('Updating VLAN ID of %s in vCenter', vmi_model.display_name)
-                    if self._wait_for_device_connected(vmi_model) and self._wait_for_proxy_host(vmi_model):
-                        state, error_msg = self._vcenter_api_client.set_vlan_id(vmi_model.vcenter_port)
-                        if state == 'success':
-                            vmi_model.vcenter_port.vlan_success = True
-                            return
-            except Exception as exc:
-                logger.error('Unexpected exception: %s during setting VLAN ID for %s', exc, vmi_model, exc_info=exc)
-        logger.error('Unable to finish the task.')
+        logger.info('Updating VLAN IDs of %s in vCenter',
+                    ', '.join(vmi_model.display_name for vmi_model in ready_vmi_models))
+        errors = self._vcenter_api_client.set_vlan_ids([vmi_model.vcenter_port for vmi_model in ready_vmi_models])
+        for vmi_model in ready_vmi_models:
+            if vmi_model.vcenter_port.port_key not in errors:
+                vmi_model.vcenter_port.vlan_success = True
+
+    def _wait_for_port(self, vmi_model):
+        return self._wait_for_device_connected(vmi_model) and self._wait_for_proxy_host(vmi_model)
 
-    @classmethod
-    def _wait_for_device_connected(cls, vmi_model):
+    def _wait_for_device_connected(self, vmi_model):
         port_key = vmi_model.vcenter_port.port_key
         vm_name = vmi_model.vm_model.name
+        device_key = vmi_model.vcenter_port.device_key
         logger.info('Waiting for VM %s interface connected to port %s...', vm_name, port_key)
-        for _ in range(WAIT_FOR_PORT_RETRY_LIMIT):
-            try:
-                device = next(device for device
-                              in vmi_model.vm_model.vmware_vm.config.hardware.device
-                              if device.key == vmi_model.vcenter_port.device.key)
+        try:
+            devices_updates = self._esxi_api_client.watch_property(
+                vmi_model.vm_model.vmware_vm, 'config.hardware.device', WAIT_FOR_PORT_TIMEOUT)
+            for devices in devices_updates:
+                device = next((device for device in devices if device.key == device_key), None)
+                if device is None:
+                    logger.error('For VM %s did not detect such interface', vm_name)
+                    return False
                 if device.connectable.connected:
                     logger.info('VM %s interface is connected to port %s.', vm_name, port_key)
                     return True
-            except StopIteration:
-                logger.error('For VM %s did not detect such interface', vm_name)
-                return False
-            except Exception as exc:
-                logger.error('Unexpected exception: %s during waiting for VM %s interface connected to port %s',
-                             exc, vm_name, port_key, exc_info=exc)
-            logger.info('VM %s interface still is not connected to port %s.', vm_name, port_key)
-            time.sleep(WAIT_FOR_PORT_RETRY_TIME)
+                logger.info('VM %s interface still is not connected to port %s.', vm_name, port_key)
+        except Exception as exc:
+            logger.error('Unexpected exception: %s during waiting for VM %s interface connected to port %s',
+                         exc, vm_name, port_key, exc_info=exc)
+            return False
         logger.info('Waiting for VM %s interface to be connected to port %s timed out', vm_name, port_key)
         return False
 
     def _wait_for_proxy_host(self, vmi_model):
         port_key = vmi_model.vcenter_port.port_key
         logger.info('Waiting for port %s proxyHost...', port_key)
-        for _ in range(WAIT_FOR_PORT_RETRY_LIMIT):
+        # DV ports aren't managed objects, so proxyHost can't be watched with
+        # a PropertyCollector and has to be polled
+        for i in range(WAIT_FOR_PORT_RETRY_LIMIT):
+            dv_port = None
             try:
-                dv_port = self._vcenter_api_client.fetch_port_from_dvs(port_key)
+                dv_port = self._vcenter_api_client.fetch_port_from_dvs(port_key, use_cache=(i == 0))
                 port_host_uuid = dv_port.proxyHost.hardware.systemInfo.uuid
                 if port_host_uuid == self._esxi_api_client.read_host_uuid():
                     logger.info('proxyHost %s for port %s is ready.', dv_port.proxyHost.name, port_key)
@@ -597,9 +820,9 @@ class VlanIdService(object):
                 logger.error('Unexpected exception: %s during waiting for port %s proxyHost',
                              exc, port_key, exc_info=exc)
             proxy_host_name = None
-            if dv_port.proxyHost is not None:
+            if dv_port is not None and dv_port.proxyHost is not None:
                 proxy_host_name = dv_port.proxyHost.name
             logger.info('proxyHost for port %s still is not ready. Still refers to %s', port_key, proxy_host_name)
-            time.sleep(WAIT_FOR_PORT_RETRY_TIME)
+            gevent.sleep(WAIT_FOR_PORT_RETRY_TIME)
         logger.error('Waiting for proxyHost for port %s timed out', port_key)
         return False
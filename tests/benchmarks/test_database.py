@@ -0,0 +1,79 @@
+# pylint: disable=redefined-outer-name
+from builtins import range
+import pytest
+from mock import Mock
+
+from cvm.database import Database, DatabaseSnapshot
+from cvm.models import (VirtualMachineInterfaceModel, VirtualMachineModel,
+                        VirtualNetworkModel)
+from tests.utils import measure
+
+pytestmark = pytest.mark.benchmark
+
+SMALL = 10
+LARGE = 1000
+
+
+def populate(size, host, vnc_vn):
+    database = Database()
+    vmware_vm = Mock()
+    vmware_vm.config.hardware.device = []
+    vn_model = VirtualNetworkModel(Mock(key='dvportgroup-1'), vnc_vn)
+    database.save(vn_model)
+    for i in range(size):
+        vm_model = VirtualMachineModel(vmware_vm, {
+            'config.instanceUuid': 'vm-uuid-%d' % i,
+            'name': 'VM-%d' % i,
+            'summary.runtime.host': host,
+        })
+        vcenter_port = Mock(mac_address='mac-address-%d' % i, vlan_id=i)
+        vmi_model = VirtualMachineInterfaceModel(vm_model, vn_model, vcenter_port)
+        database.save(vm_model)
+        database.save(vmi_model)
+    return database
+
+
+@pytest.fixture(scope='module')
+def databases():
+    host = Mock()
+    vnc_vn = Mock(uuid='vnc-vn-uuid-1')
+    return populate(SMALL, host, vnc_vn), populate(LARGE, host, vnc_vn)
+
+
+def lookups(database, size):
+    name, uuid, vlan_id = 'VM-%d' % (size - 1), 'vm-uuid-%d' % (size - 1), size - 1
+    vmi_model = Mock(uuid='dummy-uuid')
+
+    def run():
+        database.get_vm_model_by_name(name)
+        database.get_vmi_models_by_vm_uuid(uuid)
+        database.get_vn_model_by_uuid('vnc-vn-uuid-1')
+        database.is_vlan_available(vmi_model, vlan_id)
+    return run
+
+
+def test_lookups_do_not_scale_with_vm_count(databases):
+    small, large = databases
+
+    small_time = measure(lookups(small, SMALL))
+    large_time = measure(lookups(large, LARGE))
+
+    # A linear scan would be ~100 times slower for the large database
+    assert large_time < small_time * 10
+
+
+def test_publish_copies_only_changed_models(databases):
+    _, large = databases
+    vm_model = large.get_vm_model_by_uuid('vm-uuid-0')
+
+    def publish():
+        large.save(vm_model)
+        large.publish_snapshot()
+
+    def rebuild():
+        DatabaseSnapshot(large.get_all_vm_models(), large.get_all_vn_models(), large.get_all_vmi_models())
+
+    publish_time = measure(publish, number=10)
+    rebuild_time = measure(rebuild, number=10)
+
+    assert publish_time * 10 < rebuild_time
@@ -0,0 +1,77 @@
+from builtins import range
+import time
+
+import gevent
+import gevent.lock
+import pytest
+from mock import Mock, patch
+
+from cvm.database import Database, DatabaseSnapshot
+
+sandesh_handler = pytest.importorskip('cvm.sandesh_handler')
+
+pytestmark = pytest.mark.benchmark
+
+VM_COUNT = 200
+SYNC_DURATION = 0.1  # 0.1s
+
+
+def make_models(count):
+    vm_models, vmi_models = [], []
+    vn_model = Mock(uuid='vn-uuid', key='dvportgroup-1')
+    vn_model.configure_mock(name='DPG1')
+    for i in range(count):
+        vm_model = Mock(uuid='vm-uuid-%d' % i, host_uuid='host-uuid', power_state='poweredOn')
+        vm_model.configure_mock(name='VM-%d' % i)
+        vcenter_port = Mock(mac_address='mac-address-%d' % i, port_key=str(i), vlan_id=i % 4094 + 1)
+        vmi_models.append(Mock(uuid='vmi-uuid-%d' % i, display_name='vmi-DPG1-VM-%d' % i, vm_model=vm_model,
+                               vn_model=vn_model, vcenter_port=vcenter_port, vnc_instance_ip=None))
+        vm_models.append(vm_model)
+    return vm_models, [vn_model], vmi_models
+
+
+def make_request():
+    request = Mock(uuid=None, key=None, host_uuid=None, power_state=None, vn_uuid=None,
+                   min_vlan_id=None, max_vlan_id=None, start=None, limit=None)
+    request.configure_mock(name=None)
+    return request
+
+
+def sync(lock, database, models):
+    # Stands for a long synchronization, e.g. waiting for VNC responses
+    with lock:
+        gevent.sleep(SYNC_DURATION)
+        database.snapshot = DatabaseSnapshot(*models, previous=database.snapshot)
+
+
+@patch('cvm.sandesh_handler.VirtualMachineInterfaceResponse')
+@patch('cvm.sandesh_handler.VirtualNetworkResponse')
+@patch('cvm.sandesh_handler.VirtualMachineResponse')
+def test_introspect_does_not_wait_for_sync(vm_response, vn_response, vmi_response):
+    lock = gevent.lock.BoundedSemaphore()
+    database = Database()
+    models = make_models(VM_COUNT)
+    database.snapshot = DatabaseSnapshot(*models)
+    handler = sandesh_handler.SandeshHandler(database)
+    handle_requests = (
+        handler.handle_virtual_machine_request,
+        handler.handle_virtual_network_request,
+        handler.handle_virtual_machine_interface_request,
+    )
+
+    syncing = gevent.spawn(sync, lock, database, models)
+    gevent.sleep(0)
+    for handle_request in handle_requests:
+        started = time.time()
+        gevent.spawn(handle_request, make_request()).join()
+        latency = time.time() - started
+
+        # The request is served from the published snapshot while the lock is held
+        assert lock.locked()
+        assert latency < SYNC_DURATION / 4
+    syncing.join()
+
+    for response in (vm_response, vn_response, vmi_response):
+        data, _ = response.call_args[0]
+        assert data
+        response.return_value.response.assert_called_once()
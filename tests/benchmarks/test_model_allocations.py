@@ -0,0 +1,70 @@
+# pylint: disable=redefined-outer-name
+from builtins import range
+
+import pytest
+from mock import Mock
+from vnc_api import vnc_api
+
+from cvm.models import (VirtualMachineInterfaceModel, VirtualMachineModel,
+                        VirtualNetworkModel)
+
+tracemalloc = pytest.importorskip('tracemalloc')
+
+pytestmark = pytest.mark.benchmark
+
+VMI_COUNT = 200
+ACCESSES = 10
+
+
+@pytest.fixture(scope='module')
+def vmi_models():
+    host = Mock()
+    vmware_vm = Mock()
+    vmware_vm.config.hardware.device = []
+    project = vnc_api.Project()
+    vnc_vn = vnc_api.VirtualNetwork(name='DPG1', parent_obj=project)
+    vnc_vn.set_uuid('vnc-vn-uuid-1')
+    vn_model = VirtualNetworkModel(Mock(key='dvportgroup-1'), vnc_vn)
+    security_group = vnc_api.SecurityGroup(name='default', parent_obj=project)
+    models = []
+    for i in range(VMI_COUNT):
+        vm_model = VirtualMachineModel(vmware_vm, {
+            'config.instanceUuid': 'vm-uuid-%d' % i,
+            'name': 'VM-%d' % i,
+            'summary.runtime.host': host,
+        })
+        vcenter_port = Mock(mac_address='mac-address-%d' % i)
+        vmi_model = VirtualMachineInterfaceModel(vm_model, vn_model, vcenter_port)
+        vmi_model.parent = project
+        vmi_model.security_group = security_group
+        models.append(vmi_model)
+    return models
+
+
+def allocated_bytes(func):
+    """ Returns the peak of memory (in bytes) allocated while running `func`. """
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def test_vnc_vmi_access_does_not_allocate(vmi_models):
+    def access_memoized():
+        for _ in range(ACCESSES):
+            for vmi_model in vmi_models:
+                vmi_model.vnc_vmi  # pylint: disable=pointless-statement
+
+    def construct():
+        for _ in range(ACCESSES):
+            for vmi_model in vmi_models:
+                vmi_model._construct_new_vnc_vmi()  # pylint: disable=protected-access
+
+    access_memoized()
+    memoized_bytes = allocated_bytes(access_memoized)
+    constructed_bytes = allocated_bytes(construct)
+
+    assert memoized_bytes * 10 < constructed_bytes
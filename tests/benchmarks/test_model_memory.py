@@ -0,0 +1,69 @@
+# pylint: disable=redefined-outer-name
+from builtins import range
+
+import pytest
+from mock import Mock
+from pyVmomi import vim  # pylint: disable=no-name-in-module
+
+from cvm.models import VirtualMachineModel
+
+tracemalloc = pytest.importorskip('tracemalloc')
+
+pytestmark = pytest.mark.benchmark
+
+VM_COUNT = 1000
+
+
+def vm_properties(i, host):
+    backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo(
+        port=vim.dvs.PortConnection(portKey=str(i), portgroupKey='dvportgroup-1')
+    )
+    devices = [
+        vim.vm.device.VirtualVmxnet3(key=4000, macAddress='00:50:56:00:%02x:%02x' % (i // 256 % 256, i % 256),
+                                     backing=backing),
+        vim.vm.device.VirtualDisk(key=2000),
+        vim.vm.device.VirtualCdrom(key=3000),
+    ]
+    return {
+        'config.instanceUuid': 'vm-uuid-%d' % i,
+        'name': 'VM-%d' % i,
+        'runtime.powerState': 'poweredOn',
+        'guest.toolsRunningStatus': 'guestToolsRunning',
+        'config.changeVersion': '2018-01-01T00:00:00.%06d' % i,
+        'summary.runtime.host': host,
+        'config.hardware.device': devices,
+    }
+
+
+def retained_bytes(func):
+    """ Returns the memory (in bytes) still held by the result of `func`. """
+    tracemalloc.start()
+    try:
+        result = func()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current
+
+
+@pytest.fixture(scope='module')
+def host():
+    host = Mock()
+    host.hardware.systemInfo.uuid = 'host-uuid-1'
+    return host
+
+
+def test_vm_models_do_not_keep_vmware_data(host):
+    vmware_vm = Mock()
+
+    def read_properties():
+        return [vm_properties(i, host) for i in range(VM_COUNT)]
+
+    def build_models():
+        return [VirtualMachineModel(vmware_vm, vm_properties(i, host)) for i in range(VM_COUNT)]
+
+    properties_bytes = retained_bytes(read_properties)
+    models_bytes = retained_bytes(build_models)
+
+    assert models_bytes * 2 < properties_bytes
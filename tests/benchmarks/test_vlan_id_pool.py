@@ -0,0 +1,47 @@
+from builtins import range
+
+import pytest
+
+from cvm.constants import VLAN_ID_RANGE_END, VLAN_ID_RANGE_START
+from cvm.models import VlanIdPool
+from tests.utils import measure
+
+pytestmark = pytest.mark.benchmark
+
+
+def churn(vlan_id_pool, size):
+    def run():
+        vlan_ids = [vlan_id_pool.get_available() for _ in range(size)]
+        for vlan_id in vlan_ids:
+            vlan_id_pool.free(vlan_id)
+    return run
+
+
+def reserve_and_free(vlan_id_pool, vlan_id):
+    def run():
+        vlan_id_pool.reserve(vlan_id)
+        vlan_id_pool.is_available(vlan_id)
+        vlan_id_pool.free(vlan_id)
+    return run
+
+
+def test_full_pool_churn():
+    size = VLAN_ID_RANGE_END - VLAN_ID_RANGE_START + 1
+    small_pool = VlanIdPool(VLAN_ID_RANGE_START, VLAN_ID_RANGE_START + 99)
+    full_pool = VlanIdPool(VLAN_ID_RANGE_START, VLAN_ID_RANGE_END)
+
+    small_time = measure(churn(small_pool, 100), number=10)
+    full_time = measure(churn(full_pool, size), number=10)
+
+    # Cost per allocated ID should not depend on the pool size
+    assert full_time / size < small_time / 100 * 5
+
+
+def test_reserve_and_free_in_full_pool():
+    small_pool = VlanIdPool(VLAN_ID_RANGE_START, VLAN_ID_RANGE_START + 99)
+    full_pool = VlanIdPool(VLAN_ID_RANGE_START, VLAN_ID_RANGE_END)
+
+    small_time = measure(reserve_and_free(small_pool, 50))
+    full_time = measure(reserve_and_free(full_pool, VLAN_ID_RANGE_END // 2))
+
+    assert full_time < small_time * 5
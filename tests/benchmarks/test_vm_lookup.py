@@ -0,0 +1,57 @@
+from builtins import range
+import pytest
+from mock import Mock, patch
+from pyVmomi import vim  # pylint: disable=no-name-in-module
+
+from cvm.clients import VCenterAPIClient
+from tests.utils import measure
+
+pytestmark = pytest.mark.benchmark
+
+VM_COUNT = 500
+
+
+def make_inventory_update_set(vms):
+    object_updates = []
+    for uuid, vmware_vm in vms.items():
+        change = Mock(val=uuid, op='assign')
+        change.configure_mock(name='config.instanceUuid')
+        object_updates.append(Mock(obj=vmware_vm, kind='enter', changeSet=[change]))
+    return Mock(version='1', truncated=False, filterSet=[Mock(objectSet=object_updates)])
+
+
+def make_vcenter_api_client(size):
+    vms = {'vm-uuid-%d' % i: Mock(spec=vim.VirtualMachine) for i in range(size)}
+    inventory_update_set = make_inventory_update_set(vms)
+
+    def find_by_uuid(datacenter, uuid, vmSearch, instanceUuid):  # pylint: disable=invalid-name,unused-argument
+        return vms.get(uuid)
+
+    def wait_for_updates(version, options):  # pylint: disable=unused-argument
+        return inventory_update_set if version == '' else None
+
+    vcenter_api_client = VCenterAPIClient({})
+    with patch('cvm.clients.SmartConnectNoSSL') as si_mock:
+        content = si_mock.return_value.content
+        content.searchIndex.FindByUuid = find_by_uuid
+        content.viewManager.CreateContainerView.return_value = Mock(spec=vim.view.ContainerView)
+        content.propertyCollector.CreatePropertyCollector.return_value.WaitForUpdatesEx = wait_for_updates
+        with patch.object(VCenterAPIClient, '_get_datacenter'), patch.object(VCenterAPIClient, '_get_dvswitch'):
+            vcenter_api_client.__enter__()
+    return vcenter_api_client
+
+
+def test_search_index_lookup_is_faster_than_inventory_scan():
+    vcenter_api_client = make_vcenter_api_client(VM_COUNT)
+    vm_uuid = 'vm-uuid-%d' % (VM_COUNT - 1)
+
+    def scan():
+        # Without SearchIndex, a lookup reads the whole VM inventory
+        vcenter_api_client._vm_inventory = None
+        return vcenter_api_client._find_vm('config.instanceUuid', vm_uuid)
+
+    assert vcenter_api_client._get_vm_by_uuid(vm_uuid) is scan()
+    search_index_time = measure(lambda: vcenter_api_client._get_vm_by_uuid(vm_uuid), number=10, repeat=3)
+    scan_time = measure(scan, number=10, repeat=3)
+
+    assert search_index_time * 10 < scan_time
@@ -12,13 +12,31 @@ from cvm.models import (VirtualMachineInterfaceModel, VirtualMachineModel,
 from cvm.monitors import VMwareMonitor
 from cvm.services import (VirtualMachineInterfaceService,
                           VirtualMachineService, VirtualNetworkService,
-                          VlanIdService, VRouterPortService)
+                          VlanIdService, VmRemovalService,
+                          VRouterPortService)
 from mock import Mock
 from pyVmomi import vim, vmodl  # pylint: disable=no-name-in-module
 from tests.utils import assign_ip_to_instance_ip, wrap_into_update_set
 from vnc_api import vnc_api
 
 
+def pytest_addoption(parser):
+    parser.addoption('--benchmarks', action='store_true', help='run timing and memory benchmarks')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: timing or memory benchmark, runs only with --benchmarks')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmarks'):
+        return
+    skip_benchmark = pytest.mark.skip(reason='needs --benchmarks to run')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
 @pytest.fixture()
 def vnc_vn_1(project, ipam):
     vnc_vn = vnc_api.VirtualNetwork(name='DPG1', parent=project)
@@ -371,7 +389,8 @@ def vcenter_api_client():
     vcenter_client.__enter__ = Mock()
     vcenter_client.__exit__ = Mock()
     vcenter_client.get_ip_pool_for_dpg.return_value = None
-    vcenter_client.set_vlan_id.return_value = 'success', 'success message'
+    vcenter_client.set_vlan_ids.return_value = {}
+    vcenter_client.restore_vlan_ids.return_value = {}
     return vcenter_client
 
 
@@ -380,6 +399,7 @@ def esxi_api_client(vm_properties_1):
     esxi_client = Mock()
     esxi_client.read_vrouter_uuid.return_value = 'vrouter-uuid-1'
     esxi_client.read_vm_properties.return_value = vm_properties_1
+    esxi_client.read_all_vms_properties.return_value = []
     return esxi_client
 
 
@@ -475,6 +495,11 @@ def vlan_id_service(vcenter_api_client, esxi_api_client, vlan_id_pool, database)
     return vlan_id_service
 
 
+@pytest.fixture()
+def vm_removal_service(vcenter_api_client, esxi_api_client, vnc_api_client, database, vlan_id_pool):
+    return VmRemovalService(vcenter_api_client, esxi_api_client, vnc_api_client, database, vlan_id_pool)
+
+
 @pytest.fixture()
 def database():
     return Database()
@@ -484,26 +509,29 @@ def database():
 def vrouter_api_client():
     client = Mock()
     client.read_port.return_value = None
+    client.read_ports.side_effect = lambda uuids: {uuid: client.read_port(uuid) for uuid in uuids}
     return client
 
 
 @pytest.fixture()
-def controller(vm_service, vn_service, vmi_service, vrouter_port_service, vlan_id_service, lock):
+def controller(vm_service, vn_service, vmi_service, vrouter_port_service, vlan_id_service, vm_removal_service,
+               lock, database):
     handlers = [
+        PowerStateHandler(vm_service, vrouter_port_service, vlan_id_service),
         VmUpdatedHandler(vm_service, vn_service, vmi_service, vrouter_port_service, vlan_id_service),
         VmRenamedHandler(vm_service, vmi_service, vrouter_port_service),
         VmReconfiguredHandler(vm_service, vn_service, vmi_service, vrouter_port_service, vlan_id_service),
         VmRemovedHandler(vm_service, vmi_service, vrouter_port_service, vlan_id_service),
         VmRegisteredHandler(vm_service, vn_service, vmi_service, vrouter_port_service, vlan_id_service),
         GuestNetHandler(vmi_service, vrouter_port_service),
-        PowerStateHandler(vm_service, vrouter_port_service, vlan_id_service),
         VmwareToolsStatusHandler(vm_service)
     ]
     for handler in handlers:
         handler._validate_event = Mock(return_value=True)
     update_handler = UpdateHandler(handlers)
     return VmwareController(vm_service, vn_service, vmi_service,
-                            vrouter_port_service, vlan_id_service, update_handler, lock)
+                            vrouter_port_service, vlan_id_service, update_handler, lock,
+                            vm_removal_service=vm_removal_service, database=database)
 
 
 @pytest.fixture()
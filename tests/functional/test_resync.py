@@ -0,0 +1,124 @@
+from mock import Mock
+from pyVmomi import vim, vmodl  # pylint: disable=no-name-in-module
+
+
+def test_resync_unchanged(controller, database, esxi_api_client, vnc_api_client, vrouter_api_client,
+                          vcenter_api_client, vmware_vm_1, vm_properties_1, vnc_vn_1, portgroup):
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, dict(vm_properties_1))]
+    vnc_api_client.read_vn.return_value = vnc_vn_1
+    vnc_api_client.get_all_vm_uuids.return_value = []
+    vcenter_api_client.get_dpg_by_key.return_value = portgroup
+    vrouter_api_client.read_port.return_value = None
+    controller.sync()
+    vnc_api_client.reset_mock()
+    vrouter_api_client.reset_mock()
+
+    controller.resync()
+
+    assert len(database.get_all_vm_models()) == 1
+    vnc_api_client.update_vm.assert_not_called()
+    vnc_api_client.update_vmi.assert_not_called()
+    vrouter_api_client.add_port.assert_not_called()
+    esxi_api_client.add_filter.assert_called_with(vmware_vm_1, ['guest.toolsRunningStatus', 'guest.net',
+                                                                'runtime.powerState'])
+
+
+def test_resync_changed(controller, database, esxi_api_client, vnc_api_client, vcenter_api_client,
+                        vrouter_api_client, vmware_vm_1, vm_properties_1, vnc_vn_1, portgroup):
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, dict(vm_properties_1))]
+    vnc_api_client.read_vn.return_value = vnc_vn_1
+    vnc_api_client.get_all_vm_uuids.return_value = []
+    vcenter_api_client.get_dpg_by_key.return_value = portgroup
+    vrouter_api_client.read_port.return_value = None
+    controller.sync()
+    vnc_api_client.reset_mock()
+    powered_off_properties = dict(vm_properties_1, **{'runtime.powerState': 'poweredOff'})
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, powered_off_properties)]
+
+    controller.resync()
+
+    vnc_api_client.update_vmi.assert_called_once()
+    vnc_api_client.get_all_vm_uuids.assert_not_called()
+
+
+def test_resync_removed(controller, database, esxi_api_client, vnc_api_client, vcenter_api_client,
+                        vrouter_api_client, vmware_vm_1, vm_properties_1, vnc_vn_1, portgroup):
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, dict(vm_properties_1))]
+    vnc_api_client.read_vn.return_value = vnc_vn_1
+    vnc_api_client.get_all_vm_uuids.return_value = []
+    vcenter_api_client.get_dpg_by_key.return_value = portgroup
+    vrouter_api_client.read_port.return_value = None
+    controller.sync()
+    esxi_api_client.read_all_vms_properties.return_value = []
+
+    controller.resync()
+
+    assert database.get_all_vm_models() == []
+    assert [vm_model.name for vm_model in database.vms_to_confirm_removal] == ['VM1']
+    assert len(database.vmis_to_confirm_removal) == 1
+
+
+def test_resync_interfaces_changed(controller, database, esxi_api_client, vnc_api_client, vcenter_api_client,
+                                   vrouter_api_client, vmware_vm_1, vm_properties_1, vnc_vn_1, portgroup):
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, dict(vm_properties_1))]
+    vnc_api_client.read_vn.return_value = vnc_vn_1
+    vnc_api_client.get_all_vm_uuids.return_value = []
+    vcenter_api_client.get_dpg_by_key.return_value = portgroup
+    vrouter_api_client.read_port.return_value = None
+    controller.sync()
+    backing = Mock(spec=vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo)
+    backing.port = Mock(portgroupKey='dvportgroup-1', portKey='11')
+    vmware_vm_1.config.hardware.device = vmware_vm_1.config.hardware.device + [
+        Mock(backing=backing, macAddress='mac-address-new')
+    ]
+    reconfigured_properties = dict(vm_properties_1, **{'config.changeVersion': 'new-change-version'})
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, reconfigured_properties)]
+
+    controller.resync()
+
+    vmi_models = database.get_vmi_models_by_vm_uuid('vmware-vm-uuid-1')
+    assert sorted(vmi_model.vcenter_port.mac_address for vmi_model in vmi_models) == [
+        'mac-address', 'mac-address-new'
+    ]
+    vrouter_api_client.add_port.assert_called()
+
+
+def test_resync_removed_with_stale_filter(controller, database, esxi_api_client, vnc_api_client,
+                                          vcenter_api_client, vrouter_api_client, vmware_vm_1, vm_properties_1,
+                                          vnc_vn_1, portgroup):
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, dict(vm_properties_1))]
+    esxi_api_client.add_filter.return_value.DestroyPropertyFilter.side_effect = vmodl.fault.ManagedObjectNotFound()
+    vnc_api_client.read_vn.return_value = vnc_vn_1
+    vnc_api_client.get_all_vm_uuids.return_value = []
+    vcenter_api_client.get_dpg_by_key.return_value = portgroup
+    vrouter_api_client.read_port.return_value = None
+    controller.sync()
+    esxi_api_client.read_all_vms_properties.return_value = []
+
+    controller.resync()
+
+    assert database.get_all_vm_models() == []
+    assert [vm_model.name for vm_model in database.vms_to_confirm_removal] == ['VM1']
+
+
+def test_resync_failed_vlan_id(controller, database, esxi_api_client, vnc_api_client, vcenter_api_client,
+                               vrouter_api_client, vmware_vm_1, vm_properties_1, vnc_vn_1, portgroup):
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, dict(vm_properties_1))]
+    vnc_api_client.read_vn.return_value = vnc_vn_1
+    vnc_api_client.get_all_vm_uuids.return_value = []
+    vcenter_api_client.get_dpg_by_key.return_value = portgroup
+    vcenter_api_client.get_vlan_id.return_value = None
+    vcenter_api_client.set_vlan_ids.side_effect = lambda ports: {port.port_key: 'Fault' for port in ports}
+    vrouter_api_client.read_port.return_value = None
+    controller.sync()
+    vmi_model = database.get_all_vmi_models()[0]
+    assert not vmi_model.vcenter_port.vlan_success
+    vcenter_api_client.set_vlan_ids.reset_mock()
+    vcenter_api_client.set_vlan_ids.side_effect = None
+
+    controller.resync()
+
+    # Although nothing changed, the VLAN ID which failed to be set is set again
+    vcenter_api_client.set_vlan_ids.assert_called_once_with([vmi_model.vcenter_port])
+    assert vmi_model.vcenter_port.vlan_success
+    assert vmi_model.is_applied()
@@ -4,9 +4,8 @@ def test_sync(controller, vmi_service, database, esxi_api_client, vcenter_api_cl
               vmware_vm_2, vnc_vn_1, portgroup, vnc_vm, vnc_vm_2, vm_properties_1):
     vmi_service.delete_unused_vmis_in_vnc = Mock()
     vmware_vm_1.config.instanceUuid = 'vnc-vm-uuid'
-    esxi_api_client.get_all_vms.return_value = [vmware_vm_1]
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, vm_properties_1)]
     vcenter_api_client.get_all_vms.return_value = [vmware_vm_1]
-    esxi_api_client.read_vm_properties.side_effect = [vm_properties_1]
     vnc_api_client.read_vn.return_value = vnc_vn_1
     vnc_api_client.get_all_vm_uuids.return_value = [vnc_vm.uuid, vnc_vm_2.uuid]
     vnc_api_client.get_vmi_uuids_by_vm_uuid.return_value = ['vmi-uuid-2']
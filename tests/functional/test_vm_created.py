@@ -47,7 +47,7 @@ def test_vm_created(controller, database, vcenter_api_client, vnc_api_client, vr
     vrouter_api_client.disable_port.assert_not_called()
 
     # Check if VLAN ID has been set using VLAN Override
-    vcenter_port = vcenter_api_client.set_vlan_id.call_args[0][0]
+    vcenter_port = vcenter_api_client.set_vlan_ids.call_args[0][0][0]
     assert vcenter_port.port_key == '10'
     assert vcenter_port.vlan_id == 2
 
@@ -61,3 +61,8 @@ def test_vm_created(controller, database, vcenter_api_client, vnc_api_client, vr
         vn_model=vn_model_1,
         vm_model=vm_model
     )
+
+    # Check if introspect snapshot has been published
+    vmi = database.snapshot.get_vmis_by_vm_uuid('vmware-vm-uuid-1')[0]
+    assert vmi.ip_address == '192.168.100.5'
+    assert vmi.vlan_id == 2
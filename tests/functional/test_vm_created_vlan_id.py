@@ -22,7 +22,7 @@ def test_vm_created_vlan_id(controller, database, vcenter_api_client,
     controller.handle_update(vm_created_update)
 
     # Check if VLAN ID has not been changed
-    vcenter_api_client.set_vlan_id.assert_not_called()
+    vcenter_api_client.set_vlan_ids.assert_not_called()
 
     # Check inner VMI model state
     vm_model = database.get_vm_model_by_uuid('vmware-vm-uuid-1')
@@ -56,7 +56,7 @@ def test_vm_created_vlan_id_collision(controller, database, vcenter_api_client,
     controller.handle_update(vm_created_update)
 
     # Check if VLAN ID has been set
-    vcenter_api_client.set_vlan_id.assert_called_once()
+    vcenter_api_client.set_vlan_ids.assert_called_once()
 
     # Check inner VMI model state
     vm_model = database.get_vm_model_by_uuid('vmware-vm-uuid-1')
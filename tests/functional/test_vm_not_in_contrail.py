@@ -15,7 +15,7 @@ def test_vm_created(controller, vcenter_api_client, vnc_api_client, vrouter_api_
 
     # There were no calls to vCenter
     vcenter_api_client.read_vlan_id.assert_not_called()
-    vcenter_api_client.set_vlan_id.assert_not_called()
+    vcenter_api_client.set_vlan_ids.assert_not_called()
 
     # There were no calls to vrouter_api
     vrouter_api_client.add_port.assert_not_called()
@@ -35,7 +35,7 @@ def test_vm_reconfigured(controller, vcenter_api_client, vnc_api_client, vrouter
 
     # There were no calls to vCenter
     vcenter_api_client.read_vlan_id.assert_not_called()
-    vcenter_api_client.set_vlan_id.assert_not_called()
+    vcenter_api_client.set_vlan_ids.assert_not_called()
 
     # There were no calls to vrouter_api
     vrouter_api_client.add_port.assert_not_called()
@@ -69,7 +69,7 @@ def test_network_change(controller, vcenter_api_client, vnc_api_client, vrouter_
     vnc_api_client.delete_vmi.assert_called_once()
 
     # VLAN ID should be restored to the default value in vCenter
-    vcenter_api_client.restore_vlan_id.assert_called_once()
+    vcenter_api_client.restore_vlan_ids.assert_called_once()
 
     # The port should be removed from vRouter
     vrouter_api_client.delete_port.assert_called_once()
@@ -93,15 +93,15 @@ def test_vm_powered_on(database, controller, vcenter_api_client, vnc_api_client,
 
     # There were no calls to vCenter
     vcenter_api_client.read_vlan_id.assert_not_called()
-    vcenter_api_client.set_vlan_id.assert_not_called()
+    vcenter_api_client.set_vlan_ids.assert_not_called()
 
     # There were no calls to vrouter_api
     vrouter_api_client.add_port.assert_not_called()
 
 
 def test_sync(controller, database, esxi_api_client, vcenter_api_client, vrouter_api_client, vnc_api_client, vmware_vm_1,
-              portgroup, vnc_vm):
-    esxi_api_client.get_all_vms.return_value = [vmware_vm_1]
+              portgroup, vnc_vm, vm_properties_1):
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, vm_properties_1)]
     vnc_api_client.read_vn.return_value = None
     vnc_api_client.get_all_vms.return_value = [vnc_vm]
     vcenter_api_client.get_dpg_by_key.return_value = portgroup
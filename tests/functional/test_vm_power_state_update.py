@@ -47,7 +47,6 @@ def test_set_vlan_id_on_power_on(controller, database, vcenter_api_client, esxi_
     # CVM sets VLAN ID in vCenter only when current VLAN conflicts with VLAN of another VM
     database.is_vlan_available = Mock()
     database.is_vlan_available.return_value = False
-    vcenter_api_client.set_vlan_id.return_value = 'success', None
 
     # VM is powered off when the VM Registered event comes
     esxi_api_client.read_vm_properties.return_value = vm_properties_1_off
@@ -69,7 +68,7 @@ def test_set_vlan_id_on_power_on(controller, database, vcenter_api_client, esxi_
     assert len(vmi_models) == 1
     vmi_model = vmi_models[0]
 
-    vcenter_api_client.set_vlan_id.assert_called_once_with(vmi_model.vcenter_port)
+    vcenter_api_client.set_vlan_ids.assert_called_once_with([vmi_model.vcenter_port])
 
     # Check that vRouter Port was disabled
     vrouter_api_client.enable_port.assert_called_once_with(vmi_model.uuid)
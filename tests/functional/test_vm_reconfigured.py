@@ -55,8 +55,8 @@ def test_vm_reconfigured(controller, database, vcenter_api_client, vnc_api_clien
     assert vrouter_api_client.add_port.call_args[0][0] == vmi_model
 
     # Check if VLAN ID has been set using VLAN Override
-    assert vcenter_api_client.set_vlan_id.call_count == 2
-    vcenter_port = vcenter_api_client.set_vlan_id.call_args[0][0]
+    assert vcenter_api_client.set_vlan_ids.call_count == 2
+    vcenter_port = vcenter_api_client.set_vlan_ids.call_args[0][0][0]
     assert vcenter_port.port_key == '11'
     assert vcenter_port.vlan_id == 5
 
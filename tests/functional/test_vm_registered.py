@@ -22,7 +22,7 @@ def test_vmotion_vlan_unavailable(controller, database, vcenter_api_client, vm_r
     # Check if VLAN ID has been changed
     vmi_model = next(model for model in database.get_all_vmi_models()
                  if model.display_name == 'vmi-DPG1-VM1')
-    vcenter_api_client.set_vlan_id.assert_called_once_with(vmi_model.vcenter_port)
+    vcenter_api_client.set_vlan_ids.assert_called_once_with([vmi_model.vcenter_port])
 
     # Check inner VMI model state
     vm_model = database.get_vm_model_by_uuid('vmware-vm-uuid-1')
@@ -56,7 +56,7 @@ def test_vmotion_vlan_available(controller, database, vcenter_api_client, vm_reg
     # Check if VLAN ID has been changed
     vmi_model = next(model for model in database.get_all_vmi_models()
                  if model.display_name == 'vmi-DPG1-VM1')
-    vcenter_api_client.set_vlan_id.assert_not_called()
+    vcenter_api_client.set_vlan_ids.assert_not_called()
 
     # Check inner VMI model state
     vm_model = database.get_vm_model_by_uuid('vmware-vm-uuid-1')
@@ -1,4 +1,7 @@
-from tests.utils import reserve_vlan_ids
+from mock import Mock
+from pyVmomi import vim  # pylint: disable=no-name-in-module
+
+from tests.utils import reserve_vlan_ids, wrap_into_update_set
 
 
 def test_full_remove_vm(controller, database, vcenter_api_client, vnc_api_client, vrouter_api_client,
@@ -8,7 +11,7 @@ def test_full_remove_vm(controller, database, vcenter_api_client, vnc_api_client
     database.save(vn_model_1)
 
     # In this scenario vCenter should return no relocation
-    vcenter_api_client.is_vm_removed.return_value = True
+    vcenter_api_client.check_vms_removed.return_value = {'VM1': True}
 
     # Some vlan ids should be already reserved
     vcenter_api_client.get_vlan_id.return_value = None
@@ -35,6 +38,12 @@ def test_full_remove_vm(controller, database, vcenter_api_client, vnc_api_client
     # Then VmRemovedEvent is being handled
     controller.handle_update(vm_removed_update)
 
+    # VM is not deleted from VNC until vCenter confirms its removal
+    vnc_api_client.delete_vm.assert_not_called()
+
+    # And the removal is confirmed in the background
+    controller.confirm_vm_removals()
+
     # Check that VM Model has been removed from Database:
     assert database.get_vm_model_by_uuid(vm_model.uuid) is None
 
@@ -54,7 +63,7 @@ def test_full_remove_vm(controller, database, vcenter_api_client, vnc_api_client
     vrouter_api_client.add_port.assert_called_once()
 
     # Check that VLAN ID has been released
-    vcenter_api_client.restore_vlan_id.assert_called_once_with(vmi_model.vcenter_port)
+    vcenter_api_client.restore_vlan_ids.assert_called_once_with([vmi_model.vcenter_port])
     assert vlan_id_pool.is_available(4)
 
 
@@ -70,7 +79,7 @@ def test_vm_removed_local_remove(controller, database, vcenter_api_client, vnc_a
     database.save(vn_model_1)
 
     # In this scenario vCenter should return info about relocation
-    vcenter_api_client.is_vm_removed.return_value = False
+    vcenter_api_client.check_vms_removed.return_value = {'VM1': False}
 
     # Some vlan ids should be already reserved
     vcenter_api_client.get_vlan_id.return_value = None
@@ -97,6 +106,9 @@ def test_vm_removed_local_remove(controller, database, vcenter_api_client, vnc_a
     # Then VmRemovedEvent is being handled
     controller.handle_update(vm_removed_update)
 
+    # And the removal is confirmed in the background
+    controller.confirm_vm_removals()
+
     # Check that VM Model has been removed from Database:
     assert database.get_vm_model_by_uuid(vm_model.uuid) is None
 
@@ -116,7 +128,64 @@ def test_vm_removed_local_remove(controller, database, vcenter_api_client, vnc_a
     vrouter_api_client.add_port.assert_called_once
 
     # Cannot remove VLAN ID from vCenter
-    vcenter_api_client.restore_vlan_id.assert_not_called()
+    vcenter_api_client.restore_vlan_ids.assert_not_called()
 
     # Check that VLAN ID has been restored to local pool
     assert vlan_id_pool.is_available(4)
+
+
+def make_vm_created_update(esxi_api_client, host, index):
+    vmware_vm = Mock(spec=vim.VirtualMachine)
+    vmware_vm.configure_mock(name='VM%d' % index)
+    vmware_vm.summary.runtime.host = host
+    vmware_vm.config.instanceUuid = 'vmware-vm-uuid-%d' % index
+    backing = Mock(spec=vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo)
+    backing.port = Mock(portgroupKey='dvportgroup-1', portKey=str(index * 10))
+    vmware_vm.config.hardware.device = [Mock(backing=backing, macAddress='mac-address-%d' % index)]
+    vm_properties = {
+        'config.instanceUuid': 'vmware-vm-uuid-%d' % index,
+        'name': 'VM%d' % index,
+        'runtime.powerState': 'poweredOn',
+        'guest.toolsRunningStatus': 'guestToolsRunning',
+        'summary.runtime.host': host,
+    }
+    read_vm_properties = esxi_api_client.read_vm_properties.side_effect
+    esxi_api_client.read_vm_properties.side_effect = \
+        lambda vm: vm_properties if vm is vmware_vm else read_vm_properties(vm)
+    event = Mock(spec=vim.event.VmCreatedEvent())
+    event.vm.vm = vmware_vm
+    return wrap_into_update_set(event=event)
+
+
+def test_vlan_id_not_reused_before_removal_confirmed(controller, database, esxi_api_client, vcenter_api_client,
+                                                     host_1, vm_created_update, vm_removed_update, vn_model_1,
+                                                     vm_properties_1, vlan_id_pool):
+    database.save(vn_model_1)
+    esxi_api_client.read_vm_properties.side_effect = lambda vm: vm_properties_1
+    vcenter_api_client.get_vlan_id.return_value = None
+    vcenter_api_client.check_vms_removed.return_value = {'VM1': True}
+    # Only VLAN ID 4 is left
+    reserve_vlan_ids(vlan_id_pool, [vlan_id for vlan_id in range(4096) if vlan_id != 4])
+
+    controller.handle_update(vm_created_update)
+    controller.handle_update(vm_removed_update)
+    # A new VM is created before the removal of VM1 is confirmed
+    controller.handle_update(make_vm_created_update(esxi_api_client, host_1, 2))
+    controller.confirm_vm_removals()
+    controller.handle_update(make_vm_created_update(esxi_api_client, host_1, 3))
+
+    vlan_ids = [vmi_model.vcenter_port.vlan_id for vmi_model in database.get_all_vmi_models()
+                if vmi_model.vcenter_port.vlan_id is not None]
+    assert len(set(vlan_ids)) == len(vlan_ids)
+
+
+def test_nothing_to_confirm(controller, database, vcenter_api_client, esxi_api_client, lock):
+    database.publish_snapshot = Mock()
+
+    controller.confirm_vm_removals()
+
+    # Without pending removals neither vCenter nor the lock is needed
+    esxi_api_client.read_host_uuid.assert_not_called()
+    vcenter_api_client.check_vms_removed.assert_not_called()
+    lock.__enter__.assert_not_called()
+    database.publish_snapshot.assert_not_called()
@@ -44,7 +44,7 @@ def test_vm_renamed(controller, database, esxi_api_client, vcenter_api_client, v
     assert vrouter_api_client.add_port.call_count == 2
 
     # Check if VLAN ID has been set using VLAN Override
-    vcenter_port = vcenter_api_client.set_vlan_id.call_args[0][0]
+    vcenter_port = vcenter_api_client.set_vlan_ids.call_args[0][0][0]
     assert vcenter_port.port_key == '10'
     assert vcenter_port.vlan_id == 0
 
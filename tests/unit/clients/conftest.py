@@ -15,6 +15,13 @@ def dv_port():
     return port
 
 
+@pytest.fixture()
+def dv_port_4():
+    port = Mock(key='9')
+    port.config.configVersion = '1'
+    return port
+
+
 @pytest.fixture()
 def dv_port_1():
     return create_dv_port(10, 'vrouter_uuid_1')
@@ -38,6 +45,14 @@ def vcenter_port():
     return VCenterPort(device)
 
 
+@pytest.fixture()
+def vcenter_port_2():
+    device = Mock(macAddress='mac-address-2')
+    device.backing.port.portKey = '9'
+    device.backing.port.portgroupKey = 'portgroup-key'
+    return VCenterPort(device)
+
+
 @pytest.fixture()
 def dvs(dv_port):
     dvswitch = Mock()
@@ -61,7 +76,9 @@ def vcenter_api_client():
 
 @pytest.fixture()
 def vnc_lib():
-    return Mock()
+    vnc_lib = Mock()
+    vnc_lib.instance_ip_read.return_value.get_virtual_machine_interface_refs.return_value = None
+    return vnc_lib
 
 
 @pytest.fixture()
@@ -87,6 +104,7 @@ def vnc_vm():
 @pytest.fixture()
 def vnc_vmi_1():
     vmi = Mock(uuid='vmi-uuid-1')
+    vmi.get_virtual_machine_refs.return_value = [{'uuid': 'vm-uuid'}]
     vmi.get_virtual_network_refs.return_value = [
         {'to': ['domain', 'project', 'vnc-vn-1'], 'uuid': 'vnc-vn-uuid-1'}
     ]
@@ -100,6 +118,7 @@ def vnc_vmi_1():
 @pytest.fixture()
 def vnc_vmi_2():
     vmi = Mock(uuid='vmi-uuid-2')
+    vmi.get_virtual_machine_refs.return_value = [{'uuid': 'vm-uuid'}]
     vmi.get_virtual_network_refs.return_value = [{'to': ['domain', 'project', 'vnc-vn-2']}]
     return vmi
 
@@ -1,6 +1,7 @@
 # pylint: disable=redefined-outer-name
 import pytest
 from mock import Mock, patch
+from pyVmomi import vim  # pylint: disable=no-name-in-module
 
 from cvm.clients import ESXiAPIClient
 
@@ -20,9 +21,15 @@ def property_collector(vm_esxi_properties):
 
 
 @pytest.fixture()
-def esxi_api_client(property_collector):
+def container_view():
+    return Mock(spec=vim.view.ContainerView)
+
+
+@pytest.fixture()
+def esxi_api_client(property_collector, container_view):
     with patch('cvm.clients.SmartConnectNoSSL') as si_mock:
         si_mock.return_value.content.propertyCollector = property_collector
+        si_mock.return_value.content.viewManager.CreateContainerView.return_value = container_view
         return ESXiAPIClient({})
 
 
@@ -30,3 +37,50 @@ def test_read_vm(esxi_api_client, vmware_vm_1):
     result = esxi_api_client.read_vm_properties(vmware_vm_1)
 
     assert result.get('name') == 'VM1'
+
+
+def test_read_all_vms_properties(esxi_api_client, property_collector, container_view,
+                                 vmware_vm_1, vmware_vm_2, vm_esxi_properties):
+    dynamic_property = Mock(val='VM2')
+    dynamic_property.configure_mock(name='name')
+    vm_2_esxi_properties = Mock(obj=vmware_vm_2, propSet=[dynamic_property])
+    property_collector.RetrievePropertiesEx.return_value = Mock(objects=[vm_esxi_properties], token='token')
+    property_collector.ContinueRetrievePropertiesEx.return_value = Mock(objects=[vm_2_esxi_properties], token=None)
+
+    result = esxi_api_client.read_all_vms_properties()
+
+    assert result == [(vmware_vm_1, {'name': 'VM1'}), (vmware_vm_2, {'name': 'VM2'})]
+    property_collector.RetrievePropertiesEx.assert_called_once()
+    property_collector.ContinueRetrievePropertiesEx.assert_called_once_with('token')
+    filter_spec = property_collector.RetrievePropertiesEx.call_args[0][0][0]
+    assert filter_spec.objectSet[0].obj is container_view
+    assert 'config.hardware.device' in filter_spec.propSet[0].pathSet
+    container_view.Destroy.assert_called_once()
+
+
+def test_add_vms_filter(esxi_api_client, property_collector, container_view):
+    esxi_api_client.add_vms_filter(['runtime.powerState'])
+    esxi_api_client.add_vms_filter(['runtime.powerState'])
+
+    assert property_collector.CreateFilter.call_count == 2
+    filter_spec = property_collector.CreateFilter.call_args[0][0]
+    assert filter_spec.objectSet[0].obj is container_view
+    assert filter_spec.propSet[0].type is vim.VirtualMachine
+    container_view.Destroy.assert_called_once()
+
+
+def test_watch_property(esxi_api_client, property_collector, vmware_vm_1):
+    devices_change = Mock(val=['device'])
+    devices_change.configure_mock(name='config.hardware.device')
+    update_set = Mock(version='1')
+    update_set.filterSet = [Mock(objectSet=[Mock(changeSet=[devices_change])])]
+    watch_collector = property_collector.CreatePropertyCollector.return_value
+    watch_collector.WaitForUpdatesEx.side_effect = [update_set, update_set, None]
+
+    values = list(esxi_api_client.watch_property(vmware_vm_1, 'config.hardware.device', 30))
+
+    assert values == [['device'], ['device']]
+    assert watch_collector.WaitForUpdatesEx.call_args_list[0][0][0] == ''
+    assert watch_collector.WaitForUpdatesEx.call_args_list[1][0][0] == '1'
+    property_collector.WaitForUpdatesEx.assert_not_called()
+    watch_collector.DestroyPropertyCollector.assert_called_once()
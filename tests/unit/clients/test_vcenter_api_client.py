@@ -1,15 +1,18 @@
+import gevent
+import pytest
 from cvm.clients import VCenterAPIClient
 from mock import Mock, patch
+from pyVmomi import vim  # pylint: disable=no-name-in-module
 
 
-def test_set_vlan_id(vcenter_api_client, dvs, vcenter_port):
+def test_set_vlan_ids(vcenter_api_client, dvs, vcenter_port):
     vcenter_port.vlan_id = 10
 
-    with patch('cvm.clients.wait_for_task'):
+    with patch('cvm.clients.wait_for_task', return_value=('success', None)):
         with patch('cvm.clients.SmartConnectNoSSL'):
             with patch.object(VCenterAPIClient, '_get_dvswitch', return_value=dvs):
                 with vcenter_api_client:
-                    vcenter_api_client.set_vlan_id(vcenter_port)
+                    vcenter_api_client.set_vlan_ids([vcenter_port])
 
     dvs.ReconfigureDVPort_Task.assert_called_once()
     spec = dvs.ReconfigureDVPort_Task.call_args[1].get('port', [None])[0]
@@ -19,6 +22,101 @@ def test_set_vlan_id(vcenter_api_client, dvs, vcenter_port):
     assert spec.setting.vlan.vlanId == 10
 
 
+def test_set_vlan_ids_batched(vcenter_api_client, dvs, vcenter_port, vcenter_port_2, dv_port, dv_port_4):
+    vcenter_port.vlan_id = 10
+    vcenter_port_2.vlan_id = 11
+    dvs.FetchDVPorts.return_value = [dv_port, dv_port_4]
+
+    with patch('cvm.clients.wait_for_task', return_value=('success', None)):
+        with patch('cvm.clients.SmartConnectNoSSL'):
+            with patch.object(VCenterAPIClient, '_get_dvswitch', return_value=dvs):
+                with vcenter_api_client:
+                    errors = vcenter_api_client.set_vlan_ids([vcenter_port, vcenter_port_2])
+
+    assert errors == {}
+    dvs.FetchDVPorts.assert_called_once()
+    assert dvs.FetchDVPorts.call_args[0][0].portKey == ['8', '9']
+    dvs.ReconfigureDVPort_Task.assert_called_once()
+    specs = dvs.ReconfigureDVPort_Task.call_args[1]['port']
+    assert [(spec.key, spec.setting.vlan.vlanId) for spec in specs] == [('8', 10), ('9', 11)]
+
+
+def test_set_vlan_ids_fault_attribution(vcenter_api_client, dvs, vcenter_port, vcenter_port_2, dv_port, dv_port_4):
+    vcenter_port.vlan_id = 10
+    vcenter_port_2.vlan_id = 11
+    dvs.FetchDVPorts.return_value = [dv_port, dv_port_4]
+    task_results = [('error', 'Port 9 fault'), ('success', None), ('error', 'Port 9 fault')]
+
+    with patch('cvm.clients.wait_for_task', side_effect=task_results):
+        with patch('cvm.clients.SmartConnectNoSSL'):
+            with patch.object(VCenterAPIClient, '_get_dvswitch', return_value=dvs):
+                with vcenter_api_client:
+                    errors = vcenter_api_client.set_vlan_ids([vcenter_port, vcenter_port_2])
+
+    assert errors == {'9': 'Port 9 fault'}
+    assert dvs.ReconfigureDVPort_Task.call_count == 3
+
+
+def test_fetch_ports_from_dvs_cache(vcenter_api_client, dvs, vcenter_port, vcenter_port_2, dv_port, dv_port_4):
+    dv_port.config.setting.vlan.inherited = True
+    dvs.FetchDVPorts.return_value = [dv_port, dv_port_4]
+
+    with patch('cvm.clients.wait_for_task', return_value=('success', None)):
+        with patch('cvm.clients.SmartConnectNoSSL'):
+            with patch.object(VCenterAPIClient, '_get_dvswitch', return_value=dvs):
+                with vcenter_api_client:
+                    vcenter_api_client.fetch_ports_from_dvs(['8', '9'])
+                    vcenter_api_client.get_vlan_id(vcenter_port)
+                    vcenter_api_client.get_vlan_id(vcenter_port_2)
+                    assert dvs.FetchDVPorts.call_count == 1
+
+                    vcenter_port.vlan_id = 10
+                    vcenter_api_client.set_vlan_ids([vcenter_port])
+                    assert dvs.FetchDVPorts.call_count == 1
+
+                    # Reconfigured port has a new configVersion, so it has to be read again
+                    vcenter_api_client.get_vlan_id(vcenter_port)
+                    assert dvs.FetchDVPorts.call_count == 2
+                    assert dvs.FetchDVPorts.call_args[0][0].portKey == ['8']
+
+
+def test_dv_port_fetched_during_reconfigure_not_cached(vcenter_api_client, dvs, vcenter_port, dv_port):
+    dvs.FetchDVPorts.return_value = [dv_port]
+
+    def wait_for_task(*_):
+        # Another greenlet reads the port while the task is running
+        vcenter_api_client.fetch_ports_from_dvs(['8'])
+        return 'success', None
+
+    with patch('cvm.clients.wait_for_task', side_effect=wait_for_task):
+        with patch('cvm.clients.SmartConnectNoSSL'):
+            with patch.object(VCenterAPIClient, '_get_dvswitch', return_value=dvs):
+                with vcenter_api_client:
+                    vcenter_port.vlan_id = 10
+                    vcenter_api_client.set_vlan_ids([vcenter_port])
+                    assert dvs.FetchDVPorts.call_count == 2
+
+                    vcenter_api_client.get_vlan_id(vcenter_port)
+                    assert dvs.FetchDVPorts.call_count == 3
+
+
+def test_dv_port_cache_dropped_after_failed_fetch(vcenter_api_client, dvs, vcenter_port, dv_port):
+    dvs.FetchDVPorts.return_value = [dv_port]
+
+    with patch('cvm.clients.SmartConnectNoSSL'):
+        with patch.object(VCenterAPIClient, '_get_dvswitch', return_value=dvs):
+            with vcenter_api_client:
+                vcenter_api_client.fetch_ports_from_dvs(['8'])
+                dvs.FetchDVPorts.side_effect = Exception()
+                with pytest.raises(Exception):
+                    vcenter_api_client.fetch_ports_from_dvs(['8'])
+                dvs.FetchDVPorts.side_effect = None
+
+                vcenter_api_client.get_vlan_id(vcenter_port)
+
+    assert dvs.FetchDVPorts.call_count == 3
+
+
 def test_enable_vlan_override(vcenter_api_client, portgroup):
     with patch('cvm.clients.wait_for_task'):
         with patch('cvm.clients.SmartConnectNoSSL'):
@@ -53,12 +151,12 @@ def test_get_vlan_id(vcenter_api_client, dvs, vcenter_port, dv_port):
     assert result == 10
 
 
-def test_restore_vlan_id(vcenter_api_client, dvs, vcenter_port):
-    with patch('cvm.clients.wait_for_task'):
+def test_restore_vlan_ids(vcenter_api_client, dvs, vcenter_port):
+    with patch('cvm.clients.wait_for_task', return_value=('success', None)):
         with patch('cvm.clients.SmartConnectNoSSL'):
             with patch.object(VCenterAPIClient, '_get_dvswitch', return_value=dvs):
                 with vcenter_api_client:
-                    vcenter_api_client.restore_vlan_id(vcenter_port)
+                    vcenter_api_client.restore_vlan_ids([vcenter_port])
 
     dvs.ReconfigureDVPort_Task.assert_called_once()
     spec = dvs.ReconfigureDVPort_Task.call_args[1].get('port', [None])[0]
@@ -127,3 +225,164 @@ def test_get_all_vms(vcenter_api_client, vmware_vm_1, vmware_vm_2):
                 vms = vcenter_api_client.get_all_vms()
 
     assert vms == [vmware_vm_1, vmware_vm_2]
+
+
+def make_update_set(version, *object_updates):
+    update_set = Mock(version=version, truncated=False)
+    update_set.filterSet = [Mock(objectSet=list(object_updates))]
+    return update_set
+
+
+def make_object_update(obj, kind='enter', **properties):
+    change_set = []
+    for name, value in properties.items():
+        change = Mock(val=value, op='assign')
+        change.configure_mock(name=name)
+        change_set.append(change)
+    return Mock(obj=obj, kind=kind, changeSet=change_set)
+
+
+def test_vm_inventory_cache(vcenter_api_client, vmware_vm_1):
+    with patch('cvm.clients.SmartConnectNoSSL') as si_mock:
+        content = si_mock.return_value.content
+        content.viewManager.CreateContainerView.return_value = Mock(spec=vim.view.ContainerView)
+        property_collector = content.propertyCollector.CreatePropertyCollector.return_value
+        property_collector.WaitForUpdatesEx.side_effect = [
+            make_update_set('1', make_object_update(vmware_vm_1, **{
+                'name': 'VM1', 'config.instanceUuid': 'vmware-vm-uuid-1'
+            })),
+            None,
+            None,
+        ]
+        with patch.object(VCenterAPIClient, '_get_datacenter'), patch.object(VCenterAPIClient, '_get_dvswitch'):
+            with vcenter_api_client:
+                assert vcenter_api_client._find_vm('config.instanceUuid', 'vmware-vm-uuid-1') is vmware_vm_1
+                assert vcenter_api_client._get_object([vim.VirtualMachine], 'VM1') is vmware_vm_1
+                assert vcenter_api_client._get_object([vim.VirtualMachine], 'VM2') is None
+
+    # The inventory is read once and then only asked for changes
+    content.viewManager.CreateContainerView.assert_called_once()
+    content.propertyCollector.CreatePropertyCollector.assert_called_once()
+    assert [call[0][0] for call in property_collector.WaitForUpdatesEx.call_args_list] == ['', '1', '1']
+
+
+def test_vm_inventory_incremental_update(vcenter_api_client, vmware_vm_1, vmware_vm_2):
+    with patch('cvm.clients.SmartConnectNoSSL') as si_mock:
+        content = si_mock.return_value.content
+        content.viewManager.CreateContainerView.return_value = Mock(spec=vim.view.ContainerView)
+        property_collector = content.propertyCollector.CreatePropertyCollector.return_value
+        property_collector.WaitForUpdatesEx.side_effect = [
+            make_update_set('1', make_object_update(vmware_vm_1, name='VM1')),
+            make_update_set('2', make_object_update(vmware_vm_1, kind='modify', name='VM1-renamed'),
+                            make_object_update(vmware_vm_2, name='VM1')),
+            make_update_set('3', make_object_update(vmware_vm_2, kind='leave')),
+        ]
+        with patch.object(VCenterAPIClient, '_get_datacenter'), patch.object(VCenterAPIClient, '_get_dvswitch'):
+            with vcenter_api_client:
+                assert vcenter_api_client._get_object([vim.VirtualMachine], 'VM1') is vmware_vm_1
+                assert vcenter_api_client._get_object([vim.VirtualMachine], 'VM1') is vmware_vm_2
+                assert vcenter_api_client._get_object([vim.VirtualMachine], 'VM1') is None
+
+
+def test_get_vm_by_uuid_from_search_index(vcenter_api_client, vmware_vm_1):
+    with patch('cvm.clients.SmartConnectNoSSL') as si_mock:
+        search_index = si_mock.return_value.content.searchIndex
+        search_index.FindByUuid.return_value = vmware_vm_1
+        with vcenter_api_client:
+            with patch.object(VCenterAPIClient, '_find_vm') as find_vm_mock:
+                assert vcenter_api_client._get_vm_by_uuid('vmware-vm-uuid-1') is vmware_vm_1
+
+    search_index.FindByUuid.assert_called_once_with(datacenter=None, uuid='vmware-vm-uuid-1',
+                                                    vmSearch=True, instanceUuid=True)
+    find_vm_mock.assert_not_called()
+
+
+def test_get_vm_by_uuid_fallback(vcenter_api_client, vmware_vm_1):
+    with patch('cvm.clients.SmartConnectNoSSL') as si_mock:
+        si_mock.return_value.content.searchIndex.FindByUuid.side_effect = Exception()
+        with vcenter_api_client:
+            with patch.object(VCenterAPIClient, '_find_vm', return_value=vmware_vm_1) as find_vm_mock:
+                assert vcenter_api_client._get_vm_by_uuid('vmware-vm-uuid-1') is vmware_vm_1
+
+    find_vm_mock.assert_called_once_with('config.instanceUuid', 'vmware-vm-uuid-1')
+
+
+def test_session_reused(vcenter_api_client):
+    with patch('cvm.clients.SmartConnectNoSSL') as si_mock, patch('cvm.clients.Disconnect') as disconnect_mock:
+        with patch.object(VCenterAPIClient, '_get_datacenter'), patch.object(VCenterAPIClient, '_get_dvswitch'):
+            with vcenter_api_client:
+                with vcenter_api_client:
+                    pass
+            with vcenter_api_client:
+                pass
+
+    si_mock.assert_called_once()
+    disconnect_mock.assert_not_called()
+
+
+def test_session_expired(vcenter_api_client):
+    with patch('cvm.clients.SmartConnectNoSSL') as si_mock, patch('cvm.clients.Disconnect'):
+        with patch.object(VCenterAPIClient, '_get_datacenter'), patch.object(VCenterAPIClient, '_get_dvswitch'):
+            with vcenter_api_client:
+                pass
+            si_mock.return_value.content.sessionManager.currentSession = None
+            vcenter_api_client._session_checked_at -= VCenterAPIClient.SESSION_CHECK_INTERVAL
+            with vcenter_api_client:
+                pass
+
+    assert si_mock.call_count == 2
+
+
+def test_relogin_on_not_authenticated(vcenter_api_client, vm_model, vmware_vm_1):
+    with patch('cvm.clients.SmartConnectNoSSL') as si_mock, patch('cvm.clients.Disconnect'):
+        with patch.object(VCenterAPIClient, '_get_datacenter'), patch.object(VCenterAPIClient, '_get_dvswitch'):
+            with vcenter_api_client:
+                with patch.object(VCenterAPIClient, '_get_vm_by_uuid',
+                                  side_effect=[vim.fault.NotAuthenticated(), vmware_vm_1]):
+                    assert not vcenter_api_client.can_remove_vm(vm_model.uuid)
+
+    assert si_mock.call_count == 2
+
+
+def test_relogin_once_for_concurrent_calls(vcenter_api_client, vm_model, vmware_vm_1):
+    with patch('cvm.clients.SmartConnectNoSSL', side_effect=lambda **_: Mock()) as si_mock, \
+            patch('cvm.clients.Disconnect'):
+        with patch.object(VCenterAPIClient, '_get_datacenter'), patch.object(VCenterAPIClient, '_get_dvswitch'):
+            with vcenter_api_client:
+                expired_si = vcenter_api_client._si
+
+                def get_vm_by_uuid(_):
+                    si = vcenter_api_client._si
+                    gevent.sleep(0)
+                    if si is expired_si:
+                        raise vim.fault.NotAuthenticated()
+                    return vmware_vm_1
+
+                with patch.object(VCenterAPIClient, '_get_vm_by_uuid', side_effect=get_vm_by_uuid):
+                    calls = [gevent.spawn(vcenter_api_client.can_remove_vm, vm_model.uuid) for _ in range(3)]
+                    gevent.joinall(calls, raise_error=True)
+
+    assert si_mock.call_count == 2
+
+
+def test_check_vms_removed(vcenter_api_client, vmware_vm_1, vmware_vm_2, host_1):
+    host_2 = Mock()
+    host_2.hardware.systemInfo.uuid = 'host_uuid_2'
+    vmware_vm_3 = Mock()
+    vms = {'VM-moved': [vmware_vm_1], 'VM-migrating': [vmware_vm_2], 'VM-on-host': [vmware_vm_3]}
+    vms_hosts = {vmware_vm_1: host_2, vmware_vm_2: None, vmware_vm_3: host_1}
+    with patch('cvm.clients.SmartConnectNoSSL'):
+        with patch.object(VCenterAPIClient, '_find_vms', side_effect=lambda _, name: vms.get(name, [])) as find_vms, \
+                patch.object(VCenterAPIClient, '_read_properties',
+                             side_effect=lambda vm, _: {'runtime.host': vms_hosts[vm]}) as read_properties, \
+                patch.object(VCenterAPIClient, '_read_all_properties') as read_all_properties:
+            with vcenter_api_client:
+                result = vcenter_api_client.check_vms_removed(
+                    ['VM-removed', 'VM-moved', 'VM-migrating', 'VM-on-host'], 'host_uuid_1')
+
+    assert result == {'VM-removed': True, 'VM-moved': False, 'VM-migrating': None, 'VM-on-host': None}
+    # Only the given VMs are looked up, instead of reading the whole inventory
+    read_all_properties.assert_not_called()
+    assert [call[0][1] for call in find_vms.call_args_list] == ['VM-removed', 'VM-moved', 'VM-migrating',
+                                                                'VM-on-host']
+    assert read_properties.call_count == 3
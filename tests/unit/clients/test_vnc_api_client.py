@@ -1,5 +1,8 @@
+from mock import Mock, patch
 from vnc_api.exceptions import NoIdError
 
+from cvm.clients import VncObjectCache
+
 
 def test_update_create_vm(vnc_api_client, vnc_lib, vnc_vm):
     vnc_api_client.update_vm(vnc_vm)
@@ -19,18 +22,23 @@ def test_update_vmi(vnc_api_client, vnc_lib, vnc_vmi_1):
     vnc_lib.virtual_machine_interface_read.return_value = vnc_vmi_1
     vnc_vmi_1.get_instance_ip_back_refs.return_value = [{'to': 'instance-ip-fqname'}]
 
-    vnc_api_client.update_vmi(vnc_vmi_1)
+    updated_vmi = vnc_api_client.update_vmi(vnc_vmi_1)
 
     vnc_lib.virtual_machine_interface_update.assert_called_once_with(vnc_vmi_1)
+    assert updated_vmi is vnc_vmi_1
+    assert vnc_api_client.request_counts['virtual_machine_interface_read'] == 1
+    assert vnc_api_client.request_counts['virtual_machine_interface_update'] == 1
 
 
 def test_update_create_new_vmi(vnc_api_client, vnc_lib, vnc_vmi_1):
     vnc_lib.virtual_machine_interface_read.side_effect = [NoIdError(None), vnc_vmi_1]
     vnc_vmi_1.get_instance_ip_back_refs.return_value = [{'to': ['instance-ip-fqname']}]
 
-    vnc_api_client.update_vmi(vnc_vmi_1)
+    created_vmi = vnc_api_client.update_vmi(vnc_vmi_1)
 
     vnc_lib.virtual_machine_interface_create.assert_called_once_with(vnc_vmi_1)
+    assert created_vmi is vnc_vmi_1
+    assert vnc_api_client.request_counts['virtual_machine_interface_read'] == 1
 
 
 def test_update_vmi_vn(vnc_api_client, vnc_lib, vnc_vmi_1, vnc_vmi_2, vnc_vn_2):
@@ -58,21 +66,50 @@ def test_dont_update_vmi_vn(vnc_api_client, vnc_lib, vnc_vmi_1, vnc_vn_1):
 
 
 def test_get_all_vms(vnc_api_client, vnc_lib, vnc_vm):
-    vnc_lib.virtual_machines_list.return_value = {
+    vnc_lib.virtual_machines_list.side_effect = [{
         u'virtual-machines': [{
             u'fq_name': [u'vm-uuid'],
             u'href': u'http://10.100.0.84:8082/virtual-machine/vm-uuid',
             u'uuid': u'vm-uuid',
         }]
-    }
-    vnc_lib.virtual_machine_read.return_value = vnc_vm
+    }, [vnc_vm]]
 
     all_vms = vnc_api_client.get_all_vms()
 
-    vnc_lib.virtual_machine_read.assert_called_once_with(id=u'vm-uuid')
+    vnc_lib.virtual_machines_list.assert_called_with(
+        obj_uuids=[u'vm-uuid'], detail=True, fields=['virtual_machine_interface_back_refs'])
+    vnc_lib.virtual_machine_read.assert_not_called()
     assert all_vms == [vnc_vm]
 
 
+def test_get_all_vm_uuids(vnc_api_client, vnc_lib):
+    vnc_lib.virtual_machines_list.return_value = {u'virtual-machines': [
+        {u'uuid': u'vm-uuid', u'id_perms': {u'creator': u'vcenter-manager'}},
+        {u'uuid': u'other-vm-uuid', u'id_perms': {u'creator': u'other-creator'}},
+    ]}
+
+    vm_uuids = vnc_api_client.get_all_vm_uuids()
+
+    assert vm_uuids == ['vm-uuid']
+    # Without details, a single request is enough
+    vnc_lib.virtual_machines_list.assert_called_once_with(fields=['id_perms'])
+    vnc_lib.virtual_machine_read.assert_not_called()
+
+
+def test_get_vmis_by_project(vnc_api_client, vnc_lib, vnc_vmi_1):
+    project = Mock(uuid='project-uuid')
+    vnc_lib.virtual_machine_interfaces_list.side_effect = [
+        {u'virtual-machine-interfaces': [{u'uuid': u'vmi-uuid-1'}]},
+        [vnc_vmi_1],
+    ]
+
+    vmis = vnc_api_client.get_vmis_by_project(project)
+
+    assert vmis == [vnc_vmi_1]
+    vnc_lib.virtual_machine_interfaces_list.assert_any_call(parent_id='project-uuid')
+    vnc_lib.virtual_machine_interface_read.assert_not_called()
+
+
 def test_get_vmi_uuids_by_vm_uuid(vnc_api_client, vnc_lib, vnc_vm):
     vnc_lib.virtual_machine_read.return_value = vnc_vm
 
@@ -88,3 +125,106 @@ def test_read_instance_ip(vnc_api_client, vnc_lib, vmi_model, vnc_vmi_1, instanc
     read_instance_ip = vnc_api_client._read_instance_ip(vmi_model)
 
     assert read_instance_ip == instance_ip
+
+
+def test_create_and_read_instance_ip_uses_given_vmi(vnc_api_client, vnc_lib, vmi_model, vnc_vmi_1,
+                                                   instance_ip, vnf_instance_ip):
+    vnc_lib.instance_ip_read.side_effect = [vnf_instance_ip, instance_ip]
+
+    read_instance_ip = vnc_api_client.create_and_read_instance_ip(vmi_model, vnc_vmi_1)
+
+    assert read_instance_ip == instance_ip
+    vnc_lib.virtual_machine_interface_read.assert_not_called()
+    vnc_lib.instance_ip_create.assert_not_called()
+
+
+def test_create_instance_ip_trusts_set_address(vnc_api_client, vnc_lib, vmi_model, vnc_vmi_1, instance_ip):
+    vnc_vmi_1.get_instance_ip_back_refs.return_value = None
+    vmi_model.vnc_instance_ip = instance_ip
+
+    created_instance_ip = vnc_api_client.create_and_read_instance_ip(vmi_model, vnc_vmi_1)
+
+    assert created_instance_ip is instance_ip
+    vnc_lib.instance_ip_create.assert_called_once_with(instance_ip)
+    assert sum(vnc_api_client.request_counts.values()) == 1
+
+
+def test_create_instance_ip_reads_allocated_address(vnc_api_client, vnc_lib, vmi_model, vnc_vmi_1, instance_ip):
+    vnc_vmi_1.get_instance_ip_back_refs.return_value = None
+    instance_ip.set_instance_ip_address(None)
+    vmi_model.vnc_instance_ip = instance_ip
+    allocated_instance_ip = Mock(instance_ip_address='10.10.10.2')
+    vnc_lib.instance_ip_read.return_value = allocated_instance_ip
+
+    created_instance_ip = vnc_api_client.create_and_read_instance_ip(vmi_model, vnc_vmi_1)
+
+    assert created_instance_ip is allocated_instance_ip
+    vnc_lib.instance_ip_read.assert_called_once_with(id=instance_ip.uuid)
+    assert vnc_api_client.request_counts['instance_ip_read'] == 1
+    assert vnc_api_client.request_counts['virtual_machine_interface_read'] == 0
+
+
+def test_read_vn_from_cache(vnc_api_client, vnc_lib, vnc_vn_1):
+    vnc_lib.virtual_network_read.return_value = vnc_vn_1
+
+    first_vn = vnc_api_client.read_vn(['domain', 'project', 'vnc-vn-1'])
+    second_vn = vnc_api_client.read_vn(['domain', 'project', 'vnc-vn-1'])
+
+    assert first_vn is second_vn is vnc_vn_1
+    assert vnc_api_client.request_counts['virtual_network_read'] == 1
+
+
+def test_vmi_write_invalidates_cache(vnc_api_client, vnc_lib, vnc_vm, vnc_vmi_1):
+    vnc_lib.virtual_machine_read.return_value = vnc_vm
+    vnc_lib.virtual_machine_interface_read.return_value = vnc_vmi_1
+    vnc_api_client.read_vm('vm-uuid')
+    vnc_api_client.read_vmi('vmi-uuid-1')
+
+    vnc_api_client.create_vmi(vnc_vmi_1)
+    vnc_api_client.read_vm('vm-uuid')
+    vnc_api_client.read_vmi('vmi-uuid-1')
+
+    assert vnc_api_client.request_counts['virtual_machine_read'] == 2
+    assert vnc_api_client.request_counts['virtual_machine_interface_read'] == 2
+
+
+def test_revision_check_drops_modified(vnc_api_client, vnc_lib, vnc_vm):
+    vnc_vm.id_perms.last_modified = '2018-01-01T00:00:00'
+    vnc_lib.virtual_machine_read.return_value = vnc_vm
+    vnc_api_client.read_vm('vm-uuid')
+    vnc_lib.virtual_machines_list.return_value = {
+        'virtual-machines': [{'uuid': 'vm-uuid', 'id_perms': {'last_modified': '2018-01-02T00:00:00'}}]
+    }
+
+    with patch('cvm.clients.VNC_CACHE_REVISION_CHECK_INTERVAL', 0):
+        vnc_api_client.read_vm('vm-uuid')
+
+    vnc_lib.virtual_machines_list.assert_called_once_with(obj_uuids=['vm-uuid'], fields=['id_perms'])
+    assert vnc_api_client.request_counts['virtual_machine_read'] == 2
+
+
+def test_vnc_object_cache_evicts_least_recently_used():
+    cache = VncObjectCache(max_size=2)
+    vm_1, vm_2, vm_3 = Mock(uuid='vm-1'), Mock(uuid='vm-2'), Mock(uuid='vm-3')
+    cache.put('virtual_machine', vm_1)
+    cache.put('virtual_machine', vm_2)
+    cache.get('virtual_machine', uuid='vm-1')
+
+    cache.put('virtual_machine', vm_3)
+
+    assert cache.get('virtual_machine', uuid='vm-1') is vm_1
+    assert cache.get('virtual_machine', uuid='vm-2') is None
+    assert cache.get('virtual_machine', uuid='vm-3') is vm_3
+
+
+def test_instance_ip_delete_invalidates_vmi(vnc_api_client, vnc_lib, vnc_vmi_1, instance_ip):
+    vnc_lib.virtual_machine_interface_read.return_value = vnc_vmi_1
+    vnc_lib.instance_ip_read.return_value = instance_ip
+    instance_ip.set_virtual_machine_interface_list([{'to': ['vmi-fq-name'], 'uuid': vnc_vmi_1.uuid}])
+    vnc_api_client.read_vmi(vnc_vmi_1.uuid)
+
+    vnc_api_client.delete_instance_ip(instance_ip.uuid)
+    vnc_api_client.read_vmi(vnc_vmi_1.uuid)
+
+    vnc_lib.instance_ip_delete.assert_called_once_with(id=instance_ip.uuid)
+    assert vnc_api_client.request_counts['virtual_machine_interface_read'] == 2
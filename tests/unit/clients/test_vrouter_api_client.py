@@ -0,0 +1,31 @@
+# pylint: disable=redefined-outer-name
+import pytest
+from mock import Mock, patch
+
+from cvm.clients import VRouterAPIClient
+
+
+@pytest.fixture()
+def session():
+    with patch('cvm.clients.requests.Session') as session_class:
+        yield session_class.return_value
+
+
+@pytest.fixture()
+def vrouter_api_client(session):  # pylint: disable=unused-argument
+    with patch('cvm.clients.ContrailVRouterApi'):
+        return VRouterAPIClient()
+
+
+def test_read_ports(vrouter_api_client, session):
+    responses = {
+        'http://localhost:9091/port/vmi-uuid-1': Mock(status_code=200, content='{"id": "vmi-uuid-1"}'),
+        'http://localhost:9091/port/vmi-uuid-2': Mock(status_code=404),
+    }
+    session.get.side_effect = responses.get
+
+    result = vrouter_api_client.read_ports(['vmi-uuid-1', 'vmi-uuid-2'])
+
+    assert result == {'vmi-uuid-1': {'id': 'vmi-uuid-1'}, 'vmi-uuid-2': None}
+    # Both ports are read over one pooled session
+    assert session.get.call_count == 2
@@ -1,3 +1,5 @@
+from mock import Mock
+
 from cvm.models import VirtualMachineInterfaceModel
 
 
@@ -98,3 +100,237 @@ def test_is_vlan_available_same_vmi(database, vmi_model):
     result = database.is_vlan_available(vmi_model, 1)
 
     assert result
+
+
+def test_get_vm_model_by_name(database, vm_model):
+    database.save(vm_model)
+
+    result = database.get_vm_model_by_name('VM1')
+
+    assert result is vm_model
+    assert database.get_vm_model_by_name('dummy-name') is None
+
+
+def test_rename_vm_model(database, vm_model):
+    database.save(vm_model)
+
+    vm_model.rename('VM1-renamed')
+    database.save(vm_model)
+
+    assert database.get_vm_model_by_name('VM1-renamed') is vm_model
+    assert database.get_vm_model_by_name('VM1') is None
+
+
+def test_delete_vm_model_by_name(database, vm_model):
+    database.save(vm_model)
+
+    database.delete_vm_model('vmware-vm-uuid-1')
+
+    assert database.get_vm_model_by_name('VM1') is None
+
+
+def test_get_vmi_models_by_vm_uuid(database, vmi_model, vmi_model_2):
+    database.save(vmi_model)
+    database.save(vmi_model_2)
+
+    result = database.get_vmi_models_by_vm_uuid('vmware-vm-uuid-1')
+
+    assert result == [vmi_model]
+    assert database.get_vmi_models_by_vm_uuid('dummy-uuid') == []
+
+
+def test_get_vmi_models_by_vn_uuid(database, vmi_model, vmi_model_2, vn_model_2):
+    database.save(vmi_model)
+    database.save(vmi_model_2)
+
+    vmi_model.vn_model = vn_model_2
+    database.save(vmi_model)
+
+    assert database.get_vmi_models_by_vn_uuid('vnc-vn-uuid-1') == []
+    result = database.get_vmi_models_by_vn_uuid('vnc-vn-uuid-2')
+    assert len(result) == 2
+    assert vmi_model in result
+    assert vmi_model_2 in result
+
+
+def test_delete_vmi_model_from_indexes(database, vmi_model):
+    database.save(vmi_model)
+
+    database.delete_vmi_model(vmi_model.uuid)
+
+    assert database.get_vmi_models_by_vm_uuid('vmware-vm-uuid-1') == []
+    assert database.get_vmi_models_by_vn_uuid('vnc-vn-uuid-1') == []
+    assert database.is_vlan_available(Mock(uuid='dummy-uuid'), 1)
+
+
+def test_update_vlan_id(database, vmi_model, vmi_model_2):
+    database.save(vmi_model)
+
+    database.update_vlan_id(vmi_model, 2)
+
+    assert vmi_model.vcenter_port.vlan_id == 2
+    assert database.is_vlan_available(vmi_model_2, 1)
+    assert not database.is_vlan_available(vmi_model_2, 2)
+
+
+def test_work_queue_deduplicates(database, vmi_model, vm_model):
+    new_vmi_model = vm_model.vmi_models[0]
+    assert new_vmi_model.uuid == vmi_model.uuid
+
+    database.vmis_to_update.append(vmi_model)
+    database.vmis_to_update.append(new_vmi_model)
+
+    assert list(database.vmis_to_update) == [new_vmi_model]
+
+
+def test_work_queue_keeps_order(database, vmi_model, vmi_model_2):
+    database.ports_to_update.append(vmi_model)
+    database.ports_to_update.append(vmi_model_2)
+    database.ports_to_update.append(vmi_model)
+
+    assert list(database.ports_to_update) == [vmi_model, vmi_model_2]
+
+
+def test_work_queue_remove(database, vmi_model):
+    database.ports_to_delete.extend([vmi_model.uuid, 'port-uuid'])
+
+    database.ports_to_delete.remove(vmi_model.uuid)
+    database.ports_to_delete.remove('dummy-uuid')
+
+    assert list(database.ports_to_delete) == ['port-uuid']
+    assert vmi_model.uuid not in database.ports_to_delete
+
+
+def test_publish_snapshot(database, vm_model, vn_model_1, vmi_model):
+    database.save(vm_model)
+    database.save(vn_model_1)
+    database.save(vmi_model)
+
+    database.publish_snapshot()
+    snapshot = database.snapshot
+
+    assert snapshot.get_vm_by_uuid('vmware-vm-uuid-1').name == vm_model.name
+    assert snapshot.get_vm_by_name(vm_model.name).uuid == 'vmware-vm-uuid-1'
+    assert snapshot.get_vn_by_uuid('vnc-vn-uuid-1').key == 'dvportgroup-1'
+    assert snapshot.get_vmis_by_vm_uuid('vmware-vm-uuid-1') == [snapshot.get_vmi_by_uuid(vmi_model.uuid)]
+    assert snapshot.get_vmis_by_vn_uuid('vnc-vn-uuid-1')[0].vlan_id == 1
+
+
+def test_snapshot_is_not_changed_by_database(database, vm_model):
+    database.save(vm_model)
+    database.publish_snapshot()
+    snapshot = database.snapshot
+
+    vm_model.rename('VM1-renamed')
+    database.delete_vm_model(vm_model.uuid)
+
+    assert snapshot.get_vm_by_uuid('vmware-vm-uuid-1').name == 'VM1'
+    assert database.snapshot is snapshot
+
+
+def test_snapshot_shares_unchanged_records(database, vm_model, vm_model_2):
+    database.save(vm_model)
+    database.save(vm_model_2)
+    database.publish_snapshot()
+    old_snapshot = database.snapshot
+
+    vm_model_2.rename('VM2-renamed')
+    database.save(vm_model_2)
+    database.publish_snapshot()
+
+    assert database.snapshot.get_vm_by_uuid(vm_model.uuid) is old_snapshot.get_vm_by_uuid(vm_model.uuid)
+    assert database.snapshot.get_vm_by_uuid(vm_model_2.uuid).name == 'VM2-renamed'
+    assert old_snapshot.get_vm_by_uuid(vm_model_2.uuid).name == 'VM2'
+
+
+def test_publish_without_changes(database, vm_model):
+    database.save(vm_model)
+    database.publish_snapshot()
+    snapshot = database.snapshot
+
+    database.publish_snapshot()
+
+    assert database.snapshot is snapshot
+
+
+def test_snapshot_updates_indexes(database, vm_model, vm_model_2, vn_model_1, vmi_model, vmi_model_2):
+    for model in (vm_model, vm_model_2, vn_model_1, vmi_model, vmi_model_2):
+        database.save(model)
+    database.publish_snapshot()
+    old_snapshot = database.snapshot
+
+    vm_model.rename('VM1-renamed')
+    vm_model.update_power_state('poweredOff')
+    database.save(vm_model)
+    database.update_vlan_id(vmi_model_2, 10)
+    database.delete_vm_model(vm_model_2.uuid)
+    database.publish_snapshot()
+    snapshot = database.snapshot
+
+    assert snapshot.get_vm_by_name('VM1') is None
+    assert snapshot.get_vm_by_name('VM1-renamed').uuid == vm_model.uuid
+    assert [vm.uuid for vm in snapshot.find_vms(power_state='poweredOff')[0]] == [vm_model.uuid]
+    assert [vm.uuid for vm in snapshot.find_vms()[0]] == [vm_model.uuid]
+    assert [vmi.uuid for vmi in snapshot.find_vmis(min_vlan_id=10)[0]] == [vmi_model_2.uuid]
+    assert snapshot.get_vmi_by_uuid(vmi_model.uuid).display_name == vmi_model.display_name
+    # The previous snapshot is left as it was
+    assert old_snapshot.get_vm_by_name('VM1').uuid == vm_model.uuid
+    assert len(old_snapshot.find_vms()[0]) == 2
+    assert old_snapshot.find_vmis(min_vlan_id=10)[0] == []
+
+
+def test_snapshot_pagination(database, vm_model, vm_model_2):
+    database.save(vm_model)
+    database.save(vm_model_2)
+    database.publish_snapshot()
+
+    first_page, next_cursor = database.snapshot.find_vms(limit=1)
+    second_page, last_cursor = database.snapshot.find_vms(start=next_cursor, limit=1)
+
+    assert [vm.uuid for vm in first_page] == ['vmware-vm-uuid-1']
+    assert next_cursor == 'vmware-vm-uuid-2'
+    assert [vm.uuid for vm in second_page] == ['vmware-vm-uuid-2']
+    assert last_cursor is None
+
+
+def test_snapshot_vm_filters(database, vm_model, vm_model_2, vn_model_1, vmi_model):
+    vm_model_2.update_power_state('poweredOff')
+    for model in (vm_model, vm_model_2, vn_model_1, vmi_model):
+        database.save(model)
+    database.publish_snapshot()
+    snapshot = database.snapshot
+
+    powered_off, _ = snapshot.find_vms(power_state='poweredOff')
+    in_vn, _ = snapshot.find_vms(vn_uuid='vnc-vn-uuid-1')
+    on_other_host, _ = snapshot.find_vms(host_uuid='dummy-host-uuid')
+
+    assert [vm.uuid for vm in powered_off] == ['vmware-vm-uuid-2']
+    assert [vm.uuid for vm in in_vn] == ['vmware-vm-uuid-1']
+    assert on_other_host == []
+
+
+def test_snapshot_vmi_filters(database, vm_model, vm_model_2, vmi_model, vmi_model_2):
+    vm_model_2.update_power_state('poweredOff')
+    for model in (vm_model, vm_model_2, vmi_model, vmi_model_2):
+        database.save(model)
+    database.publish_snapshot()
+    snapshot = database.snapshot
+
+    in_vlan_range, _ = snapshot.find_vmis(min_vlan_id=2, max_vlan_id=10)
+    powered_on, _ = snapshot.find_vmis(power_state='poweredOn', max_vlan_id=2)
+    in_vn, _ = snapshot.find_vmis(vn_uuid='vnc-vn-uuid-2')
+
+    assert in_vlan_range == [snapshot.get_vmi_by_uuid(vmi_model_2.uuid)]
+    assert powered_on == [snapshot.get_vmi_by_uuid(vmi_model.uuid)]
+    assert in_vn == [snapshot.get_vmi_by_uuid(vmi_model_2.uuid)]
+
+
+def test_work_queue_keeps_newer_item(database, vmi_model, vm_model):
+    new_vmi_model = vm_model.vmi_models[0]
+    database.vmis_to_update.append(vmi_model)
+
+    # A newer model is queued while the old one is being processed
+    database.vmis_to_update.append(new_vmi_model)
+    database.vmis_to_update.remove(vmi_model)
+
+    assert list(database.vmis_to_update) == [new_vmi_model]
@@ -0,0 +1,115 @@
+import gevent
+from mock import Mock
+from pyVmomi import vim, vmodl  # pylint: disable=no-name-in-module
+
+from tests.utils import wrap_into_update_set
+
+
+def test_coalesce_vm_updates(controller, vm_service, vn_service, vmi_service, vrouter_port_service,
+                             vlan_id_service, vmware_vm_1, vm_created_update, vm_reconfigured_update,
+                             vm_power_on_state_update):
+    controller.handle_updates([vm_created_update, vm_reconfigured_update, vm_power_on_state_update])
+
+    vm_service.update.assert_called_once_with(vmware_vm_1)
+    vm_service.update_vm_models_interfaces.assert_not_called()
+    vm_service.update_power_state.assert_called_once_with(vmware_vm_1, 'poweredOn')
+    vn_service.update_vns.assert_called_once()
+    vmi_service.update_vmis.assert_called_once()
+    vlan_id_service.update_vlan_ids.assert_called_once()
+    vlan_id_service.update_vcenter_vlans.assert_called_once()
+    vrouter_port_service.sync_ports.assert_called_once()
+    vrouter_port_service.sync_port_states.assert_called_once()
+
+
+def test_deduplicate_events(controller, vm_service, vn_service, vm_created_update):
+    controller.handle_updates([vm_created_update, vm_created_update])
+
+    vm_service.update.assert_called_once()
+    vn_service.update_vns.assert_called_once()
+
+
+def test_keep_last_property_value(controller, vm_service, vmware_vm_1,
+                                  vm_power_off_state_update, vm_power_on_state_update):
+    controller.handle_updates([vm_power_off_state_update, vm_power_on_state_update])
+
+    vm_service.update_power_state.assert_called_once_with(vmware_vm_1, 'poweredOn')
+
+
+def test_keep_arrival_order(controller, vm_service, vmware_vm_1, vm_created_update,
+                            vm_power_off_state_update, vm_power_on_state_update):
+    handled = []
+    vm_service.update.side_effect = lambda vmware_vm: handled.append('update')
+    vm_service.update_power_state.side_effect = lambda vmware_vm, power_state: handled.append(power_state)
+
+    controller.handle_updates([vm_power_off_state_update, vm_created_update, vm_created_update,
+                               vm_power_on_state_update])
+
+    # The duplicated event and the overwritten power state are dropped in place
+    assert handled == ['update', 'poweredOn']
+
+    handled[:] = []
+    controller.handle_updates([vm_power_on_state_update, vm_created_update])
+
+    assert handled == ['poweredOn', 'update']
+
+
+def test_no_sync_without_changes(controller, vn_service, vrouter_port_service, vm_created_update):
+    controller.handle_update(vm_created_update)
+    vn_service.update_vns.reset_mock()
+    vrouter_port_service.sync_ports.reset_mock()
+
+    controller.handle_updates([])
+
+    vn_service.update_vns.assert_not_called()
+    vrouter_port_service.sync_ports.assert_not_called()
+
+
+def test_handle_vms_concurrently(controller, vm_service, vmware_vm_1, vmware_vm_2,
+                                 vm_created_update, vm_power_on_state_update):
+    handled = []
+
+    def update(vmware_vm):
+        if vmware_vm is vmware_vm_1:
+            gevent.sleep(0.01)
+        handled.append(('update', vmware_vm))
+
+    vm_service.update.side_effect = update
+    vm_service.update_power_state.side_effect = lambda vmware_vm, _: handled.append(('power', vmware_vm))
+    vm_2_created_event = Mock(spec=vim.event.VmCreatedEvent())
+    vm_2_created_event.vm.vm = vmware_vm_2
+    vm_2_power_change = Mock(spec=vmodl.query.PropertyCollector.Change(), val='poweredOn')
+    vm_2_power_change.name = 'runtime.powerState'
+
+    controller.handle_updates([
+        vm_created_update,
+        wrap_into_update_set(event=vm_2_created_event),
+        vm_power_on_state_update,
+        wrap_into_update_set(change=vm_2_power_change, obj=vmware_vm_2),
+    ])
+
+    # A slow update of one VM does not hold back the other,
+    # but changes of each VM are still applied in order
+    assert handled == [
+        ('update', vmware_vm_2),
+        ('power', vmware_vm_2),
+        ('update', vmware_vm_1),
+        ('power', vmware_vm_1),
+    ]
+
+
+def test_change_without_vm_runs_alone(controller, vm_service, vm_created_update):
+    handled = []
+
+    def update(_):
+        gevent.sleep(0.01)
+        handled.append('update')
+
+    vm_service.update.side_effect = update
+    vm_service.remove_vm.side_effect = lambda _: handled.append('remove')
+    vm_removed_event = Mock(spec=vim.event.VmRemovedEvent())
+    vm_removed_event.vm.vm = None
+    vm_removed_event.vm.name = 'VM1'
+
+    controller.handle_updates([vm_created_update, wrap_into_update_set(event=vm_removed_event)])
+
+    assert handled == ['update', 'remove']
@@ -56,3 +56,15 @@ def test_double_free(vlan_id_pool):
     vlan_id_pool.reserve(5000)
 
     assert vlan_id_pool.is_available(5000) is False
+
+
+def test_free_all(vlan_id_pool):
+    vlan_ids = [vlan_id_pool.get_available() for _ in range(4096)]
+
+    for vlan_id in reversed(vlan_ids):
+        vlan_id_pool.free(vlan_id)
+
+    assert vlan_ids == list(range(4096))
+    assert all(vlan_id_pool.is_available(vlan_id) for vlan_id in range(4096))
+    # Freed IDs are handed out again in the order they were freed
+    assert vlan_id_pool.get_available() == 4095
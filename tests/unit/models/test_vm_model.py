@@ -4,7 +4,7 @@ from cvm.models import VirtualMachineModel
 def test_init(vmware_vm_1, vm_properties_1):
     vm_model = VirtualMachineModel(vmware_vm_1, vm_properties_1)
 
-    assert vmware_vm_1.config.hardware.device is vm_model.devices
+    assert [port.mac_address for port in vm_model.ports] == ['mac-address']
     assert vm_model.uuid == 'vmware-vm-uuid-1'
     assert vm_model.name == 'VM1'
     assert vm_model.is_powered_on
@@ -12,8 +12,6 @@ def test_init(vmware_vm_1, vm_properties_1):
 
 
 def test_to_vnc(vm_model):
-    vm_model.vrouter_uuid = 'vrouter_uuid'
-
     vnc_vm = vm_model.vnc_vm
 
     assert vnc_vm.name == vm_model.uuid
@@ -21,10 +19,21 @@ def test_to_vnc(vm_model):
     assert vnc_vm.fq_name == [vm_model.uuid]
 
 
+def test_vnc_vm_is_memoized(vm_model):
+    first_vnc_vm = vm_model.vnc_vm
+    second_vnc_vm = vm_model.vnc_vm
+    vm_model.rename('VM1-renamed')
+    renamed_vnc_vm = vm_model.vnc_vm
+
+    assert first_vnc_vm is second_vnc_vm
+    assert renamed_vnc_vm is not first_vnc_vm
+    assert renamed_vnc_vm.display_name == 'VM1-renamed'
+
+
 def test_update(vm_model, vmware_vm_1_updated, vm_properties_1_updated):
     vm_model.update(vmware_vm_1_updated, vm_properties_1_updated)
 
-    assert vm_model.devices == []
+    assert vm_model.ports == []
     assert vm_model.uuid == 'vmware-vm-uuid-1'
     assert vm_model.name == 'VM1-renamed'
     assert vm_model.is_powered_on is False
@@ -49,3 +58,11 @@ def test_update_tools_running(vm_model):
     assert check_1 is True
     assert check_2 is False
     assert vm_model.tools_running is False
+
+
+def test_is_changed(vm_model, vm_properties_1):
+    unchanged_properties = dict(vm_properties_1)
+    reconfigured_properties = dict(vm_properties_1, **{'config.changeVersion': '2018-01-02T00:00:00'})
+
+    assert vm_model.is_changed(unchanged_properties) is False
+    assert vm_model.is_changed(reconfigured_properties) is True
@@ -17,6 +17,20 @@ def test_to_vnc(vmi_model, project, security_group):
     assert vnc_vmi.get_id_perms() == ID_PERMS
 
 
+def test_vnc_vmi_is_memoized(vmi_model, project, security_group):
+    vmi_model.parent = project
+    vmi_model.security_group = security_group
+
+    first_vnc_vmi = vmi_model.vnc_vmi
+    second_vnc_vmi = vmi_model.vnc_vmi
+    vmi_model.vm_model.rename('VM1-renamed')
+    renamed_vnc_vmi = vmi_model.vnc_vmi
+
+    assert first_vnc_vmi is second_vnc_vmi
+    assert renamed_vnc_vmi is not first_vnc_vmi
+    assert renamed_vnc_vmi.display_name == vmi_model.display_name
+
+
 def test_construct_instance_ip(vmi_model, project, security_group):
     vmi_model.parent = project
     vmi_model.security_group = security_group
@@ -1,14 +1,15 @@
 # pylint: disable=redefined-outer-name
 import pytest
-from mock import Mock
+from gevent import GreenletExit
+from mock import Mock, patch
 
-from cvm.monitors import VMwareMonitor
+from cvm.monitors import VMwareMonitor, VmRemovalMonitor
 
 
 @pytest.fixture()
 def controller():
     ctrlr = Mock()
-    ctrlr.handle_update.side_effect = StopIteration
+    ctrlr.handle_updates.side_effect = StopIteration
     return ctrlr
 
 
@@ -16,6 +17,7 @@ def controller():
 def update_set_queue(vm_created_update):
     queue = Mock()
     queue.get.return_value = vm_created_update
+    queue.empty.return_value = True
     return queue
 
 
@@ -25,9 +27,37 @@ def monitor(controller, update_set_queue):
 
 
 def test_pass_update_to_controller(monitor, controller, vm_created_update):
-    try:
-        monitor.monitor()
-    except StopIteration:
-        pass
+    with patch('cvm.monitors.gevent.sleep'):
+        try:
+            monitor.monitor()
+        except StopIteration:
+            pass
 
-    controller.handle_update.assert_called_once_with(vm_created_update)
+    controller.handle_updates.assert_called_once_with([vm_created_update])
+
+
+def test_pass_queued_updates_in_batch(monitor, controller, update_set_queue,
+                                      vm_created_update, vm_power_on_state_update):
+    update_set_queue.empty.side_effect = [False, True]
+    update_set_queue.get_nowait.return_value = vm_power_on_state_update
+
+    with patch('cvm.monitors.gevent.sleep'):
+        try:
+            monitor.monitor()
+        except StopIteration:
+            pass
+
+    controller.handle_updates.assert_called_once_with([vm_created_update, vm_power_on_state_update])
+
+
+def test_confirm_vm_removals(controller):
+    controller.confirm_vm_removals.side_effect = [Exception(), GreenletExit]
+    monitor = VmRemovalMonitor(controller)
+
+    with patch('cvm.monitors.gevent.sleep'):
+        try:
+            monitor.monitor()
+        except GreenletExit:
+            pass
+
+    assert controller.confirm_vm_removals.call_count == 2
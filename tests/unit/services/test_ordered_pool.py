@@ -0,0 +1,42 @@
+import gevent
+
+from cvm.services import OrderedPool
+
+
+def make_job(events, name, delay=0):
+    def job():
+        events.append('start %s' % name)
+        gevent.sleep(delay)
+        events.append('end %s' % name)
+    return job
+
+
+def test_same_key_in_order():
+    events = []
+    pool = OrderedPool(10)
+
+    pool.spawn('vmi-1', make_job(events, 'update', delay=0.01))
+    pool.spawn('vmi-1', make_job(events, 'delete'))
+    pool.spawn('vmi-2', make_job(events, 'other'))
+    pool.join()
+
+    assert events.index('end update') < events.index('start delete')
+    assert events.index('end other') < events.index('end update')
+
+
+def test_bounded():
+    running = []
+    max_running = []
+
+    def job():
+        running.append(None)
+        max_running.append(len(running))
+        gevent.sleep(0.01)
+        running.pop()
+
+    pool = OrderedPool(2)
+    for i in range(6):
+        pool.spawn(i, job)
+    pool.join()
+
+    assert max(max_running) == 2
@@ -1,5 +1,8 @@
+import gevent
 import pytest
+from mock import Mock, patch
 
+from cvm.services import VlanIdService
 from tests.utils import reserve_vlan_ids
 
 
@@ -28,7 +31,7 @@ def test_retain_old_vlan_id(vlan_id_service, database, vcenter_api_client, vmi_m
 
     vlan_id_service.update_vlan_ids()
 
-    vcenter_api_client.set_vlan_id.assert_not_called()
+    vcenter_api_client.set_vlan_ids.assert_not_called()
     assert vmi_model.vcenter_port.vlan_id == 20
     assert not database.vlans_to_update
 
@@ -47,6 +50,42 @@ def test_current_not_available(vlan_id_service, database, vcenter_api_client,
     assert not database.vlans_to_update
 
 
+def test_set_vlan_ids_in_one_task(vlan_id_service, database, vcenter_api_client,
+                                  vlan_id_pool, vmi_model, vmi_model_2):
+    database.save(vmi_model)
+    database.save(vmi_model_2)
+    database.vlans_to_update.extend([vmi_model, vmi_model_2])
+    vmi_model.vcenter_port.vlan_success = False
+    vmi_model_2.vcenter_port.vlan_success = False
+    reserve_vlan_ids(vlan_id_pool, [0, 1])
+    vcenter_api_client.get_vlan_id.return_value = None
+
+    vlan_id_service.update_vlan_ids()
+
+    vcenter_api_client.fetch_ports_from_dvs.assert_called_once_with(
+        [vmi_model.vcenter_port.port_key, vmi_model_2.vcenter_port.port_key])
+    vcenter_api_client.set_vlan_ids.assert_called_once_with([vmi_model.vcenter_port, vmi_model_2.vcenter_port])
+    assert vmi_model.vcenter_port.vlan_success
+    assert vmi_model_2.vcenter_port.vlan_success
+
+
+def test_retry_failed_vlan_ids(vlan_id_service, database, vcenter_api_client,
+                               vlan_id_pool, vmi_model, vmi_model_2):
+    database.save(vmi_model)
+    database.save(vmi_model_2)
+    database.vlans_to_update.extend([vmi_model, vmi_model_2])
+    vmi_model.vcenter_port.vlan_success = False
+    vmi_model_2.vcenter_port.vlan_success = False
+    vcenter_api_client.get_vlan_id.return_value = None
+    vcenter_api_client.set_vlan_ids.side_effect = [{vmi_model_2.vcenter_port.port_key: 'fault'}, {}]
+
+    vlan_id_service.update_vlan_ids()
+
+    assert vcenter_api_client.set_vlan_ids.call_count == 2
+    assert vcenter_api_client.set_vlan_ids.call_args[0][0] == [vmi_model_2.vcenter_port]
+    assert vmi_model_2.vcenter_port.vlan_success
+
+
 def test_restore_vlan_id(vlan_id_service, database, vcenter_api_client,
                          vlan_id_pool, vmi_model):
     reserve_vlan_ids(vlan_id_pool, [20])
@@ -55,7 +94,54 @@ def test_restore_vlan_id(vlan_id_service, database, vcenter_api_client,
 
     vlan_id_service.update_vlan_ids()
 
-    vcenter_api_client.restore_vlan_id.assert_called_once_with(
-        vmi_model.vcenter_port)
+    vcenter_api_client.restore_vlan_ids.assert_called_once_with([vmi_model.vcenter_port])
     assert vlan_id_pool.is_available(20)
     assert not database.vlans_to_restore
+
+
+def test_wait_for_device_connected(vcenter_api_client, esxi_api_client, vlan_id_pool, database, vmi_model):
+    vlan_id_service = VlanIdService(vcenter_api_client, esxi_api_client, vlan_id_pool, database)
+    device_key = vmi_model.vcenter_port.device_key
+    disconnected = Mock(key=device_key)
+    disconnected.connectable.connected = False
+    connected = Mock(key=device_key)
+    connected.connectable.connected = True
+    esxi_api_client.watch_property.return_value = iter([[disconnected], [connected]])
+
+    assert vlan_id_service._wait_for_device_connected(vmi_model)
+
+    esxi_api_client.watch_property.return_value = iter([[]])
+    assert not vlan_id_service._wait_for_device_connected(vmi_model)
+
+
+def test_wait_for_proxy_host(vcenter_api_client, esxi_api_client, vlan_id_pool, database, vmi_model):
+    vlan_id_service = VlanIdService(vcenter_api_client, esxi_api_client, vlan_id_pool, database)
+    esxi_api_client.read_host_uuid.return_value = 'host-uuid-1'
+    dv_port = Mock()
+    dv_port.proxyHost.hardware.systemInfo.uuid = 'host-uuid-1'
+    # The first fetch fails before the port is read
+    vcenter_api_client.fetch_port_from_dvs.side_effect = [Exception(), dv_port]
+
+    with patch('cvm.services.gevent.sleep') as sleep_mock:
+        assert vlan_id_service._wait_for_proxy_host(vmi_model)
+
+    sleep_mock.assert_called_once()
+    assert vcenter_api_client.fetch_port_from_dvs.call_count == 2
+
+
+def test_set_vlan_ids_in_background(vcenter_api_client, esxi_api_client, vlan_id_pool, database, vmi_model):
+    vlan_id_service = VlanIdService(vcenter_api_client, esxi_api_client, vlan_id_pool, database,
+                                    wait_in_background=True)
+    vlan_id_service._wait_for_port = Mock(side_effect=lambda _: gevent.sleep(0.01) or True)
+    database.save(vmi_model)
+    database.vlans_to_update.append(vmi_model)
+    vmi_model.vcenter_port.vlan_success = False
+    vcenter_api_client.get_vlan_id.return_value = None
+
+    vlan_id_service.update_vlan_ids()
+    vlan_id_service.update_vcenter_vlans()
+
+    vcenter_api_client.set_vlan_ids.assert_not_called()
+    gevent.sleep(0.05)
+    vcenter_api_client.set_vlan_ids.assert_called_once_with([vmi_model.vcenter_port])
+    assert vmi_model.vcenter_port.vlan_success
@@ -0,0 +1,56 @@
+import pytest
+from mock import patch
+
+
+@pytest.fixture(autouse=True)
+def removed_vm(database, vm_model, vmi_model):
+    database.vms_to_confirm_removal.append(vm_model)
+    database.vmis_to_confirm_removal.append(vmi_model)
+
+
+def test_confirm_removal(vm_removal_service, database, esxi_api_client, vcenter_api_client, vnc_api_client,
+                         vm_model, vmi_model):
+    esxi_api_client.read_host_uuid.return_value = 'host_uuid_1'
+    vcenter_api_client.check_vms_removed.return_value = {'VM1': True}
+
+    vm_removal_service.confirm_removals(vm_removal_service.check_removals())
+
+    vcenter_api_client.check_vms_removed.assert_called_once_with(['VM1'], 'host_uuid_1')
+    vnc_api_client.delete_vm.assert_called_once_with(vm_model.uuid)
+    vnc_api_client.delete_vmi.assert_called_once_with(vmi_model.uuid)
+    assert vmi_model in database.vlans_to_restore
+    assert not database.vms_to_confirm_removal
+    assert not database.vmis_to_confirm_removal
+
+
+def test_vm_on_other_host(vm_removal_service, database, vnc_api_client):
+    """ We can't remove VMs from VNC if they exist on other host. """
+    vm_removal_service.confirm_removals({'VM1': False})
+
+    vnc_api_client.delete_vm.assert_not_called()
+    vnc_api_client.delete_vmi.assert_not_called()
+    assert not database.vlans_to_restore
+    assert not database.vms_to_confirm_removal
+    assert not database.vmis_to_confirm_removal
+
+
+def test_vm_back_on_host(vm_removal_service, database, vnc_api_client, vm_model):
+    database.save(vm_model)
+
+    vm_removal_service.confirm_removals({'VM1': True})
+
+    vnc_api_client.delete_vm.assert_not_called()
+    assert not database.vms_to_confirm_removal
+
+
+def test_removal_not_confirmed(vm_removal_service, database, vnc_api_client, vm_model):
+    with patch('cvm.services.time.time', return_value=0):
+        vm_removal_service.confirm_removals({})
+    assert vm_model in database.vms_to_confirm_removal
+
+    with patch('cvm.services.time.time', return_value=60):
+        vm_removal_service.confirm_removals({'VM1': None})
+
+    vnc_api_client.delete_vm.assert_not_called()
+    assert not database.vms_to_confirm_removal
+    assert not database.vmis_to_confirm_removal
@@ -2,6 +2,7 @@ from mock import Mock
 
 from cvm.constants import VM_UPDATE_FILTERS
 from cvm.models import VirtualMachineModel
+from cvm.services import VirtualMachineService
 from tests.utils import assert_vm_model_state, create_property_filter
 
 
@@ -31,6 +32,17 @@ def test_create_property_filter(vm_service, database, esxi_api_client, vmware_vm
     assert vm_model.property_filter == property_filter
 
 
+def test_shared_property_filter(esxi_api_client, vcenter_api_client, vnc_api_client, database, vmware_vm_1):
+    vm_service = VirtualMachineService(esxi_api_client, vcenter_api_client, vnc_api_client, database,
+                                       shared_property_filter=True)
+
+    vm_service.update(vmware_vm_1)
+    vm_service.remove_vm('VM1')
+
+    esxi_api_client.add_filter.assert_not_called()
+    assert database.get_vm_model_by_uuid('vmware-vm-uuid-1') is None
+
+
 def test_destroy_property_filter(vm_service, database):
     vm_model = Mock(spec=VirtualMachineModel)
     vm_model.configure_mock(name='VM')
@@ -53,13 +65,13 @@ def test_update_existing_vm(vm_service, database, vnc_api_client, vmware_vm_1, v
     vnc_api_client.update_vm.assert_not_called()
 
 
-def test_sync_vms(vm_service, database, esxi_api_client, vnc_api_client, vmware_vm_1):
-    esxi_api_client.get_all_vms.return_value = [vmware_vm_1]
+def test_sync_vms(vm_service, database, esxi_api_client, vnc_api_client, vmware_vm_1, vm_properties_1):
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, vm_properties_1)]
 
     vm_service.get_vms_from_vmware()
 
     vm_model = database.get_vm_model_by_uuid('vmware-vm-uuid-1')
-    assert vm_model.devices == vmware_vm_1.config.hardware.device
+    assert [port.mac_address for port in vm_model.ports] == ['mac-address']
     assert_vm_model_state(
         vm_model=vm_model,
         uuid='vmware-vm-uuid-1',
@@ -68,13 +80,17 @@ def test_sync_vms(vm_service, database, esxi_api_client, vnc_api_client, vmware_
     vnc_api_client.update_vm.assert_called_once()
 
 
-def test_sync_no_uuid_vm(vm_service, database, esxi_api_client, vnc_api_client, vmware_vm_1, vmware_vm_no_uuid):
-    esxi_api_client.get_all_vms.return_value = [vmware_vm_1, vmware_vm_no_uuid]
+def test_sync_no_uuid_vm(vm_service, database, esxi_api_client, vnc_api_client, vmware_vm_1, vmware_vm_no_uuid,
+                         vm_properties_1):
+    esxi_api_client.read_all_vms_properties.return_value = [
+        (vmware_vm_1, vm_properties_1),
+        (vmware_vm_no_uuid, {'name': 'VM1'}),
+    ]
 
     vm_service.get_vms_from_vmware()
 
     vm_model = database.get_vm_model_by_uuid('vmware-vm-uuid-1')
-    assert vm_model.devices == vmware_vm_1.config.hardware.device
+    assert [port.mac_address for port in vm_model.ports] == ['mac-address']
     assert_vm_model_state(
         vm_model=vm_model,
         uuid='vmware-vm-uuid-1',
@@ -85,7 +101,7 @@ def test_sync_no_uuid_vm(vm_service, database, esxi_api_client, vnc_api_client,
 
 def test_sync_no_vms(vm_service, database, esxi_api_client, vnc_api_client):
     """ Syncing when there's no VMware VMs doesn't update anything. """
-    esxi_api_client.get_all_vms.return_value = []
+    esxi_api_client.read_all_vms_properties.return_value = []
     vnc_api_client.get_all_vms.return_value = []
 
     vm_service.get_vms_from_vmware()
@@ -94,6 +110,19 @@ def test_sync_no_vms(vm_service, database, esxi_api_client, vnc_api_client):
     vnc_api_client.update_vm.assert_not_called()
 
 
+def test_sync_vms_with_prefetched_devices(vm_service, database, esxi_api_client, vmware_vm_1, vm_properties_1):
+    devices = vmware_vm_1.config.hardware.device
+    vmware_vm_1.config.hardware.device = []
+    vm_properties_1['config.hardware.device'] = devices
+    esxi_api_client.read_all_vms_properties.return_value = [(vmware_vm_1, vm_properties_1)]
+
+    vm_service.get_vms_from_vmware()
+
+    vm_model = database.get_vm_model_by_uuid('vmware-vm-uuid-1')
+    assert [port.mac_address for port in vm_model.ports] == ['mac-address']
+    esxi_api_client.read_vm_properties.assert_not_called()
+
+
 def test_delete_unused_vms(vm_service, vnc_api_client, vcenter_api_client):
     vcenter_api_client.get_all_vms.return_value = []
     vnc_api_client.get_all_vm_uuids.side_effect = [['vnc-vm-uuid'], []]
@@ -105,29 +134,22 @@ def test_delete_unused_vms(vm_service, vnc_api_client, vcenter_api_client):
 
 
 def test_remove_vm(vm_service, database, vcenter_api_client, vnc_api_client, vm_model):
+    """ VM is deleted from VNC only after its removal is confirmed by vCenter. """
     database.save(vm_model)
-    vcenter_api_client.is_vm_removed.return_value = True
 
     vm_service.remove_vm('VM1')
 
     assert vm_model not in database.get_all_vm_models()
-    vnc_api_client.delete_vm.assert_called_once_with('vmware-vm-uuid-1')
+    assert vm_model in database.vms_to_confirm_removal
+    vcenter_api_client.check_vms_removed.assert_not_called()
+    vnc_api_client.delete_vm.assert_not_called()
 
 
-def test_remove_no_vm(vm_service, vnc_api_client):
+def test_remove_no_vm(vm_service, database, vnc_api_client):
     """ Remove VM should do nothing when VM doesn't exist in database. """
     vm_service.remove_vm('VM')
 
-    vnc_api_client.delete_vm.assert_not_called()
-
-
-def test_remove_other_host(vm_service, database, vcenter_api_client, vnc_api_client, vm_model):
-    """ We can't remove VMs from VNC if they exist on other host. """
-    database.save(vm_model)
-    vcenter_api_client.is_vm_removed.return_value = False
-
-    vm_service.remove_vm('VM1')
-
+    assert not database.vms_to_confirm_removal
     vnc_api_client.delete_vm.assert_not_called()
 
 
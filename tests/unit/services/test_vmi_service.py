@@ -23,7 +23,7 @@ def test_no_update_for_no_dpgs(vmi_service, database, vnc_api_client, vm_model):
     vmi_service.update_vmis()
 
     assert database.get_all_vmi_models() == []
-    assert database.ports_to_update == []
+    assert not database.ports_to_update
     vnc_api_client.update_vmi.assert_not_called()
 
 
@@ -85,31 +85,17 @@ def test_remove_vmis_for_vm_model(vmi_service, database, vcenter_api_client, vnc
                                   vlan_id_pool):
     database.save(vm_model)
     database.save(vmi_model)
-    vcenter_api_client.is_vm_removed.return_value = True
-
-    vmi_service.remove_vmis_for_vm_model(vm_model.name)
-
-    assert vmi_model not in database.get_all_vmi_models()
-    assert vmi_model.uuid in database.ports_to_delete
-    assert vmi_model in database.vlans_to_restore
-    vnc_api_client.delete_vmi.assert_called_once_with(vmi_model.uuid)
-    assert vlan_id_pool.is_available(vmi_model.vcenter_port.vlan_id)
-
-
-def test_remove_vmis_other_host(vmi_service, database, vcenter_api_client, vnc_api_client, vmi_model, vm_model,
-                                vlan_id_pool):
-    """ We can't delete VMIs for VM on other hosts"""
-    database.save(vm_model)
-    database.save(vmi_model)
-    vcenter_api_client.is_vm_removed.return_value = False
+    vlan_id_pool.reserve(vmi_model.vcenter_port.vlan_id)
 
     vmi_service.remove_vmis_for_vm_model(vm_model.name)
 
     assert vmi_model not in database.get_all_vmi_models()
     assert vmi_model.uuid in database.ports_to_delete
+    assert vmi_model in database.vmis_to_confirm_removal
+    # The VLAN ID is freed only once the removal is confirmed
+    assert not vlan_id_pool.is_available(vmi_model.vcenter_port.vlan_id)
+    vcenter_api_client.check_vms_removed.assert_not_called()
     vnc_api_client.delete_vmi.assert_not_called()
-    vcenter_api_client.restore_vlan_id.assert_not_called()
-    assert vlan_id_pool.is_available(vmi_model.vcenter_port.vlan_id)
 
 
 def test_remove_vmis_no_vm_model(vmi_service, vnc_api_client):
@@ -155,4 +141,63 @@ def test_update_instance_ip(vmi_service, database, vnc_api_client, vmi_model):
     vmi_service.update_vmis()
 
     assert vmi_model.vnc_instance_ip is not None
-    vnc_api_client.create_and_read_instance_ip.assert_called_once_with(vmi_model)
+    vnc_api_client.create_and_read_instance_ip.assert_called_once_with(
+        vmi_model, vnc_api_client.update_vmi.return_value)
+
+
+def test_skip_applied_vmi(vmi_service, database, vnc_api_client, vmi_model):
+    database.save(vmi_model)
+    database.save(vmi_model.vm_model)
+    database.save(vmi_model.vn_model)
+    vmi_model.mark_applied()
+    database.vmis_to_update.append(vmi_model)
+
+    vmi_service.update_vmis()
+
+    vnc_api_client.update_vmi.assert_not_called()
+    assert not database.vmis_to_update
+    assert not database.ports_to_update
+    assert vmi_service.update_counts['skipped'] == 1
+
+
+def test_retry_failed_instance_ip(vmi_service, database, vnc_api_client, vmi_model):
+    database.save(vmi_model)
+    database.save(vmi_model.vm_model)
+    database.save(vmi_model.vn_model)
+    vnc_api_client.create_and_read_instance_ip.side_effect = None
+    vnc_api_client.create_and_read_instance_ip.return_value = None
+    database.vmis_to_update.append(vmi_model)
+
+    vmi_service.update_vmis()
+
+    assert list(database.vmis_to_update) == [vmi_model]
+    assert vmi_service.update_counts['updated'] == 0
+
+
+def test_update_changed_vmi(vmi_service, database, vnc_api_client, vmi_model):
+    database.save(vmi_model)
+    database.save(vmi_model.vm_model)
+    database.save(vmi_model.vn_model)
+    vmi_model.mark_applied()
+    vmi_model.update_ip_address('192.168.100.6')
+    database.vmis_to_update.append(vmi_model)
+
+    vmi_service.update_vmis()
+
+    vnc_api_client.update_vmi.assert_called_once()
+    assert vmi_service.update_counts['updated'] == 1
+
+
+def test_update_vmi_with_failed_vlan_id(vmi_service, database, vnc_api_client, vmi_model):
+    database.save(vmi_model)
+    database.save(vmi_model.vm_model)
+    database.save(vmi_model.vn_model)
+    vmi_model.mark_applied()
+    # Setting the VLAN ID in vCenter failed after the VMI was applied
+    vmi_model.vcenter_port.vlan_success = False
+    database.vmis_to_update.append(vmi_model)
+
+    vmi_service.update_vmis()
+
+    assert list(database.vlans_to_update) == [vmi_model]
+    assert vmi_service.update_counts['updated'] == 1
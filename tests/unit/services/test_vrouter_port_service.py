@@ -10,6 +10,28 @@ def test_create_port(vrouter_port_service, database, vrouter_api_client, vmi_mod
     vrouter_api_client.delete_port.assert_not_called()
     vrouter_api_client.add_port.assert_called_once_with(vmi_model)
     vrouter_api_client.enable_port.assert_called_once_with(vmi_model.uuid)
+    assert vmi_model.is_applied()
+
+
+@patch('cvm.services.VRouterPortService._port_needs_an_update', Mock(return_value=True))
+def test_failed_port_not_applied(vrouter_port_service, database, vrouter_api_client, vmi_model):
+    vrouter_api_client.add_port.return_value = False
+    database.ports_to_update.append(vmi_model)
+
+    vrouter_port_service.sync_ports()
+
+    assert not vmi_model.is_applied()
+
+
+@patch('cvm.services.VRouterPortService._port_needs_an_update', Mock(return_value=True))
+def test_pending_vnc_writes_not_applied(vrouter_port_service, database, vrouter_api_client, vmi_model):
+    database.vmis_to_update.append(vmi_model)
+    database.ports_to_update.append(vmi_model)
+
+    vrouter_port_service.sync_ports()
+
+    vrouter_api_client.add_port.assert_called_once_with(vmi_model)
+    assert not vmi_model.is_applied()
 
 
 @patch('cvm.services.VRouterPortService._port_needs_an_update', Mock(return_value=False))
@@ -21,7 +43,7 @@ def test_no_update(vrouter_port_service, database, vrouter_api_client, vmi_model
 
     vrouter_api_client.delete_port.assert_not_called()
     vrouter_api_client.add_port.assert_not_called()
-    assert database.ports_to_update == []
+    assert not database.ports_to_update
 
 
 def test_delete_port(vrouter_port_service, database, vrouter_api_client):
@@ -34,7 +56,7 @@ def test_delete_port(vrouter_port_service, database, vrouter_api_client):
 
 @patch('cvm.services.VRouterPortService._port_needs_an_update', Mock(return_value=False))
 def test_enable_port(vrouter_port_service, database, vrouter_api_client, vmi_model):
-    vmi_model.vm_model.update_power_state = True
+    vmi_model.vm_model.update_power_state('poweredOn')
     database.ports_to_update.append(vmi_model)
 
     vrouter_port_service.sync_ports()
@@ -45,10 +67,11 @@ def test_enable_port(vrouter_port_service, database, vrouter_api_client, vmi_mod
 
 @patch('cvm.services.VRouterPortService._port_needs_an_update', Mock(return_value=False))
 def test_disable_port(vrouter_port_service, database, vrouter_api_client, vmi_model):
-    vmi_model.vm_model.update_power_state = False
+    vmi_model.vm_model.update_power_state('poweredOff')
+    vrouter_api_client.read_port.return_value = {'id': vmi_model.uuid}
     database.ports_to_update.append(vmi_model)
 
     vrouter_port_service.sync_ports()
 
-    vrouter_api_client.enable_port.assert_called_once_with(vmi_model.uuid)
-    vrouter_api_client.disable_port.assert_not_called()
+    vrouter_api_client.disable_port.assert_called_once_with(vmi_model.uuid)
+    vrouter_api_client.enable_port.assert_not_called()
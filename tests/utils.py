@@ -1,4 +1,6 @@
 from builtins import next
+import timeit
+
 from mock import Mock
 from pyVmomi import vim, vmodl  # pylint: disable=no-name-in-module
 
@@ -26,7 +28,7 @@ def reserve_vlan_ids(vlan_id_pool, vlan_ids):
         vlan_id_pool.reserve(vlan_id)
 
 
-def assign_ip_to_instance_ip(vmi_model):
+def assign_ip_to_instance_ip(vmi_model, vnc_vmi=None):  # pylint: disable=unused-argument
     vmi_model.vnc_instance_ip.set_instance_ip_address('192.168.100.5')
     return vmi_model.vnc_instance_ip
 
@@ -113,3 +115,8 @@ def assert_vnc_vm_state(vnc_vm, uuid=None, name=None, display_name=None, owner=N
         assert vnc_vm.display_name == display_name
     if owner is not None:
         assert vnc_vm.get_perms2().get_owner() == owner
+
+
+def measure(func, number=1000, repeat=5):
+    """ Returns the best time (in seconds) of `number` calls of `func`. """
+    return min(timeit.repeat(func, number=number, repeat=repeat))